@@ -0,0 +1,394 @@
+"""emulates the Hack computer running a .hack program
+"""
+from assembler import HackProgram
+from typing import Callable, Dict, List, Optional, Tuple
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+RAM_SIZE = 1 << 15
+ADDRESS_MASK = RAM_SIZE - 1
+SCREEN = 16384
+KBD = 24576
+
+
+def _alu(zx: int, nx: int, zy: int, ny: int, f: int, no: int) -> Callable[[int, int], int]:
+    """general ALU as specified in the Hack hardware. x=D, y=A or M
+    """
+    def compute(x: int, y: int) -> int:
+        if zx:
+            x = 0
+        if nx:
+            x = ~x & WORD_MASK
+        if zy:
+            y = 0
+        if ny:
+            y = ~y & WORD_MASK
+        out = (x + y) & WORD_MASK if f else x & y
+        if no:
+            out = ~out & WORD_MASK
+        return out
+    return compute
+
+
+class ALU(object):
+    """maps c-bits (zx nx zy ny f no) of a C-instruction to a function (x, y) -> out
+    """
+
+    # comps defined in the Hack assembly language
+    STANDARD = {
+        0b101010: lambda x, y: 0,
+        0b111111: lambda x, y: 1,
+        0b111010: lambda x, y: WORD_MASK,
+        0b001100: lambda x, y: x,
+        0b110000: lambda x, y: y,
+        0b001101: lambda x, y: ~x & WORD_MASK,
+        0b110001: lambda x, y: ~y & WORD_MASK,
+        0b001111: lambda x, y: -x & WORD_MASK,
+        0b110011: lambda x, y: -y & WORD_MASK,
+        0b011111: lambda x, y: (x + 1) & WORD_MASK,
+        0b110111: lambda x, y: (y + 1) & WORD_MASK,
+        0b001110: lambda x, y: (x - 1) & WORD_MASK,
+        0b110010: lambda x, y: (y - 1) & WORD_MASK,
+        0b000010: lambda x, y: (x + y) & WORD_MASK,
+        0b010011: lambda x, y: (x - y) & WORD_MASK,
+        0b000111: lambda x, y: (y - x) & WORD_MASK,
+        0b000000: lambda x, y: x & y,
+        0b010101: lambda x, y: x | y,
+    }
+
+    @classmethod
+    def get(cls, cbits: int) -> Callable[[int, int], int]:
+        func = cls.STANDARD.get(cbits)
+        if func is None:
+            bits = [(cbits >> i) & 1 for i in range(5, -1, -1)]
+            func = _alu(*bits)
+        return func
+
+
+class DecodedProgram(object):
+    """ROM decoded once into parallel lists indexed by the address.
+
+    comp[i]  ... None for A-instruction, otherwise ALU function (D, A/M) -> out
+    value[i] ... value to load for A-instruction
+    use_m[i] ... True if the ALU reads M instead of A
+    dest[i]  ... destination bits: 4=A, 2=D, 1=M
+    jump[i]  ... jump bits: 4=out<0, 2=out=0, 1=out>0
+    """
+
+    def __init__(self, program: HackProgram):
+        n = len(program)
+        self.comp: List[Optional[Callable[[int, int], int]]] = [None] * n
+        self.value: List[int] = [0] * n
+        self.use_m: List[bool] = [False] * n
+        self.dest: List[int] = [0] * n
+        self.jump: List[int] = [0] * n
+        for address, word in enumerate(program.words):
+            if not word & SIGN_BIT:
+                self.value[address] = word
+                continue
+            self.comp[address] = ALU.get((word >> 6) & 0b111111)
+            self.use_m[address] = bool(word & 0x1000)
+            self.dest[address] = (word >> 3) & 0b111
+            self.jump[address] = word & 0b111
+
+    def __len__(self):
+        return len(self.comp)
+
+    def is_halt(self, address: int) -> bool:
+        """(END) @END 0;JMP - an infinite loop which is the end of a program
+        """
+        return (address + 1 < len(self)
+                and self.comp[address] is None
+                and self.value[address] == address
+                and self.comp[address + 1] is not None
+                and self.dest[address + 1] == 0
+                and self.jump[address + 1] == 0b111)
+
+
+class CPUEmulator(object):
+    """Hack CPU with 32K words of RAM. All the values are unsigned 16-bit integers
+    and memory is addressed by the lower 15 bits of A.
+
+    Example:
+    cpu = CPUEmulator(HackProgram.load("Prog.hack"))
+    cpu.run(max_cycles=1000000)
+    print(cpu.cycles, cpu.ram[0])
+    """
+
+    def __init__(self, program: HackProgram):
+        self.program = program
+        self.decoded = DecodedProgram(program)
+        self.ram: List[int] = [0] * RAM_SIZE
+        self.reset()
+
+    def reset(self):
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+
+    def run(self, max_cycles: int = 1 << 62) -> int:
+        """execute until the program halts, PC goes out of ROM or max_cycles
+        instructions are executed. returns the number of executed instructions.
+        """
+        decoded = self.decoded
+        comp = decoded.comp
+        value = decoded.value
+        use_m = decoded.use_m
+        dest = decoded.dest
+        jump = decoded.jump
+        size = len(decoded)
+        ram = self.ram
+        pc, a, d = self.pc, self.a, self.d
+
+        n = 0
+        while n < max_cycles and 0 <= pc < size:
+            n += 1
+            alu = comp[pc]
+            if alu is None:
+                a = value[pc]
+                pc += 1
+                continue
+            out = alu(d, ram[a & ADDRESS_MASK] if use_m[pc] else a)
+            target = a
+            dd = dest[pc]
+            if dd:
+                if dd & 1:
+                    ram[target & ADDRESS_MASK] = out
+                if dd & 2:
+                    d = out
+                if dd & 4:
+                    a = out
+            jj = jump[pc]
+            if jj and jj & (4 if out & SIGN_BIT else 2 if out == 0 else 1):
+                if target == pc - 1 and jj == 0b111 and decoded.is_halt(target):
+                    self.halted = True
+                    pc = target
+                    break
+                pc = target
+            else:
+                pc += 1
+
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += n
+        if not 0 <= pc < size:
+            self.halted = True
+        return n
+
+
+class BlockCompiler(object):
+    """translates a basic block of the ROM into a Python function
+
+        def block(ram, a, d):
+            ...
+            return pc, a, d, n
+
+    where n is the number of executed instructions.
+
+    A basic block ends at a jump instruction or just before a leader (an address
+    loaded by '@label' right before a jump). A jump into the middle of a block
+    simply starts another block at that address. The value of A is
+    tracked while it is known at compile time, so that e.g. '@SP M=M+1' becomes
+    'ram[0] = (ram[0] + 1) & 65535'.
+    """
+
+    # c-bits -> expression of x (D) and y (A or M)
+    EXPRESSIONS = {
+        0b101010: "0",
+        0b111111: "1",
+        0b111010: "65535",
+        0b001100: "{x}",
+        0b110000: "{y}",
+        0b001101: "(~{x} & 65535)",
+        0b110001: "(~{y} & 65535)",
+        0b001111: "(-{x} & 65535)",
+        0b110011: "(-{y} & 65535)",
+        0b011111: "(({x} + 1) & 65535)",
+        0b110111: "(({y} + 1) & 65535)",
+        0b001110: "(({x} - 1) & 65535)",
+        0b110010: "(({y} - 1) & 65535)",
+        0b000010: "(({x} + {y}) & 65535)",
+        0b010011: "(({x} - {y}) & 65535)",
+        0b000111: "(({y} - {x}) & 65535)",
+        0b000000: "({x} & {y})",
+        0b010101: "({x} | {y})",
+    }
+
+    # jump bits -> condition of out (unsigned 16-bit)
+    CONDITIONS = {
+        0b001: "0 < {t} < 32768",
+        0b010: "{t} == 0",
+        0b011: "{t} < 32768",
+        0b100: "{t} >= 32768",
+        0b101: "{t} != 0",
+        0b110: "{t} == 0 or {t} >= 32768",
+    }
+
+    def __init__(self, program: HackProgram):
+        self.program = program
+        self.size = len(program)
+        # targets of '@label' followed by a jump. other entry points such as
+        # return addresses are compiled as separate blocks on demand.
+        self.leaders = set()
+        words = program.words
+        for address in range(self.size - 1):
+            word, nxt = words[address], words[address + 1]
+            if not word & SIGN_BIT and nxt & SIGN_BIT and nxt & 0b111:
+                self.leaders.add(word)
+
+    def block_end(self, start: int) -> int:
+        """returns the address next to the last instruction of the block
+        """
+        words = self.program.words
+        address = start
+        while address < self.size:
+            word = words[address]
+            address += 1
+            # jump instruction
+            if word & SIGN_BIT and word & 0b111:
+                break
+            if address in self.leaders:
+                break
+        return address
+
+    def source(self, start: int) -> str:
+        """generate Python source code of the block starting at 'start'
+        """
+        words = self.program.words
+        end = self.block_end(start)
+        lines = [f"def block_{start}(ram, a, d):"]
+        known_a: Optional[int] = None  # value of A if known at compile time
+
+        for address in range(start, end):
+            word = words[address]
+            if not word & SIGN_BIT:
+                known_a = word
+                continue
+
+            cbits = (word >> 6) & 0b111111
+            dd = (word >> 3) & 0b111
+            jj = word & 0b111
+            a = "a" if known_a is None else str(known_a)
+            m = "ram[a & 32767]" if known_a is None else f"ram[{known_a & ADDRESS_MASK}]"
+            y = m if word & 0x1000 else a
+            if cbits in self.EXPRESSIONS:
+                expr = self.EXPRESSIONS[cbits].format(x="d", y=y)
+            else:
+                expr = f"alu_{cbits}(d, {y})"
+
+            if jj and dd & 4 and known_a is None:
+                # jump to A before the update
+                lines.append("    target = a")
+                a = "target"
+            targets = []
+            if dd & 1:
+                targets.append(m)
+            if dd & 2:
+                targets.append("d")
+            if dd & 4:
+                targets.append("a")
+                known_a = None
+            if jj:
+                targets.append("t")
+            if targets:
+                lines.append(f"    {' = '.join(targets)} = {expr}")
+
+            if jj == 0b111:
+                lines.append(f"    return {a}, {self._a(known_a)}, d, {address - start + 1}")
+                return "\n".join(lines) + "\n"
+            elif jj:
+                cond = self.CONDITIONS[jj].format(t="t")
+                lines.append(f"    if {cond}:")
+                lines.append(f"        return {a}, {self._a(known_a)}, d, {address - start + 1}")
+
+        lines.append(f"    return {end}, {self._a(known_a)}, d, {end - start}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _a(known_a: Optional[int]) -> str:
+        return "a" if known_a is None else str(known_a)
+
+    def compile(self, start: int) -> Tuple[Callable, int]:
+        """returns the function of the block and the number of instructions
+        """
+        namespace = {f"alu_{cbits}": ALU.get(cbits) for cbits in range(64)
+                     if cbits not in self.EXPRESSIONS}
+        code = compile(self.source(start), f"<block {start}>", "exec")
+        exec(code, namespace)
+        return namespace[f"block_{start}"], self.block_end(start) - start
+
+
+class BlockCPUEmulator(CPUEmulator):
+    """executes basic blocks compiled into Python functions.
+
+    Blocks are compiled on the first visit and cached by the start address.
+    max_cycles is checked at the boundaries of blocks.
+    """
+
+    def __init__(self, program: HackProgram):
+        super().__init__(program)
+        self.compiler = BlockCompiler(program)
+        self.blocks: Dict[int, Tuple[Callable, int]] = {}
+
+    def run(self, max_cycles: int = 1 << 62) -> int:
+        blocks = self.blocks
+        size = len(self.decoded)
+        ram = self.ram
+        pc, a, d = self.pc, self.a, self.d
+
+        n = 0
+        while n < max_cycles and 0 <= pc < size:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self.compiler.compile(pc)
+            func, length = block
+            start = pc
+            pc, a, d, executed = func(ram, a, d)
+            n += executed
+            if pc == start and self.decoded.is_halt(pc):
+                self.halted = True
+                break
+
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += n
+        if not 0 <= pc < size:
+            self.halted = True
+        return n
+
+
+ENGINES = {
+    "interpreter": CPUEmulator,
+    "blocks": BlockCPUEmulator,
+}
+
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help=".hack (text) or binary program")
+    parser.add_argument("--cycles", type=int, default=10000000,
+                        help="maximum number of instructions to execute")
+    parser.add_argument("--dump", type=int, nargs=2, metavar=("START", "END"),
+                        help="print RAM[START:END] after the execution")
+    parser.add_argument("--engine", choices=ENGINES.keys(), default="interpreter")
+    args = parser.parse_args()
+
+    cpu = ENGINES[args.engine](HackProgram.load(args.filename))
+    start = time.perf_counter()
+    cycles = cpu.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    status = "halted" if cpu.halted else "stopped"
+    print(f"{status} at PC={cpu.pc} after {cycles} cycles")
+    print(f"{elapsed:.3f} sec ({cycles / elapsed:,.0f} instructions/sec)")
+    if args.dump:
+        start, end = args.dump
+        for address in range(start, end):
+            print(f"RAM[{address}] = {cpu.ram[address]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from ParseTree import TreeNode, TreeNodeIterator
+from ParseTree import TreeNode
 from VMWriter import VMWriter
 from constants import *
 from SymbolTable import SymbolTable, Symbol
@@ -40,9 +40,10 @@ class Helper:
         return cls.is_token(node, TokenType.IDENTIFIER)
 
     @classmethod
-    def eat(cls, it: Iterator[TreeNode], expected_token_type: TokenType=None,
-            expected_token: str=None):
-        node = next(it)
+    def expect(cls, node: TreeNode, expected_token_type: TokenType=None,
+               expected_token: str=None) -> TreeNode:
+        """returns the node after checking its token type and token
+        """
         if expected_token_type is not None and expected_token_type != node.token_type:
             raise SyntaxError(f"expected token type {expected_token_type} but got {node.token_type}")
         if expected_token is not None and expected_token != node.token:
@@ -50,20 +51,20 @@ class Helper:
         return node
 
     @classmethod
-    def eat_keyword(cls, it: Iterator[TreeNode], keyword: Keyword=None) -> TreeNode:
-        return cls.eat(it, TokenType.KEYWORD, keyword.value if keyword is not None else None)
+    def expect_keyword(cls, node: TreeNode, keyword: Keyword=None) -> TreeNode:
+        return cls.expect(node, TokenType.KEYWORD, keyword.text if keyword is not None else None)
 
     @classmethod
-    def eat_identifier(cls, it: Iterator[TreeNode]) -> TreeNode:
-        return cls.eat(it, TokenType.IDENTIFIER)
+    def expect_identifier(cls, node: TreeNode) -> TreeNode:
+        return cls.expect(node, TokenType.IDENTIFIER)
     
     @classmethod
-    def eat_symbol(cls, it: Iterator[TreeNode], symbol: str=None) -> TreeNode:
-        return cls.eat(it, TokenType.SYMBOL, symbol)
+    def expect_symbol(cls, node: TreeNode, symbol: str=None) -> TreeNode:
+        return cls.expect(node, TokenType.SYMBOL, symbol)
     
     @classmethod
-    def eat_nonterminal(cls, it: Iterator[TreeNode], expected_type: NonTerminalType=None) -> TreeNode:
-        node = cls.eat(it, TokenType.NONTERMINAL)
+    def expect_nonterminal(cls, node: TreeNode, expected_type: NonTerminalType=None) -> TreeNode:
+        node = cls.expect(node, TokenType.NONTERMINAL)
         if expected_type is not None and not expected_type.is_same(node.name):
             raise SyntaxError(f"expected '{expected_type.value}' but got '{node.name}'")
         return node
@@ -90,8 +91,7 @@ class Helper:
     @classmethod
     def count_fields(cls, node: TreeNode) -> int:
         if NonTerminalType.CLASS_VAR_DEC.is_same(node.name):
-            it = node.get_iterator()
-            k = Helper.eat_keyword(it)
+            k = Helper.expect_keyword(node.children[0])
             if Helper.is_keyword(k, Keyword.FIELD):
                 return cls.count_variables(node)
             else:
@@ -99,6 +99,63 @@ class Helper:
         else:
             raise ValueError
     
+    @classmethod
+    def is_boolean_expression(cls, node: TreeNode) -> bool:
+        """true if the expression is always true (-1) or false (0)
+        """
+        return cls._is_boolean_operation(node.children)
+
+    @classmethod
+    def _is_boolean_operation(cls, children: List[TreeNode]) -> bool:
+        # operators are applied from left to right, so the last one decides
+        if len(children) == 1:
+            return cls.is_boolean_term(children[0])
+        op = children[-2].token
+        if op in ("<", ">", "="):
+            return True
+        if op in ("&", "|"):
+            return cls._is_boolean_operation(children[:-2]) and cls.is_boolean_term(children[-1])
+        return False
+
+    @classmethod
+    def is_comparison(cls, node: TreeNode) -> bool:
+        """true if the last operator of the expression is <, > or =
+        """
+        children = node.children
+        if len(children) == 1:
+            term = children[0]
+            return cls.is_symbol(term.children[0], "(") and cls.is_comparison(term.children[1])
+        return children[-2].token in ("<", ">", "=")
+
+    @classmethod
+    def is_boolean_term(cls, node: TreeNode) -> bool:
+        first = node.children[0]
+        if cls.is_keyword(first, Keyword.TRUE) or cls.is_keyword(first, Keyword.FALSE):
+            return True
+        if cls.is_symbol(first, "~"):
+            return cls.is_boolean_term(node.children[1])
+        if cls.is_symbol(first, "("):
+            return cls.is_boolean_expression(node.children[1])
+        return False
+
+    @classmethod
+    def negated_term(cls, node: TreeNode) -> Optional[TreeNode]:
+        """returns x if the expression is ~x or (~x) for a boolean x
+        """
+        if len(node.children) != 1:
+            return None
+        term = node.children[0]
+        first = term.children[0]
+        if cls.is_symbol(first, "~") and cls.is_boolean_term(term.children[1]):
+            return term.children[1]
+        if cls.is_symbol(first, "("):
+            return cls.negated_term(term.children[1])
+        return None
+
+    @classmethod
+    def ends_with_return(cls, node: TreeNode) -> bool:
+        return node.has_child() and NonTerminalType.RETURN_STATEMENT.is_same(node.children[-1].name)
+
     @classmethod
     def symbol_kind_to_segment(cls, kind: SymbolKind) -> Segment:
         if kind == SymbolKind.VAR:
@@ -163,8 +220,10 @@ class Context(dict):
 
 class CompilationEngine:
 
-    def __init__(self, writer: VMWriter):
+    def __init__(self, writer: VMWriter, rotate_loops: bool = True, compact_ifs: bool = True):
         self.writer = writer
+        self.rotate_loops = rotate_loops
+        self.compact_ifs = compact_ifs
         self.namespace = ""
 
     def compile_class(self, root: TreeNode):
@@ -173,22 +232,18 @@ class CompilationEngine:
     
         context = Context()
 
-        it = root.get_iterator()
+        children = root.children
         # should be 'class' keyword
-        _ = Helper.eat_keyword(it, Keyword.CLASS)
+        _ = Helper.expect_keyword(children[0], Keyword.CLASS)
         # class name
-        node = Helper.eat_identifier(it)
+        node = Helper.expect_identifier(children[1])
         context["class"] = node.token
         context["nfields"] = 0
         # {
-        _ = Helper.eat_symbol(it, "{")
-
-        # TODO static
-        # TODO constructor
-        # TODO method
+        _ = Helper.expect_symbol(children[2], "{")
 
-        while it.has_next():
-            node = Helper.eat(it)
+        for i in range(3, len(children)):
+            node = children[i]
 
             # class variables
             if Helper.is_nonterminal(node, NonTerminalType.CLASS_VAR_DEC):
@@ -214,34 +269,34 @@ class CompilationEngine:
         context.clear_local_symbols()
         context.clear_label_count()
 
-        it = root.get_iterator()
+        children = root.children
         # expect 'constructor', 'function' or 'method
-        node = Helper.eat_keyword(it)
+        node = Helper.expect_keyword(children[0])
         function_type = Keyword.from_str(node.token)
         context['function_type'] = function_type
 
-        return_type: TreeNode = Helper.eat(it)
+        return_type: TreeNode = children[1]
         context["return_type"] = return_type.token
 
-        function_name = f"{context['class']}.{Helper.eat_identifier(it).token}"
+        function_name = f"{context['class']}.{Helper.expect_identifier(children[2]).token}"
         
         # skip symbol
-        _ = Helper.eat_symbol(it, "(")
+        _ = Helper.expect_symbol(children[3], "(")
 
         # parameters
-        parametert_list = Helper.eat_nonterminal(it, NonTerminalType.PARAMETER_LIST)
+        parametert_list = Helper.expect_nonterminal(children[4], NonTerminalType.PARAMETER_LIST)
         nargs = Helper.parameter_size(parametert_list)
         self.compile_parameter_list(context, parametert_list)
 
         # skip symbol
-        _ = Helper.eat_symbol(it, ")")
+        _ = Helper.expect_symbol(children[5], ")")
 
         # 'function' instruction needs the number of local variables.
         # delegate it to compiler of subroutine body.
         context["function_name"] = function_name
 
         # subroutine body
-        body = Helper.eat_nonterminal(it, NonTerminalType.SUBROUTINE_BODY)
+        body = Helper.expect_nonterminal(children[6], NonTerminalType.SUBROUTINE_BODY)
         self.compile_subroutine_body(context, body)
         
         # moved out of function. remove it!
@@ -251,17 +306,14 @@ class CompilationEngine:
         context.clear_local_symbols()
     
     def compile_subroutine_body(self, context: Context, root: TreeNode):
-        it = root.get_iterator()
-        _ = Helper.eat_symbol(it, "{")
+        children = root.children
+        _ = Helper.expect_symbol(children[0], "{")
 
-        # variables
-        variables = []
+        # variables are followed by statements and '}'
+        variables = children[1:-2]
         nlocals = 0
-        while it.has_next():
-            node = Helper.eat(it) 
-            if not NonTerminalType.VAR_DEC.is_same(node.name):
-                break
-            variables.append(node)
+        for node in variables:
+            _ = Helper.expect_nonterminal(node, NonTerminalType.VAR_DEC)
             nlocals += Helper.count_variables(node)
         
         self.writer.write_functions(context["function_name"], nlocals)
@@ -279,39 +331,32 @@ class CompilationEngine:
         for var in variables:
             self.compile_var_decl(context, var)
 
-        self.compile_statements(context, node)
-        _ = Helper.eat_symbol(it)
+        statements = Helper.expect_nonterminal(children[-2], NonTerminalType.STATEMETNS)
+        self.compile_statements(context, statements)
+        _ = Helper.expect_symbol(children[-1], "}")
     
     def compile_parameter_list(self, context, root: TreeNode):
         """define arguments in local symbol table
         int x, int y
         """
-        it = root.get_iterator()
-        while it.has_next():
-            type = Helper.eat(it).token
-            name = Helper.eat(it).token
+        children = root.children
+        # type name (, type name)*
+        for i in range(0, len(children), 3):
+            type = children[i].token
+            name = Helper.expect_identifier(children[i + 1]).token
             context.local_symbols.define(name, type, SymbolKind.ARG)
-            if it.has_next():
-                _ = Helper.eat_symbol(it, ",")
-            else:
-                break
         
     def process_variable_decl(self, root: TreeNode, table: SymbolTable, kind: SymbolKind):
-        it = root.get_iterator()
-        _ = Helper.eat_keyword(it)
-        type = Helper.eat(it).token
-        # name
-        while it.has_next():
-            name = Helper.eat_identifier(it).token
+        children = root.children
+        _ = Helper.expect_keyword(children[0])
+        type = children[1].token
+        # name (, name)* ;
+        for i in range(2, len(children), 2):
+            name = Helper.expect_identifier(children[i]).token
             table.define(name, type, kind)
-
-            symbol = Helper.eat_symbol(it)
-            if symbol.token == ";":
-                break
     
     def compile_class_var_decl(self, context: Context, root: TreeNode):
-        it = root.get_iterator()
-        kwd = Helper.eat_keyword(it)
+        kwd = Helper.expect_keyword(root.children[0])
         if Helper.is_keyword(kwd, Keyword.FIELD):
             self.process_variable_decl(root, context.global_symbols, SymbolKind.FIELD)
         elif Helper.is_keyword(kwd, Keyword.STATIC):
@@ -327,28 +372,21 @@ class CompilationEngine:
         self.process_variable_decl(root, context.local_symbols, SymbolKind.VAR)
     
     def compile_statements(self, context: Context, root: TreeNode):
-        for statement in root.loop_children():
-            if NonTerminalType.DO_STATEMENT.is_same(statement.name):
-                self.compile_do_statement(context, statement)
-            elif NonTerminalType.RETURN_STATEMENT.is_same(statement.name):
-                self.compile_return_statement(context, statement)
-            elif NonTerminalType.LET_STATEMENT.is_same(statement.name):
-                self.compile_let_statement(context, statement)
-            elif NonTerminalType.WHILE_STATEMENT.is_same(statement.name):
-                self.compile_while_statement(context, statement)
-            elif NonTerminalType.IF_STATEMENT.is_same(statement.name):
-                self.compile_if_statement(context, statement)
+        for statement in root.children:
+            compile_statement = self.STATEMENT_COMPILERS.get(statement.name)
+            if compile_statement is not None:
+                compile_statement(self, context, statement)
             else:
                 print(statement.name)
                 # raise NotImplementedError(statement.name)
 
-    def compile_call(self, context: Context, it: Iterator[TreeNode]):
-        """to be called by do-statement or let-statement
+    def compile_call(self, context: Context, nodes: List[TreeNode], i: int = 0):
+        """to be called by do-statement or let-statement. the call starts at
+        nodes[i].
         """
-        identifier = Helper.eat_identifier(it)
+        identifier = Helper.expect_identifier(nodes[i])
 
         push_this = False
-        eat_left_paren = True
 
         # variable's method
         if context.local_symbols.has_name(identifier.token) or context.global_symbols.has_name(identifier.token):
@@ -358,12 +396,13 @@ class CompilationEngine:
             else:
                 symbol = context.global_symbols.get(name)
 
-            _ = Helper.eat_symbol(it, ".")
+            _ = Helper.expect_symbol(nodes[i + 1], ".")
 
             # function name
             type = symbol.type
-            method_name = Helper.eat_identifier(it).token
+            method_name = Helper.expect_identifier(nodes[i + 2]).token
             function_name = f"{type}.{method_name}"
+            i += 3
 
             # push the variable as the first arugment
             segment = Helper.symbol_kind_to_segment(symbol.kind)
@@ -371,10 +410,11 @@ class CompilationEngine:
             push_this = True
         # static function or method call
         else:
-            node = next(it)
+            node = nodes[i + 1]
             # static function call
             if Helper.is_symbol(node, "."):
-                function_name = f"{identifier.token}.{Helper.eat_identifier(it).token}"
+                function_name = f"{identifier.token}.{Helper.expect_identifier(nodes[i + 2]).token}"
+                i += 3
             # method call
             else:
                 method_name = identifier.token
@@ -383,14 +423,13 @@ class CompilationEngine:
                 # push THIS as the first arugment
                 self.writer.write_push(Segment.POINTER, 0)
                 push_this = True
-                eat_left_paren = False
-        if eat_left_paren:
-            _ = Helper.eat_symbol(it, "(")
+                i += 1
+        _ = Helper.expect_symbol(nodes[i], "(")
         # parse expression list
-        expression_list = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION_LIST)
+        expression_list = Helper.expect_nonterminal(nodes[i + 1], NonTerminalType.EXPRESSION_LIST)
         self.compile_expression_list(context, expression_list)
 
-        _ = Helper.eat_symbol(it, ")")
+        _ = Helper.expect_symbol(nodes[i + 2], ")")
 
         # call function
         nargs = Helper.expression_size(expression_list) + push_this
@@ -400,8 +439,8 @@ class CompilationEngine:
         """calls a function returning nothing
         """
         # need a symbol table here!
-        it = root.get_iterator()
-        _ = Helper.eat_keyword(it, Keyword.DO)
+        children = root.children
+        _ = Helper.expect_keyword(children[0], Keyword.DO)
 
         # method call
         #   do foo(x, y)
@@ -410,16 +449,16 @@ class CompilationEngine:
         # method call
         #   do p1.dist(p2)
         # in any case, start with identifier
-        self.compile_call(context, it)
+        self.compile_call(context, children, 1)
 
         # remove dummy return value
         self.writer.write_pop(Segment.TEMP, 0)
 
     def compile_let_statement(self, context: Context, root: TreeNode):
-        it = root.get_iterator()
-        _ = Helper.eat_keyword(it, Keyword.LET)
+        children = root.children
+        _ = Helper.expect_keyword(children[0], Keyword.LET)
         # variable
-        identifier = Helper.eat_identifier(it)
+        identifier = Helper.expect_identifier(children[1])
         name = identifier.token
         symbol = context.lookup_symbol(name)
         index = symbol.index
@@ -433,17 +472,17 @@ class CompilationEngine:
         # push index_expr
         # add
         # pop pointer 1  (THAT)
-        if Helper.is_symbol(Helper.eat_symbol(it), "["):
+        if Helper.is_symbol(Helper.expect_symbol(children[2]), "["):
             # push the variable
-            index_expr = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+            index_expr = Helper.expect_nonterminal(children[3], NonTerminalType.EXPRESSION)
             self.compile_expression(context, index_expr)
             self.compile_variable(context, identifier)
-            _ = Helper.eat_symbol(it, "]")
-            _ = Helper.eat_symbol(it, "=")
+            _ = Helper.expect_symbol(children[4], "]")
+            _ = Helper.expect_symbol(children[5], "=")
             self.writer.write_arithmetic(ArithmeticCommand.ADD)
 
             # rhs
-            expression = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+            expression = Helper.expect_nonterminal(children[6], NonTerminalType.EXPRESSION)
             self.compile_expression(context, expression)
 
             # stack (bottom)
@@ -462,54 +501,97 @@ class CompilationEngine:
             self.writer.write_pop(Segment.THAT, 0)
         else:
             # rhs
-            expression = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+            expression = Helper.expect_nonterminal(children[3], NonTerminalType.EXPRESSION)
             self.compile_expression(context, expression)
             # pop the stack top to the variable
             self.writer.write_pop(segment, index)
     
     def compile_while_statement(self, context:Context, root: TreeNode):
-        it = root.get_iterator()
+        """
+        goto WHILE_EXP
+        label WHILE_TOP
+        <statements>
+        label WHILE_EXP
+        <expr>
+        if-goto WHILE_TOP
+
+        the test is at the bottom so that an iteration takes a single branch.
+        with rotate_loops=False, or if the condition is not boolean (e.g.
+        x & 4), where 'not' would exit the loop on any value but -1:
+        label WHILE_EXP
+        <expr>
+        not
+        if-goto WHILE_END
+        <statements>
+        goto WHILE_EXP
+        label WHILE_END
+        """
+        children = root.children
 
         label_count = context.next_label_count(Keyword.WHILE)
+        top_label = f"WHILE_TOP{label_count}"
         exp_label = f"WHILE_EXP{label_count}"
         end_label = f"WHILE_END{label_count}"
 
-        self.writer.write_label(exp_label)
-        _ = Helper.eat_keyword(it, Keyword.WHILE)
-
-        # expression
-        _ = Helper.eat_symbol(it, "(")
-        expression = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
-        self.compile_expression(context, expression)
-        _ = Helper.eat_symbol(it, ")")
-
-        # check end condition
-        self.writer.write_arithmetic(ArithmeticCommand.NOT)
-        self.writer.write_if(end_label)
-
-        # statements
-        _ = Helper.eat_symbol(it, "{")
-        statements = Helper.eat_nonterminal(it, NonTerminalType.STATEMETNS)
-        self.compile_statements(context, statements)
-        # loop top
-        self.writer.write_goto(exp_label)
-        _ = Helper.eat_symbol(it, "}")
+        _ = Helper.expect_keyword(children[0], Keyword.WHILE)
+        _ = Helper.expect_symbol(children[1], "(")
+        expression = Helper.expect_nonterminal(children[2], NonTerminalType.EXPRESSION)
+        _ = Helper.expect_symbol(children[3], ")")
+        _ = Helper.expect_symbol(children[4], "{")
+        statements = Helper.expect_nonterminal(children[5], NonTerminalType.STATEMETNS)
+        _ = Helper.expect_symbol(children[6], "}")
+
+        if self.rotate_loops and Helper.is_boolean_expression(expression):
+            self.writer.write_goto(exp_label)
+            self.writer.write_label(top_label)
+            self.compile_statements(context, statements)
+            self.writer.write_label(exp_label)
+            self.compile_expression(context, expression)
+            self.writer.write_if(top_label)
+        else:
+            self.writer.write_label(exp_label)
+            self.compile_expression(context, expression)
+            # check end condition
+            self.writer.write_arithmetic(ArithmeticCommand.NOT)
+            self.writer.write_if(end_label)
+            self.compile_statements(context, statements)
+            # loop top
+            self.writer.write_goto(exp_label)
+            self.writer.write_label(end_label)
 
-        self.writer.write_label(end_label)
-    
     def compile_if_statement(self, context: Context, root: TreeNode):
         """
+        ~x of a boolean x, or a comparison without else:
+        <x>                         (or <expr> not)
+        if-goto IF_FALSE
+        <true_statements>
+        goto IF_END                 (unless the true statements return)
+        label IF_FALSE
+        <false_statements>
+        label IF_END
+
+        otherwise with else, the false statements follow the branch:
+        <expr>
+        if-goto IF_TRUE
+        <false_statements>
+        goto IF_END                 (unless the false statements return)
+        label IF_TRUE
+        <true_statements>
+        label IF_END
+
+        empty blocks are omitted. a non-boolean condition without else keeps
+        the layout of compact_ifs=False because 'not' would change it:
         <expr>
-        if-goto IFTRUE
-        goto IFFLASE
-        label IFTRUE
+        if-goto IF_TRUE
+        goto IF_FALSE
+        label IF_TRUE
         <true_statements>
-        goto IFEND
-        label IFFALSE (else)
+        goto IF_END                 (with else)
+        label IF_FALSE
         <false_statements>
-        label IFEND
+        label IF_END
         """
-        it = root.get_iterator()
+        children = root.children
         
         # labels
         n = context.next_label_count(Keyword.IF)
@@ -519,40 +601,90 @@ class CompilationEngine:
         has_else = False
 
         # if (expr)
-        _ = Helper.eat_keyword(it, Keyword.IF)
-        _ = Helper.eat_symbol(it, "(")
-        expr = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
-        _ = Helper.eat_symbol(it, ")")
+        _ = Helper.expect_keyword(children[0], Keyword.IF)
+        _ = Helper.expect_symbol(children[1], "(")
+        expr = Helper.expect_nonterminal(children[2], NonTerminalType.EXPRESSION)
+        _ = Helper.expect_symbol(children[3], ")")
         
         # if true statements
-        _ = Helper.eat_symbol(it, "{")
-        true_statements = Helper.eat_nonterminal(it, NonTerminalType.STATEMETNS)
-        _ = Helper.eat_symbol(it, "}")
+        _ = Helper.expect_symbol(children[4], "{")
+        true_statements = Helper.expect_nonterminal(children[5], NonTerminalType.STATEMETNS)
+        _ = Helper.expect_symbol(children[6], "}")
 
         # else statement (optional)
-        if it.has_next():
+        if len(children) > 7:
             has_else = True
-            _ = Helper.eat_keyword(it, Keyword.ELSE)
-            _ = Helper.eat_symbol(it, "{")
-            false_statements = Helper.eat_nonterminal(it, NonTerminalType.STATEMETNS)
-            _ = Helper.eat_symbol(it, "}")
-
-        self.compile_expression(context, expr)
-        if has_else:
-            self.writer.write_if(if_true_label)     # if-statement
-            self.writer.write_goto(if_false_label)  # else-statement
-            # true
-            self.writer.write_label(if_true_label)
+            _ = Helper.expect_keyword(children[7], Keyword.ELSE)
+            _ = Helper.expect_symbol(children[8], "{")
+            false_statements = Helper.expect_nonterminal(children[9], NonTerminalType.STATEMETNS)
+            _ = Helper.expect_symbol(children[10], "}")
+
+        if not self.compact_ifs:
+            self.compile_expression(context, expr)
+            if has_else:
+                self.writer.write_if(if_true_label)     # if-statement
+                self.writer.write_goto(if_false_label)  # else-statement
+                # true
+                self.writer.write_label(if_true_label)
+                self.compile_statements(context, true_statements)
+                self.writer.write_goto(if_end_label)
+                # false
+                self.writer.write_label(if_false_label)
+                self.compile_statements(context, false_statements)
+                self.writer.write_label(if_end_label)
+            else:
+                self.writer.write_if(if_true_label)     # if-statement
+                self.writer.write_goto(if_false_label)  # else-statement
+                # true
+                self.writer.write_label(if_true_label)
+                self.compile_statements(context, true_statements)
+                self.writer.write_label(if_false_label)
+            return
+
+        has_true = true_statements.has_child()
+        has_false = has_else and false_statements.has_child()
+        negated = Helper.negated_term(expr)
+        if not has_true and not has_false:
+            # only for the side effects of the condition
+            self.compile_expression(context, expr)
+            self.writer.write_pop(Segment.TEMP, 0)
+        elif not has_true:
+            self.compile_expression(context, expr)
+            self.writer.write_if(if_end_label)
+            self.compile_statements(context, false_statements)
+            self.writer.write_label(if_end_label)
+        elif negated is not None or (not has_false and Helper.is_comparison(expr)):
+            # branch to the false statements on ~expr
+            if negated is not None:
+                self.compile_term(context, negated)
+            else:
+                self.compile_expression(context, expr)
+                self.writer.write_arithmetic(ArithmeticCommand.NOT)
+            self.writer.write_if(if_false_label)
             self.compile_statements(context, true_statements)
-            self.writer.write_goto(if_end_label)
-            # false
-            self.writer.write_label(if_false_label)
+            if has_false:
+                if not Helper.ends_with_return(true_statements):
+                    self.writer.write_goto(if_end_label)
+                self.writer.write_label(if_false_label)
+                self.compile_statements(context, false_statements)
+                self.writer.write_label(if_end_label)
+            else:
+                self.writer.write_label(if_false_label)
+        elif has_false:
+            # the false statements fall through from the condition
+            self.compile_expression(context, expr)
+            self.writer.write_if(if_true_label)
             self.compile_statements(context, false_statements)
+            if not Helper.ends_with_return(false_statements):
+                self.writer.write_goto(if_end_label)
+            self.writer.write_label(if_true_label)
+            self.compile_statements(context, true_statements)
             self.writer.write_label(if_end_label)
         else:
-            self.writer.write_if(if_true_label)     # if-statement
-            self.writer.write_goto(if_false_label)  # else-statement
-            # true
+            # 'not' would change the result of a non-boolean condition
+            self.compile_expression(context, expr)
+            self.writer.write_if(if_true_label)
+            self.writer.write_goto(if_false_label)
             self.writer.write_label(if_true_label)
             self.compile_statements(context, true_statements)
             self.writer.write_label(if_false_label)
@@ -560,18 +692,10 @@ class CompilationEngine:
     def compile_expression_list(self, context: Context, root: TreeNode):
         """<expression> (, <expression>)*
         """
-        it = root.get_iterator()
-        # empty list
-        if not it.has_next():
-            return
-        # at least one expression
-        expression = next(it)
-        self.compile_expression(context, expression)
-        # more expressions
-        while it.has_next():
-            _ = Helper.eat_symbol(it, ",")
-            expression = next(it)
-            self.compile_expression(context, expression)
+        children = root.children
+        # expressions are separated by ','
+        for i in range(0, len(children), 2):
+            self.compile_expression(context, children[i])
     
     def compile_expression(self, context: Context, root: TreeNode):
         """term (op term)*
@@ -579,27 +703,18 @@ class CompilationEngine:
         x + y
         x + (y * z)
         """
-        it = root.get_iterator()
-        term = Helper.eat(it)
-        if not it.has_next():
-            self.compile_term(context, term)
-        else:
-            symbol = Helper.eat_symbol(it)
-            other = Helper.eat(it)
-            self.compile_term(context, term)
-            self.compile_term(context, other)
+        children = root.children
+        self.compile_term(context, children[0])
+        # operators are applied from left to right
+        for i in range(1, len(children), 2):
+            symbol = Helper.expect_symbol(children[i])
+            self.compile_term(context, children[i + 1])
             # handle operation
-            if symbol.token == "*":
-                self.writer.write_call("Math.multiply", 2)
-            elif symbol.token == "/":
-                self.writer.write_call("Math.divide", 2)
-            else:
-                # to avoid confusion with neg
-                if symbol.token == "-":
-                    cmd = ArithmeticCommand.SUB
-                else:
-                    cmd = ArithmeticCommand.from_symbol(symbol.token)
+            cmd = BINARY_OPERATORS.get(symbol.token)
+            if cmd is not None:
                 self.writer.write_arithmetic(cmd)
+            else:
+                self.writer.write_call(BINARY_OPERATOR_CALLS[symbol.token], 2)
         
     def compile_string_const(self, context: Context, root: TreeNode):
         value = root.token
@@ -625,54 +740,42 @@ class CompilationEngine:
         variable
         "abcdefg"
         """
-        it = root.get_iterator()
-        node = Helper.eat(it)
+        children = root.children
+        node = children[0]
+        token_type = node.token_type
         # integer constant
-        if node.is_terminal() and node.token_type == TokenType.INT_CONST:
+        if token_type == TokenType.INT_CONST:
             value = int(node.token)
             self.writer.write_push(Segment.CONSTANT, value)
         # string constant
-        elif node.is_terminal() and node.token_type == TokenType.STRING_CONST:
+        elif token_type == TokenType.STRING_CONST:
             self.compile_string_const(context, node)
         # unary operation
-        elif Helper.is_symbol(node, "-"):
-            term = Helper.eat_nonterminal(it, NonTerminalType.TERM)
-            self.compile_term(context, term)
-            self.writer.write_arithmetic(ArithmeticCommand.NEG)
-        elif Helper.is_symbol(node, "~"):
-            term = Helper.eat_nonterminal(it, NonTerminalType.TERM)
+        elif token_type == TokenType.SYMBOL and node.token in self.UNARY_OPERATORS:
+            term = Helper.expect_nonterminal(children[1], NonTerminalType.TERM)
             self.compile_term(context, term)
-            self.writer.write_arithmetic(ArithmeticCommand.NOT)
-        # boolean
-        elif Helper.is_keyword(node, Keyword.TRUE):
-            # push -1
-            self.writer.write_push(Segment.CONSTANT, 0)
-            self.writer.write_arithmetic(ArithmeticCommand.NOT)
-        elif Helper.is_keyword(node, Keyword.FALSE):
-            self.writer.write_push(Segment.CONSTANT, 0)
-        # null
-        elif Helper.is_keyword(node, Keyword.NULL):
-            # push -1
-            self.writer.write_push(Segment.CONSTANT, 0)
-        # this
-        elif Helper.is_keyword(node, Keyword.THIS):
-            self.writer.write_push(Segment.POINTER, 0)
+            self.writer.write_arithmetic(self.UNARY_OPERATORS[node.token])
+        # true, false, null and this
+        elif token_type == TokenType.KEYWORD and node.token in self.KEYWORD_CONSTANTS:
+            segment, index, cmd = self.KEYWORD_CONSTANTS[node.token]
+            self.writer.write_push(segment, index)
+            if cmd is not None:
+                self.writer.write_arithmetic(cmd)
         # expression enclosed by parentheses
         elif Helper.is_symbol(node, "("):
-            expression = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+            expression = Helper.expect_nonterminal(children[1], NonTerminalType.EXPRESSION)
             self.compile_expression(context, expression)
-            _ = Helper.eat_symbol(it, ")")
+            _ = Helper.expect_symbol(children[2], ")")
         elif Helper.is_identifier(node):
-            if it.has_next():
+            if len(children) > 1:
                 # is array?
-                nxt = it.current_value() 
+                nxt = children[1]
                 if Helper.is_symbol(nxt, "["):
                     # index
-                    _ = Helper.eat(it)
-                    expr = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+                    expr = Helper.expect_nonterminal(children[2], NonTerminalType.EXPRESSION)
                     self.compile_expression(context, expr)
                     self.compile_variable(context, node)
-                    _ = Helper.eat(it)
+                    _ = Helper.expect_symbol(children[3], "]")
                     # address = base address + index
                     self.writer.write_arithmetic(ArithmeticCommand.ADD)
                     # THAT
@@ -681,7 +784,7 @@ class CompilationEngine:
                     self.writer.write_push(Segment.THAT, 0)
                 # otherwise should be function call
                 else:
-                    self.compile_call(context, root.get_iterator())
+                    self.compile_call(context, children)
             # variable
             else:
                 self.compile_variable(context, node)
@@ -689,30 +792,54 @@ class CompilationEngine:
             print("term not defined: ", root)
     
     def compile_return_statement(self, context: Context, root: TreeNode):
-        it = root.get_iterator()
-        _ = Helper.eat_keyword(it)
+        children = root.children
+        _ = Helper.expect_keyword(children[0], Keyword.RETURN)
         if context["return_type"] == "void":
             # push dummy
             self.writer.write_push(Segment.CONSTANT, 0)
         elif context["function_type"] == Keyword.CONSTRUCTOR:
             # expect return this;
-            expr = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
-            term = Helper.eat_nonterminal(expr.get_iterator(), NonTerminalType.TERM)
-            _ = Helper.eat_keyword(term.get_iterator(), Keyword.THIS)
+            expr = Helper.expect_nonterminal(children[1], NonTerminalType.EXPRESSION)
+            term = Helper.expect_nonterminal(expr.children[0], NonTerminalType.TERM)
+            _ = Helper.expect_keyword(term.children[0], Keyword.THIS)
             self.writer.write_push(Segment.POINTER, 0)
         else:
-            expr = Helper.eat_nonterminal(it, NonTerminalType.EXPRESSION)
+            expr = Helper.expect_nonterminal(children[1], NonTerminalType.EXPRESSION)
             self.compile_expression(context, expr)
         self.writer.write_return()
 
+    # ----------------------------------------------------------------
+    # dispatch tables
+    # ----------------------------------------------------------------
+    STATEMENT_COMPILERS = {
+        NonTerminalType.DO_STATEMENT.text: compile_do_statement,
+        NonTerminalType.RETURN_STATEMENT.text: compile_return_statement,
+        NonTerminalType.LET_STATEMENT.text: compile_let_statement,
+        NonTerminalType.WHILE_STATEMENT.text: compile_while_statement,
+        NonTerminalType.IF_STATEMENT.text: compile_if_statement,
+    }
+
+    UNARY_OPERATORS = {
+        "-": ArithmeticCommand.NEG,
+        "~": ArithmeticCommand.NOT,
+    }
+
+    # keyword -> (segment, index, command after the push)
+    KEYWORD_CONSTANTS = {
+        Keyword.TRUE.text: (Segment.CONSTANT, 0, ArithmeticCommand.NOT),     # -1
+        Keyword.FALSE.text: (Segment.CONSTANT, 0, None),
+        Keyword.NULL.text: (Segment.CONSTANT, 0, None),
+        Keyword.THIS.text: (Segment.POINTER, 0, None),
+    }
+
 
 def main():
     import sys
-    from JackTokenizer import JackTokenizer
+    from JackTokenizer import RegexJackTokenizer
     from ParseTree import ParseTreeBuilder
     input_filename = sys.argv[1]
     input_file = open(input_filename, "r")
-    tokenizer = JackTokenizer(input_file)
+    tokenizer = RegexJackTokenizer(input_file)
 
     output_filename = input_filename.replace(".jack", ".vm")
     output_file = open(output_filename, "w")
@@ -1,5 +1,5 @@
 from CompilationEngine import ParseTreeBuilder
-from JackTokenizer import JackTokenizer
+from JackTokenizer import RegexJackTokenizer
 
 
 def main():
@@ -16,7 +16,7 @@ def main():
 
     for input_filename in input_files:
         input_file = open(input_filename, "r")
-        tokenizer = JackTokenizer(input_file)
+        tokenizer = RegexJackTokenizer(input_file)
         print(f"Analyzing {input_filename}")
 
         output_filename = input_filename.replace(".jack", ".xml")
@@ -1,6 +1,6 @@
 from ParseTree import ParseTreeBuilder
 from CompilationEngine import CompilationEngine
-from JackTokenizer import JackTokenizer
+from JackTokenizer import RegexJackTokenizer
 from VMWriter import VMWriter
 
 
@@ -18,7 +18,7 @@ def main():
 
     for input_filename in input_files:
         input_file = open(input_filename, "r")
-        tokenizer = JackTokenizer(input_file)
+        tokenizer = RegexJackTokenizer(input_file)
         print(f"Compiling {input_filename}")
 
         # parse the input
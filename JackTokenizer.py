@@ -1,4 +1,16 @@
-from constants import TokenType, Keyword
+import collections
+import re
+from sys import intern
+from typing import Iterator, Optional
+
+from constants import TokenType, Keyword, KEYWORDS
+
+
+class Token(collections.namedtuple("Token", ["token_type", "token", "line", "column"])):
+    """a token and its position. line and column start from 1; column is 0
+    if unknown.
+    """
+    __slots__ = ()
 
 
 class Reader:
@@ -150,6 +162,8 @@ class JackTokenizer:
                 self.reader.readline()
                 continue
             if self.reader.is_eof():
+                self._token_type = TokenType.UNKNOWN
+                self._raw_token = ""
                 return
             break
 
@@ -185,7 +199,7 @@ class JackTokenizer:
         else:
             token = ""
             for c in word:
-                if c.isalpha() or c == "_":
+                if c.isalnum() or c == "_":
                     token += c
                 else:
                     break
@@ -199,6 +213,16 @@ class JackTokenizer:
                 self._token_type = TokenType.IDENTIFIER
                 self._raw_token = token
 
+    def tokens(self) -> Iterator[Token]:
+        """yields the remaining tokens. the column is unknown and the line is
+        the one where the reader stopped.
+        """
+        while self.has_more_tokens():
+            self.advance()
+            if self._token_type == TokenType.UNKNOWN:
+                return
+            yield Token(self._token_type, self._raw_token, self.reader.lineno, 0)
+
     def token_type(self) -> TokenType:
         """Returns the type of the curren token
         """
@@ -209,7 +233,7 @@ class JackTokenizer:
         only when token_type() is KEYWORD.
         """
         assert self._token_type == TokenType.KEYWORD
-        return Keyword.from_str(self._raw_token)
+        return KEYWORDS[self._raw_token]
     
     def token(self) -> str:
         return self._raw_token
@@ -234,6 +258,92 @@ class JackTokenizer:
         return self._raw_token
 
 
+class RegexJackTokenizer(JackTokenizer):
+    """Tokenizes Jack source code like JackTokenizer, reading the whole file
+    at once and matching the tokens with a single regular expression.
+    """
+
+    PATTERN = re.compile(r"""
+        \s+ | //[^\n]* | /\*.*?(?:\*/|\Z)      # blanks and comments
+        | "(?P<string>[^"\n]*)"
+        | (?P<int>[0-9]+)
+        | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+        | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+        | (?P<error>.)
+        """, re.VERBOSE | re.DOTALL)
+
+    KEYWORDS = frozenset(KEYWORDS)
+    GROUP_TYPES = {
+        "symbol": TokenType.SYMBOL,
+        "int": TokenType.INT_CONST,
+        "string": TokenType.STRING_CONST,
+    }
+
+    def __init__(self, f):
+        self.source = f.read()
+        # index of the first character of each line, for current_line()
+        self._line_starts = [0] + [m.end() for m in re.finditer("\n", self.source)]
+        self._tokens = self._scan()
+        self._token_type: TokenType = TokenType.UNKNOWN
+        self._raw_token: str = ""
+        self._line = 0
+        self._next: Optional[Token] = next(self._tokens, None)
+
+    def _scan(self) -> Iterator[Token]:
+        source = self.source
+        keywords = self.KEYWORDS
+        group_types = self.GROUP_TYPES
+        line = 1
+        line_start = 0      # index of the first character of the line
+        for m in self.PATTERN.finditer(source):
+            group = m.lastgroup
+            if group is None:
+                # blanks and comments may span lines
+                n = source.count("\n", m.start(), m.end())
+                if n:
+                    line += n
+                    line_start = source.rfind("\n", m.start(), m.end()) + 1
+                continue
+            token = m.group(group)
+            if group == "word":
+                # share the strings of repeated names between the tokens
+                token = intern(token)
+                token_type = TokenType.KEYWORD if token in keywords else TokenType.IDENTIFIER
+            elif group == "error":
+                raise SyntaxError(f"line {line}: unexpected character {token!r}")
+            else:
+                token_type = group_types[group]
+            yield Token(token_type, token, line, m.start() - line_start + 1)
+
+    def tokens(self) -> Iterator[Token]:
+        """yields the remaining tokens with their line and column. advance()
+        has no more tokens after this.
+        """
+        if self._next is None:
+            return
+        token, self._next = self._next, None
+        yield token
+        yield from self._tokens
+
+    def has_more_tokens(self) -> bool:
+        return self._next is not None
+
+    def current_line(self) -> str:
+        """the line of the current token
+        """
+        if not 0 < self._line <= len(self._line_starts):
+            return ""
+        start = self._line_starts[self._line - 1]
+        end = self.source.find("\n", start)
+        return self.source[start:end if end >= 0 else len(self.source)].rstrip("\r")
+
+    def advance(self):
+        if self._next is None:
+            return
+        self._token_type, self._raw_token, self._line, _ = self._next
+        self._next = next(self._tokens, None)
+
+
 def test_reader(f):
     reader = Reader(f)
     while not reader.is_eof():
@@ -255,7 +365,7 @@ def main():
     lines = []
     lines.append("<tokens>")
     with open(input_file, "r") as f:
-        tokenizer = JackTokenizer(f)
+        tokenizer = RegexJackTokenizer(f)
         while tokenizer.has_more_tokens():
             tokenizer.advance()
 
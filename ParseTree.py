@@ -1,21 +1,33 @@
-from JackTokenizer import JackTokenizer
-from constants import TokenType, Keyword, NonTerminalType
-from typing import List, Tuple, Iterator
+from JackTokenizer import JackTokenizer, RegexJackTokenizer, Token
+from constants import TokenType, Keyword, NonTerminalType, BINARY_OPERATORS, BINARY_OPERATOR_CALLS
+from typing import Deque, Dict, List, Tuple, Iterator
+from array import array
+import collections
 import io
 
 
 class TreeNode:
+    """a node of the parse tree. nodes use __slots__ and leaves have no child
+    list, so that a tree costs little more than its tokens.
+    """
+    __slots__ = ("token_type", "token", "_addenda")
+
+    # leaves share this empty tuple instead of having a list each
+    children: List["TreeNode"] = ()
 
-    def __init__(self, token_type: TokenType, token: str = "", children: List["TreeNode"] = None,
-                 addenda: dict = None):
-        self.children = children if children is not None else list()
+    def __init__(self, token_type: TokenType, token: str = ""):
         self.token_type = token_type
         self.token = token
-        self.addenda = addenda if addenda is not None else dict()
+        # created by set_addendum() when needed
+        self._addenda = None
 
     @property
     def name(self):
-        return self.token_type.value
+        return self.token_type.text
+
+    @property
+    def addenda(self) -> dict:
+        return self._addenda if self._addenda is not None else {}
     
     def is_leaf(self):
         return len(self.children) == 0
@@ -27,14 +39,15 @@ class TreeNode:
         return not self.token_type == TokenType.NONTERMINAL
     
     def add(self, *childlen):
-        for child in childlen:
-            self.children.append(child)
+        raise NotImplementedError
     
     def set_addendum(self, key: str, value: str):
-        self.addenda[key] = value
+        if self._addenda is None:
+            self._addenda = {}
+        self._addenda[key] = value
     
     def get_addedum(self, key: str) -> str:
-        self.addenda[key]
+        return self.addenda[key]
     
     def to_xml(self, fout, depth=0):
         raise NotImplementedError
@@ -48,51 +61,19 @@ class TreeNode:
             return f.getvalue()
         
     def _addenda_str(self) -> str:
-        s = " ".join([k + "=" + v for k, v in self.addenda.items()])
+        if not self._addenda:
+            return ""
+        s = " ".join([k + "=" + v for k, v in self._addenda.items()])
         return s
 
-    def get_iterator(self) -> Iterator["TreeNode"]:
-        return TreeNodeIterator(self.children)
-    
-    def loop_children(self) -> "TreeNode":
-        it = self.get_iterator()
-        while it.has_next():
-            yield next(it)
-
-
-class TreeNodeIterator:
-    """assume that nodes are immutable during the visit
-    """
-    
-    def __init__(self, nodes: List[TreeNode]):
-        self.nodes = nodes
-        self.idx = 0
-    
-    def __iter__(self):
-        self.idx = 0
-    
-    def __next__(self) -> TreeNode:
-        if not self.has_next():
-            raise StopIteration
-        res = self.nodes[self.idx]
-        self.idx += 1
-        return res
-    
-    def has_next(self) -> bool:
-        return self.idx < len(self.nodes)
-    
-    def current_value(self) -> TreeNode:
-        """returns the current value without moving to next
-        """
-        return self.nodes[self.idx]
-
 
 class TerminalNode(TreeNode):
+    __slots__ = ()
 
     def __init__(self, token_type: TokenType, token: str):
         super().__init__(token_type, token)
     
-    def add(self):
+    def add(self, *childlen):
         raise NotImplementedError("never call 'add'")
 
     def to_xml(self, fout, depth=0, show_addenda=False):
@@ -105,9 +86,11 @@ class TerminalNode(TreeNode):
     
 
 class NonTerminalNode(TreeNode):
+    __slots__ = ("children", "_nodetype")
 
     def __init__(self, nodetype: NonTerminalType):
-        super().__init__(TokenType.NONTERMINAL, nodetype.value)
+        super().__init__(TokenType.NONTERMINAL, nodetype.text)
+        self.children: List[TreeNode] = []
         self._nodetype = nodetype
 
     @property
@@ -116,7 +99,11 @@ class NonTerminalNode(TreeNode):
 
     @property
     def name(self) -> str:
-        return self.nodetype.value
+        # same as nodetype.text
+        return self.token
+
+    def add(self, *childlen):
+        self.children.extend(childlen)
 
     def to_xml(self, fout, depth=0, show_addenda=False):
         indent = "  " * depth
@@ -138,30 +125,71 @@ class NonTerminalNode(TreeNode):
 
 class ParseTreeBuilder:
 
+    # returned by peek() after the last token
+    END = Token(TokenType.UNKNOWN, "", 0, 0)
+
     def __init__(self, tokenizer: JackTokenizer):
         self.tokenizer = tokenizer
-        self.tokenizer.advance()
+        self.tokens = tokenizer.tokens()
+        # the current token and the ones after it read by peek()
+        self.token: Token = next(self.tokens, self.END)
+        self.lookahead: Deque[Token] = collections.deque()
         self.root: TreeNode = None
         self.depth = 0
 
-    def eat(self) -> Tuple[TokenType, str]:
+    def peek(self, k: int = 0) -> Token:
+        """returns the k-th token from the current one without consuming it
+        """
+        if k == 0:
+            return self.token
+        lookahead = self.lookahead
+        while len(lookahead) < k:
+            lookahead.append(next(self.tokens, self.END))
+        return lookahead[k - 1]
+
+    def has_more_tokens(self) -> bool:
+        """true if there is a token after the current one
+        """
+        return self.peek(1) is not self.END
+
+    def eat(self) -> Token:
         """returns the current token and advance
         """
-        token_type = self.tokenizer.token_type()
-        token = self.tokenizer.token()
-        self.tokenizer.advance()
-        return token_type, token
+        token = self.token
+        self.token = self.lookahead.popleft() if self.lookahead else next(self.tokens, self.END)
+        return token
+
+    def error(self, message: str) -> SyntaxError:
+        token = self.token
+        if token is self.END:
+            return SyntaxError(f"unexpected end of input: {message}")
+        return SyntaxError(f"line {token.line}, column {token.column}: {message}")
+
+    # ----------------------------------------------------------------
+    # nodes, overridden by FlatTreeBuilder
+    # ----------------------------------------------------------------
+    # called with a NonTerminalType
+    new_node = NonTerminalNode
+
+    def new_leaf(self, token: Token) -> TreeNode:
+        return TerminalNode(token.token_type, token.token)
+
+    def add(self, parent: TreeNode, *children: TreeNode):
+        parent.children.extend(children)
 
     # ----------------------------------------------------------------
     # eat functions to build TreeNode
     # ----------------------------------------------------------------
     def eat_terminal(self, expected_token_type: TokenType=None, expected_token: str="") -> TerminalNode:
-        token_type, token = self.eat()
-        if expected_token_type is not None:
-            assert token_type == expected_token_type
-        if expected_token:
-            assert token == expected_token
-        return TerminalNode(token_type=token_type, token=token)
+        token = self.token
+        if token is self.END:
+            raise self.error("expected a token")
+        if expected_token_type is not None and token.token_type != expected_token_type:
+            raise self.error(f"expected {expected_token_type.value} but got '{token.token}'")
+        if expected_token and token.token != expected_token:
+            raise self.error(f"expected '{expected_token}' but got '{token.token}'")
+        self.eat()
+        return self.new_leaf(token)
     
     def eat_identifier(self):
         return self.eat_terminal(TokenType.IDENTIFIER)
@@ -170,7 +198,7 @@ class ParseTreeBuilder:
         if keyword is None:
             return self.eat_terminal(TokenType.KEYWORD)
         else:
-            return self.eat_terminal(TokenType.KEYWORD, keyword.value)
+            return self.eat_terminal(TokenType.KEYWORD, keyword.text)
 
     def eat_symbol(self, symbol: str="") -> TerminalNode:
         if not symbol == "":
@@ -178,18 +206,18 @@ class ParseTreeBuilder:
         return self.eat_terminal(TokenType.SYMBOL, symbol)
 
     def is_symbol(self, expected_symbol: str="") -> bool:
-        type_ok = self.tokenizer.token_type() == TokenType.SYMBOL
+        token = self.token
         if len(expected_symbol) == 0:
-            return type_ok
+            return token.token_type == TokenType.SYMBOL
         else:
-            return type_ok and self.tokenizer.symbol() == expected_symbol
+            return token.token_type == TokenType.SYMBOL and token.token == expected_symbol
     
     def is_keyword(self, expected_keyword: Keyword=None) -> bool:
-        type_ok = self.tokenizer.token_type() == TokenType.KEYWORD
+        token = self.token
         if expected_keyword is None:
-            return type_ok
+            return token.token_type == TokenType.KEYWORD
         else:
-            return type_ok and self.tokenizer.keyword() == expected_keyword
+            return token.token_type == TokenType.KEYWORD and token.token == expected_keyword.text
     
     # ----------------------------------------------------------------
     # functions to analyse
@@ -202,44 +230,42 @@ class ParseTreeBuilder:
         """jack file always starts with 'class' keyword
         """
         assert self.is_keyword(Keyword.CLASS)
-        self.root = NonTerminalNode(NonTerminalType.CLASS)
-        self.root.add(
+        self.root = self.new_node(NonTerminalType.CLASS)
+        self.add(self.root,
             self.eat_keyword(Keyword.CLASS),
             self.eat_identifier(),
             self.eat_symbol("{")
         )
 
-        while self.tokenizer.has_more_tokens() and not self.is_symbol("}"):
+        while self.has_more_tokens() and not self.is_symbol("}"):
             # for class, expect keywords only
-            # classVarDec
-            if self.is_keyword(Keyword.FIELD) or self.is_keyword(Keyword.STATIC):
-                self.parse_class_var_dec(self.root)
-            elif self.is_keyword(Keyword.CONSTRUCTOR) or self.is_keyword(Keyword.METHOD) or self.is_keyword(Keyword.FUNCTION):
-                self.parse_subroutine(self.root)
+            parse = self.CLASS_MEMBER_PARSERS.get(self.token.token) if self.is_keyword() else None
+            if parse is not None:
+                parse(self, self.root)
             else:
                 _ = self.eat()
-        self.root.add(
+        self.add(self.root,
             self.eat_symbol("}"))
                 
     def parse_class_var_dec(self, parent: TreeNode):
         """
         field int x, y;
         """
-        node = NonTerminalNode(NonTerminalType.CLASS_VAR_DEC)
-        node.add(
+        node = self.new_node(NonTerminalType.CLASS_VAR_DEC)
+        self.add(node,
             self.eat_keyword()
         )
-        while self.tokenizer.has_more_tokens():
+        while self.has_more_tokens():
             if self.is_symbol(";"):
-                node.add(
+                self.add(node,
                     self.eat_symbol(";")
                 )
                 break
             # expect terminal nodes
-            token_type, token = self.eat()
-            child = TerminalNode(token_type, token)
-            node.add(child)
-        parent.add(node)
+            token = self.eat()
+            child = self.new_leaf(token)
+            self.add(node, child)
+        self.add(parent, node)
 
     def parse_subroutine(self, parent: TreeNode):
         """
@@ -249,28 +275,28 @@ class ParseTreeBuilder:
             return;
         }
         """
-        node = NonTerminalNode(NonTerminalType.SUBROUTINE_DEC)
-        node.add(
+        node = self.new_node(NonTerminalType.SUBROUTINE_DEC)
+        self.add(node,
             self.eat_keyword(),     # 'method' or 'constructor' or 'function'
         )
         # return type is an identifier or keyword (void, int, string)
         if self.is_keyword():
-            node.add(self.eat_keyword())
+            self.add(node, self.eat_keyword())
         else:
-            node.add(self.eat_identifier())
-        node.add(
+            self.add(node, self.eat_identifier())
+        self.add(node,
             self.eat_identifier(),  # function name
             self.eat_symbol("(")
         )
         # parameter list
         self.parse_parameter_list(node)
-        node.add(
+        self.add(node,
             self.eat_symbol(")")
         )
 
         # subroutine body
-        body = NonTerminalNode(NonTerminalType.SUBROUTINE_BODY)
-        body.add(
+        body = self.new_node(NonTerminalType.SUBROUTINE_BODY)
+        self.add(body,
             self.eat_symbol("{")
         )
         # optinally variable declarations
@@ -279,72 +305,65 @@ class ParseTreeBuilder:
         # statement
         self.parse_statements(body)
         # end of body
-        body.add(
+        self.add(body,
             self.eat_symbol("}")
         )
 
-        node.add(body)
-        parent.add(node)
+        self.add(node, body)
+        self.add(parent, node)
     
     def parse_parameter_list(self, parent: TreeNode):
         """
         ()
         (int x, int y)
         """
-        node = NonTerminalNode(NonTerminalType.PARAMETER_LIST)
-        while self.tokenizer.has_more_tokens():
+        node = self.new_node(NonTerminalType.PARAMETER_LIST)
+        while self.has_more_tokens():
             if self.is_symbol(")"):
                 break
             # expect termianl expressions
-            token_type, token = self.eat()
-            child = TerminalNode(token_type, token)
-            node.add(child)
-        parent.add(node)
+            token = self.eat()
+            child = self.new_leaf(token)
+            self.add(node, child)
+        self.add(parent, node)
     
     def parse_statements(self, parent: TreeNode):
         """
         var int a;
         let a = 1;
         """
-        node = NonTerminalNode(NonTerminalType.STATEMETNS)
-        while self.tokenizer.has_more_tokens():
+        node = self.new_node(NonTerminalType.STATEMETNS)
+        while self.has_more_tokens():
             if self.is_symbol("}"):
                 break
             # let, do, return, if, while
-            if self.is_keyword(Keyword.LET):
-                self.parse_let(node)
-            elif self.is_keyword(Keyword.DO):
-                self.parse_do(node)
-            elif self.is_keyword(Keyword.RETURN):
-                self.parse_return(node)
-            elif self.is_keyword(Keyword.IF):
-                self.parse_if_statement(node)
-            elif self.is_keyword(Keyword.WHILE):
-                self.parse_while_statement(node)
+            parse = self.STATEMENT_PARSERS.get(self.token.token) if self.is_keyword() else None
+            if parse is not None:
+                parse(self, node)
             else:
                 print(f"ignoring {self.eat()}")
-        parent.add(node)
+        self.add(parent, node)
     
     def parse_var_dec(self, parent: TreeNode):
         """
         var int x, y;
         var int x;
         """
-        node = NonTerminalNode(NonTerminalType.VAR_DEC)
-        node.add(
+        node = self.new_node(NonTerminalType.VAR_DEC)
+        self.add(node,
             self.eat_keyword(Keyword.VAR),  # var
             self.eat_terminal()             # type can be keyword or identifier
         )
-        while self.tokenizer.has_more_tokens():
-            node.add(self.eat_identifier())
+        while self.has_more_tokens():
+            self.add(node, self.eat_identifier())
             if self.is_symbol(";"):
                 break
             elif self.is_symbol(","):
-                node.add(self.eat_symbol(","))
+                self.add(node, self.eat_symbol(","))
             else:
-                raise SyntaxError(self.tokenizer.current_line())
-        node.add(self.eat_symbol(";"))
-        parent.add(node)
+                raise self.error("expected ',' or ';'")
+        self.add(node, self.eat_symbol(";"))
+        self.add(parent, node)
     
     def parse_let(self, parent: TreeNode):
         """
@@ -355,51 +374,51 @@ class ParseTreeBuilder:
         let a = Foo.bar();
         """
         # let <identifier>
-        node = NonTerminalNode(NonTerminalType.LET_STATEMENT)
-        node.add(
+        node = self.new_node(NonTerminalType.LET_STATEMENT)
+        self.add(node,
             self.eat_keyword(Keyword.LET),
             self.eat_identifier()
         )
         # can be array
         if self.is_symbol("["):
-            node.add(self.eat_symbol("["))
+            self.add(node, self.eat_symbol("["))
             self.parse_expression(node)
-            node.add(self.eat_symbol("]"))
+            self.add(node, self.eat_symbol("]"))
 
         # =
-        node.add(
+        self.add(node,
             self.eat_symbol("="),
         )
         # rhs is expression
         self.parse_expression(node)
-        node.add(self.eat_symbol(";"))
-        parent.add(node)
+        self.add(node, self.eat_symbol(";"))
+        self.add(parent, node)
 
     def parse_do(self, parent: TreeNode):
         """
         do foo(<ExpressionList>)
         do Output.printInt(<ExpressionList>)
         """
-        node = NonTerminalNode(NonTerminalType.DO_STATEMENT)
-        node.add(
+        node = self.new_node(NonTerminalType.DO_STATEMENT)
+        self.add(node,
             self.eat_keyword(Keyword.DO))
         # continue until reaching (
-        while self.tokenizer.has_more_tokens():
+        while self.has_more_tokens():
             if self.is_symbol("("):
                 break
             # expect termianl expressions
-            token_type, token = self.eat()
-            child = TerminalNode(token_type, token)
-            node.add(child)
+            token = self.eat()
+            child = self.new_leaf(token)
+            self.add(node, child)
 
         # expression list (arguments for the function call)
-        node.add(self.eat_symbol("("))
+        self.add(node, self.eat_symbol("("))
         self.parse_expression_list(node)
-        node.add(
+        self.add(node,
             self.eat_symbol(")"),
             self.eat_symbol(";"))
 
-        parent.add(node)
+        self.add(parent, node)
 
     def parse_expression(self, parent: TreeNode):
         """
@@ -407,19 +426,16 @@ class ParseTreeBuilder:
         do foo(<expr>, <expr>)
         a[<expr>]
         """
-        node = NonTerminalNode(NonTerminalType.EXPRESSION)
+        node = self.new_node(NonTerminalType.EXPRESSION)
         self.parse_term(node)
+        # binary operations
+        while self.is_symbol() and self.token.token in self.BINARY_OPERATORS:
+            self.add(node, self.eat_symbol())
+            self.parse_term(node)
         # termination
-        if any(self.is_symbol(e) for e in ",;)]"):
-            pass
-        else:
-            if self.is_symbol():
-                # binary operation
-                node.add(self.eat_symbol())
-                self.parse_term(node)
-            else:
-                self.parse_term(node)
-        parent.add(node)
+        if not (self.is_symbol() and self.token.token in self.EXPRESSION_END):
+            raise self.error(f"expected an operator or the end of the expression but got '{self.token.token}'")
+        self.add(parent, node)
     
     def parse_term(self, parent: TreeNode):
         """
@@ -431,19 +447,19 @@ class ParseTreeBuilder:
         (x+1) * (y+2)
         ~flag
         """
-        node = NonTerminalNode(NonTerminalType.TERM)
+        node = self.new_node(NonTerminalType.TERM)
         # start of another expression
         if self.is_symbol("("):
-            node.add(self.eat_symbol("("))
+            self.add(node, self.eat_symbol("("))
             self.parse_expression(node)
-            node.add(self.eat_symbol(")"))
+            self.add(node, self.eat_symbol(")"))
         # unary operation
         elif self.is_symbol():
             # expect ~ or -
-            symbol = self.tokenizer.symbol()
+            symbol = self.token.token
             if symbol not in "-~":
                 raise SyntaxError(f"unexpected unary operator {symbol}")
-            node.add(self.eat_symbol(symbol))
+            self.add(node, self.eat_symbol(symbol))
             if self.is_symbol("("):
                 self.parse_term(node)
             # otherwise, an identifier should follow
@@ -451,29 +467,29 @@ class ParseTreeBuilder:
                 self.parse_term(node)
         # otherwise it must be an expression
         else:
-            node.add(self.eat_terminal())
+            self.add(node, self.eat_terminal())
 
         # array
         if self.is_symbol("["):
-            node.add(self.eat_symbol("["))
+            self.add(node, self.eat_symbol("["))
             self.parse_expression(node)
-            node.add(self.eat_symbol("]"))
+            self.add(node, self.eat_symbol("]"))
         # function call
         elif self.is_symbol("."):
-            node.add(
+            self.add(node,
                 self.eat_symbol("."),
                 self.eat_identifier(), # funcition name
                 self.eat_symbol("(")
             )
             self.parse_expression_list(node)
-            node.add(self.eat_symbol(")"))
+            self.add(node, self.eat_symbol(")"))
         # member function call
         elif self.is_symbol("("):
-            node.add(self.eat_symbol("("))
+            self.add(node, self.eat_symbol("("))
             self.parse_expression_list(node)
-            node.add(self.eat_symbol(")"))
+            self.add(node, self.eat_symbol(")"))
 
-        parent.add(node)
+        self.add(parent, node)
     
     def parse_expression_list(self, parent: TreeNode):
         """
@@ -481,14 +497,14 @@ class ParseTreeBuilder:
         (x)
         (x, y)
         """
-        node = NonTerminalNode(NonTerminalType.EXPRESSION_LIST)
-        while self.tokenizer.has_more_tokens() and not self.is_symbol(")"):
+        node = self.new_node(NonTerminalType.EXPRESSION_LIST)
+        while self.has_more_tokens() and not self.is_symbol(")"):
             self.parse_expression(node)
             if self.is_symbol(","):
-                node.add(
+                self.add(node,
                     self.eat_symbol(",")
                 )
-        parent.add(node)
+        self.add(parent, node)
     
     def parse_return(self, parent: TreeNode):
         """
@@ -496,12 +512,12 @@ class ParseTreeBuilder:
         return;
         return (x+y) - 2;
         """
-        node = NonTerminalNode(NonTerminalType.RETURN_STATEMENT)
-        node.add(self.eat_keyword(Keyword.RETURN))
+        node = self.new_node(NonTerminalType.RETURN_STATEMENT)
+        self.add(node, self.eat_keyword(Keyword.RETURN))
         if not self.is_symbol(";"):
             self.parse_expression(node)
-        node.add(self.eat_symbol(";"))
-        parent.add(node)
+        self.add(node, self.eat_symbol(";"))
+        self.add(parent, node)
     
     def parse_if_statement(self, parent: TreeNode):
         """
@@ -516,30 +532,30 @@ class ParseTreeBuilder:
             <statements>
         }
         """
-        node = NonTerminalNode(NonTerminalType.IF_STATEMENT)
-        node.add(
+        node = self.new_node(NonTerminalType.IF_STATEMENT)
+        self.add(node,
             self.eat_keyword(Keyword.IF),
             self.eat_symbol("(")
         )
         self.parse_expression(node)
-        node.add(
+        self.add(node,
             self.eat_symbol(")"),
             self.eat_symbol("{"))
         self.parse_statements(node)
-        node.add(
+        self.add(node,
             self.eat_symbol("}")
         )
         # else-statement is optional
         if self.is_keyword(Keyword.ELSE):
-            node.add(
+            self.add(node,
                 self.eat_keyword(Keyword.ELSE),
                 self.eat_symbol("{")
             )
             self.parse_statements(node)
-            node.add(
+            self.add(node,
                 self.eat_symbol("}")
             )
-        parent.add(node)
+        self.add(parent, node)
     
     def parse_while_statement(self, parent: TreeNode):
         """
@@ -547,27 +563,191 @@ class ParseTreeBuilder:
             <statements>
         }
         """
-        node = NonTerminalNode(NonTerminalType.WHILE_STATEMENT)
-        node.add(
+        node = self.new_node(NonTerminalType.WHILE_STATEMENT)
+        self.add(node,
             self.eat_keyword(Keyword.WHILE),
             self.eat_symbol("(")
         )
         self.parse_expression(node)
-        node.add(
+        self.add(node,
             self.eat_symbol(")"),
             self.eat_symbol("{"))
         self.parse_statements(node)
-        node.add(
+        self.add(node,
             self.eat_symbol("}")
         )
-        parent.add(node)
+        self.add(parent, node)
+
+    # ----------------------------------------------------------------
+    # dispatch tables by the token
+    # ----------------------------------------------------------------
+    CLASS_MEMBER_PARSERS = {
+        Keyword.FIELD.text: parse_class_var_dec,
+        Keyword.STATIC.text: parse_class_var_dec,
+        Keyword.CONSTRUCTOR.text: parse_subroutine,
+        Keyword.METHOD.text: parse_subroutine,
+        Keyword.FUNCTION.text: parse_subroutine,
+    }
+
+    STATEMENT_PARSERS = {
+        Keyword.LET.text: parse_let,
+        Keyword.DO.text: parse_do,
+        Keyword.RETURN.text: parse_return,
+        Keyword.IF.text: parse_if_statement,
+        Keyword.WHILE.text: parse_while_statement,
+    }
+
+    BINARY_OPERATORS = frozenset(BINARY_OPERATORS.keys() | BINARY_OPERATOR_CALLS.keys())
+    EXPRESSION_END = frozenset(",;)]")
+
+
+class FlatTree:
+    """a parse tree in parallel arrays instead of node objects. node i has the
+    kind KINDS[kinds[i]] and the text strings[tokens[i]], and first_child[i]
+    and next_sibling[i] are node indices or -1. node 0 is the root.
+    a tree is a few arrays and a list of strings, so it pickles quickly.
+    """
+
+    KINDS = (
+        TokenType.KEYWORD,
+        TokenType.SYMBOL,
+        TokenType.IDENTIFIER,
+        TokenType.INT_CONST,
+        TokenType.STRING_CONST,
+    ) + tuple(NonTerminalType)
+    # kind -> token type of the node
+    TOKEN_TYPES = tuple(kind if isinstance(kind, TokenType) else TokenType.NONTERMINAL for kind in KINDS)
+    # text of the token type or nonterminal type -> kind
+    TERMINAL_KINDS = {kind.text: i for i, kind in enumerate(KINDS) if isinstance(kind, TokenType)}
+    NONTERMINAL_KINDS = {kind.text: i for i, kind in enumerate(KINDS) if isinstance(kind, NonTerminalType)}
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.tokens = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        # distinct token texts
+        self.strings: List[str] = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def node(self, index: int) -> "FlatNode":
+        return FlatNode(self, index)
+
+    def root(self) -> "FlatNode":
+        return FlatNode(self, 0)
+
+
+class FlatNode:
+    """a cursor on a node of FlatTree. it has the attributes of TreeNode that
+    CompilationEngine reads, so the engine can walk either tree.
+    """
+    __slots__ = ("tree", "index", "token_type", "token")
+
+    def __init__(self, tree: FlatTree, index: int):
+        self.tree = tree
+        self.index = index
+        self.token_type: TokenType = tree.TOKEN_TYPES[tree.kinds[index]]
+        self.token: str = tree.strings[tree.tokens[index]]
+
+    @property
+    def name(self) -> str:
+        if self.token_type == TokenType.NONTERMINAL:
+            return self.token
+        return self.token_type.text
+
+    @property
+    def nodetype(self) -> NonTerminalType:
+        return self.tree.KINDS[self.tree.kinds[self.index]]
+
+    @property
+    def children(self) -> List["FlatNode"]:
+        tree = self.tree
+        next_sibling = tree.next_sibling
+        children = []
+        child = tree.first_child[self.index]
+        while child >= 0:
+            children.append(FlatNode(tree, child))
+            child = next_sibling[child]
+        return children
+
+    def is_leaf(self):
+        return self.tree.first_child[self.index] < 0
+
+    def has_child(self):
+        return not self.is_leaf()
+
+    def is_terminal(self):
+        return not self.token_type == TokenType.NONTERMINAL
+
+    def to_xml(self, fout, depth=0, show_addenda=False):
+        from xml.sax import saxutils
+        indent = "  " * depth
+        if self.is_terminal():
+            fout.write(f"{indent}<{self.name}> {saxutils.escape(self.token)} </{self.name}>\n")
+            return
+        fout.write(f"{indent}<{self.name}>\n")
+        for child in self.children:
+            child.to_xml(fout, depth+1)
+        fout.write(f"{indent}</{self.name}>\n")
+
+    def __repr__(self):
+        return f"<{self.name}> {self.token} </{self.name}>"
+
+
+class FlatTreeBuilder(ParseTreeBuilder):
+    """builds a FlatTree. nodes are indices to the tree while parsing.
+    """
+
+    def __init__(self, tokenizer: JackTokenizer):
+        super().__init__(tokenizer)
+        self.tree = FlatTree()
+        # the last child of each node to link the next one
+        self.last_child = array("i")
+        self.string_ids: Dict[str, int] = {}
+
+    def build(self) -> FlatTree:
+        self.parse_class()
+        return self.tree
+
+    def _new(self, kind: int, text: str) -> int:
+        tree = self.tree
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(tree.strings)
+            tree.strings.append(text)
+        tree.kinds.append(kind)
+        tree.tokens.append(string_id)
+        tree.first_child.append(-1)
+        tree.next_sibling.append(-1)
+        self.last_child.append(-1)
+        return len(tree.kinds) - 1
+
+    def new_node(self, nodetype: NonTerminalType) -> int:
+        return self._new(FlatTree.NONTERMINAL_KINDS[nodetype.text], nodetype.text)
+
+    def new_leaf(self, token: Token) -> int:
+        return self._new(FlatTree.TERMINAL_KINDS[token.token_type.text], token.token)
+
+    def add(self, parent: int, *children: int):
+        first_child = self.tree.first_child
+        next_sibling = self.tree.next_sibling
+        last_child = self.last_child
+        for child in children:
+            last = last_child[parent]
+            if last < 0:
+                first_child[parent] = child
+            else:
+                next_sibling[last] = child
+            last_child[parent] = child
 
 
 def main():
     import sys
     input_filename = sys.argv[1]
     input_file = open(input_filename, "r")
-    tokenizer = JackTokenizer(input_file)
+    tokenizer = RegexJackTokenizer(input_file)
 
     output_filename = input_filename.replace(".jack", ".mine.xml")
     output_file = open(output_filename, "w")
@@ -0,0 +1,566 @@
+"""executes VM code directly, without translating it into Hack assembly
+"""
+from VMTranslator import Parser, Command, CommandType
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import math
+import os.path
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+RAM_SIZE = 1 << 15
+STACK_BASE = 256
+STATIC_BASE = 16
+TEMP_BASE = 5
+
+# opcodes of the resolved commands, grouped so that run() dispatches by ranges
+# push: 0-6
+PUSH_CONSTANT = 0
+PUSH_LOCAL = 1
+PUSH_ARGUMENT = 2
+PUSH_THIS = 3
+PUSH_THAT = 4
+PUSH_ADDRESS = 5    # temp and static are resolved to fixed addresses
+PUSH_POINTER = 6
+# pop: 7-12
+POP_LOCAL = 7
+POP_ARGUMENT = 8
+POP_THIS = 9
+POP_THAT = 10
+POP_ADDRESS = 11
+POP_POINTER = 12
+# arithmetic: 13-21
+ADD = 13
+SUB = 14
+NEG = 15
+EQ = 16
+GT = 17
+LT = 18
+AND = 19
+OR = 20
+NOT = 21
+# program flow: 22-27
+IF_GOTO = 22
+GOTO = 23
+CALL = 24
+FUNCTION = 25
+RETURN = 26
+NATIVE = 27
+HALT = 28
+END = 29            # after the last command
+UNDEFINED = 30      # call of a function that is not loaded
+
+ARITHMETIC_OPCODES = {
+    "add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT,
+    "and": AND, "or": OR, "not": NOT,
+}
+
+PUSH_OPCODES = {
+    "constant": PUSH_CONSTANT,
+    "local": PUSH_LOCAL,
+    "argument": PUSH_ARGUMENT,
+    "this": PUSH_THIS,
+    "that": PUSH_THAT,
+}
+
+POP_OPCODES = {
+    "local": POP_LOCAL,
+    "argument": POP_ARGUMENT,
+    "this": POP_THIS,
+    "that": POP_THAT,
+}
+
+
+# ----------------------------------------------------------------
+# native functions
+# ----------------------------------------------------------------
+# function name -> Python implementation (vm, arguments) -> return value.
+# arguments and the return value are unsigned 16-bit integers.
+NATIVES: Dict[str, Callable[["VMEmulator", List[int]], int]] = {}
+
+
+def native(name: str):
+    """register a Python implementation of a VM function
+    """
+    def register(func):
+        NATIVES[name] = func
+        return func
+    return register
+
+
+def to_signed(value: int) -> int:
+    return value - 0x10000 if value & SIGN_BIT else value
+
+
+@native("Math.multiply")
+def _math_multiply(vm: "VMEmulator", args: List[int]) -> int:
+    return (args[0] * args[1]) & WORD_MASK
+
+
+def _wrap(value: int) -> int:
+    """wrap around into a signed 16-bit integer
+    """
+    return to_signed(value & WORD_MASK)
+
+
+def _divide(x: int, y: int) -> Optional[int]:
+    """same algorithm as os/Math.jack on signed 16-bit integers, including the
+    wrap-around of 2*q*y. returns None where the Jack implementation recurses
+    forever: y is 0, or y+y overflows to 0 before y exceeds x.
+    """
+    xneg, yneg = x < 0, y < 0
+    x = _wrap(-x) if xneg else x
+    y = _wrap(-y) if yneg else y
+    if y > x:
+        return 0
+    if y == 0:
+        # divide(x, 0) calls itself again. y+y gets here after overflowing
+        # unless x is -32768, whose absolute value does not fit either
+        return None
+    q = _divide(x, _wrap(y + y))
+    if q is None:
+        return None
+    if _wrap(x - _wrap(_wrap(2 * q) * y)) < y:
+        res = _wrap(q + q)
+    else:
+        res = _wrap(q + q + 1)
+    if xneg != yneg:
+        res = _wrap(-res)
+    return res
+
+
+@native("Math.divide")
+def _math_divide(vm: "VMEmulator", args: List[int]) -> int:
+    x, y = to_signed(args[0]), to_signed(args[1])
+    res = _divide(x, y)
+    if res is None:
+        raise RuntimeError(f"Math.divide({x}, {y}) does not terminate in os/Math.jack")
+    return res & WORD_MASK
+
+
+@native("Math.sqrt")
+def _math_sqrt(vm: "VMEmulator", args: List[int]) -> int:
+    x = to_signed(args[0])
+    return math.isqrt(x) if x > 0 else 0
+
+
+def _heap_address(address: int) -> int:
+    if not 0 <= address < RAM_SIZE:
+        raise RuntimeError(f"corrupted heap: address {address} is out of RAM")
+    return address
+
+
+# same algorithm as os/Memory.jack, so the heap can be shared with the Jack
+# implementation. static 1 of Memory is the head of the free list.
+# a corrupted free list raises RuntimeError, where the Jack code would read
+# and write anywhere or loop forever.
+@native("Memory.alloc")
+def _memory_alloc(vm: "VMEmulator", args: List[int]) -> int:
+    ram = vm.ram
+    size = args[0]
+    addr = ram[vm.static_address("Memory", 1)]
+    # a fragment takes at least 2 words, so a longer list has a cycle
+    for _ in range(RAM_SIZE // 2):
+        if not to_signed(addr) > 0:
+            return 0
+        _heap_address(addr + 1)
+        # the first fragment whose size >= size+2
+        if not to_signed(ram[addr + 1]) < to_signed((size + 2) & WORD_MASK):
+            ram[addr + 1] = (ram[addr + 1] - (size + 2)) & WORD_MASK
+            new_addr = (addr + ram[addr + 1] + 4) & WORD_MASK
+            _heap_address(new_addr - 2)
+            _heap_address(new_addr - 1)
+            ram[new_addr - 2] = 0
+            ram[new_addr - 1] = size
+            return new_addr
+        addr = ram[addr]
+    raise RuntimeError("corrupted heap: the free list has a cycle")
+
+
+@native("Memory.deAlloc")
+def _memory_dealloc(vm: "VMEmulator", args: List[int]) -> int:
+    ram = vm.ram
+    free_list = vm.static_address("Memory", 1)
+    segment = _heap_address((args[0] - 2) & WORD_MASK)
+    ram[segment] = ram[free_list]
+    ram[free_list] = segment
+    return 0
+
+
+class _StackUnderflow(Exception):
+    """raised in run() by a command popping more values than the stack has
+    """
+
+
+class VMEmulator(object):
+    """Loads .vm files and runs them on a 32K RAM. All the values are unsigned
+    16-bit integers.
+
+    Function names and labels are resolved into indices of the command list
+    once when loading, and static variables into RAM addresses. Call frames
+    are kept in a Python list, while the operand stack lives in RAM from 256.
+    Calling Sys.halt stops the execution.
+
+    Functions listed in 'natives' are served by the Python implementations in
+    NATIVES instead of their VM code. They can be switched per function with
+    use_native() to compare them against the Jack implementations.
+
+    Example:
+    vm = VMEmulator.from_path("project9/Lifegame", natives=["Math.multiply"])
+    vm.start()
+    vm.run(max_steps=1000000)
+    """
+
+    HALT_FUNCTION = "Sys.halt"
+
+    def __init__(self, natives: Iterable[str] = ()):
+        self.natives = set()
+        for name in natives:
+            self.use_native(name)
+        self.native_functions: List[Callable[["VMEmulator", List[int]], int]] = []
+        self.commands: List[Tuple[str, Command]] = []  # (namespace, command)
+        self.ops: List[int] = []
+        self.args1: List[int] = []
+        self.args2: List[int] = []
+        # commands by pc for error messages
+        self.linked: List[Command] = []
+        self.functions: Dict[str, int] = {}
+        self.statics: Dict[str, int] = {}
+        self.ram: List[int] = [0] * RAM_SIZE
+        self.frames: List[Tuple[int, int, int, int, int]] = []
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+
+    # ----------------------------------------------------------------
+    # loading
+    # ----------------------------------------------------------------
+    @classmethod
+    def from_path(cls, path: str, natives: Iterable[str] = ()) -> "VMEmulator":
+        """load a .vm file or all the .vm files in a directory
+        """
+        import glob
+        if path.endswith(".vm"):
+            filenames = [path]
+        else:
+            filenames = sorted(glob.glob(os.path.join(path, "*.vm")))
+        vm = VMEmulator(natives)
+        for filename in filenames:
+            with open(filename) as f:
+                vm.load(f, os.path.splitext(os.path.basename(filename))[0])
+        vm.link()
+        return vm
+
+    def load(self, f, namespace: str):
+        """parse VM commands of a file. call link() after loading all the files.
+        """
+        parser = Parser(f)
+        while True:
+            parser.advance()
+            if not parser.has_more_commands():
+                break
+            self.commands.append((namespace, parser.get_current_command()))
+
+    def use_native(self, name: str, enabled: bool = True):
+        """switch a function to/from its native implementation.
+        call link() again to apply it to loaded code.
+        """
+        if name not in NATIVES:
+            raise ValueError(f"no native implementation of {name}")
+        if enabled:
+            self.natives.add(name)
+        else:
+            self.natives.discard(name)
+
+    def static_address(self, namespace: str, index: int) -> int:
+        name = f"{namespace}.{index}"
+        if name not in self.statics:
+            self.statics[name] = STATIC_BASE + len(self.statics)
+        return self.statics[name]
+
+    def link(self):
+        """resolve labels, functions and segments into opcodes and integers
+        """
+        # labels are scoped by the function
+        labels: Dict[str, int] = {}
+        function = ""
+        index = 0
+        for namespace, cmd in self.commands:
+            if cmd.command == CommandType.FUNCTION:
+                function = cmd.arg1
+                self.functions[function] = index
+            if cmd.command == CommandType.LABEL:
+                labels[f"{function}${cmd.arg1}"] = index
+            else:
+                index += 1
+
+        self.ops, self.args1, self.args2 = [], [], []
+        self.linked = []
+        self.native_functions = []
+        function = ""
+        for namespace, cmd in self.commands:
+            if cmd.command == CommandType.LABEL:
+                continue
+            if cmd.command == CommandType.FUNCTION:
+                function = cmd.arg1
+            op, arg1, arg2 = self._resolve(namespace, function, cmd, labels)
+            self.ops.append(op)
+            self.args1.append(arg1)
+            self.args2.append(arg2)
+            self.linked.append(cmd)
+        self.ops.append(END)
+        self.args1.append(0)
+        self.args2.append(0)
+        self.linked.append(Command(CommandType.LABEL, "end of program", None, None))
+
+    def _resolve(self, namespace: str, function: str, cmd: Command,
+                 labels: Dict[str, int]) -> Tuple[int, int, int]:
+        if cmd.command == CommandType.PUSH or cmd.command == CommandType.POP:
+            segment, index = cmd.arg1, cmd.arg2
+            is_push = cmd.command == CommandType.PUSH
+            if segment == "pointer":
+                return (PUSH_POINTER if is_push else POP_POINTER), index, 0
+            if segment == "temp":
+                return (PUSH_ADDRESS if is_push else POP_ADDRESS), TEMP_BASE + index, 0
+            if segment == "static":
+                address = self.static_address(namespace, index)
+                return (PUSH_ADDRESS if is_push else POP_ADDRESS), address, 0
+            opcodes = PUSH_OPCODES if is_push else POP_OPCODES
+            if segment not in opcodes:
+                raise ValueError(f"invalid command: {cmd.op} {segment} {index}")
+            return opcodes[segment], index, 0
+        elif cmd.command == CommandType.ARITHMETIC:
+            return ARITHMETIC_OPCODES[cmd.op], 0, 0
+        elif cmd.command == CommandType.GOTO or cmd.command == CommandType.IF:
+            label = f"{function}${cmd.arg1}"
+            if label not in labels:
+                raise RuntimeError(f"undefined label {cmd.arg1} in {function}")
+            return (GOTO if cmd.command == CommandType.GOTO else IF_GOTO), labels[label], 0
+        elif cmd.command == CommandType.CALL:
+            if cmd.arg1 == self.HALT_FUNCTION:
+                return HALT, 0, 0
+            if cmd.arg1 in self.natives:
+                self.native_functions.append(NATIVES[cmd.arg1])
+                return NATIVE, len(self.native_functions) - 1, cmd.arg2
+            if cmd.arg1 not in self.functions:
+                # reported when called, so that unused calls can stay unresolved
+                return UNDEFINED, 0, cmd.arg2
+            return CALL, self.functions[cmd.arg1], cmd.arg2
+        elif cmd.command == CommandType.FUNCTION:
+            return FUNCTION, cmd.arg2, 0
+        elif cmd.command == CommandType.RETURN:
+            return RETURN, 0, 0
+        raise NotImplementedError(cmd)
+
+    # ----------------------------------------------------------------
+    # execution
+    # ----------------------------------------------------------------
+    def start(self, function: str = "Sys.init", args: List[int] = ()):
+        """prepare to call a function. returning from it stops the execution.
+        """
+        if function not in self.functions:
+            raise RuntimeError(f"undefined function {function}")
+        ram = self.ram
+        sp = STACK_BASE
+        for value in args:
+            ram[sp] = value & WORD_MASK
+            sp += 1
+        ram[0], ram[1], ram[2] = sp, sp, sp - len(args)
+        self.frames = []
+        self.pc = self.functions[function]
+        self.halted = False
+
+    def run(self, max_steps: int = 1 << 62) -> int:
+        """execute until halting or max_steps commands. returns the number of
+        executed commands.
+        """
+        ops, args1, args2 = self.ops, self.args1, self.args2
+        native_functions = self.native_functions
+        ram = self.ram
+        frames = self.frames
+        pc = self.pc
+        sp, lcl, arg, this, that = ram[0], ram[1], ram[2], ram[3], ram[4]
+
+        n = 0
+        # addresses from local, argument, this and that are not checked in the
+        # loop; the list raises IndexError beyond the RAM instead. the stack
+        # pointer is checked where it decreases, since a negative index would
+        # silently read the end of the RAM
+        try:
+            while n < max_steps:
+                op = ops[pc]
+                x = args1[pc]
+                pc += 1
+                n += 1
+                if op <= PUSH_POINTER:
+                    if op == PUSH_CONSTANT:
+                        ram[sp] = x
+                    elif op == PUSH_LOCAL:
+                        ram[sp] = ram[lcl + x]
+                    elif op == PUSH_ARGUMENT:
+                        ram[sp] = ram[arg + x]
+                    elif op == PUSH_THIS:
+                        ram[sp] = ram[this + x]
+                    elif op == PUSH_THAT:
+                        ram[sp] = ram[that + x]
+                    elif op == PUSH_ADDRESS:
+                        ram[sp] = ram[x]
+                    else:
+                        ram[sp] = that if x else this
+                    sp += 1
+                elif op <= POP_POINTER:
+                    sp -= 1
+                    if sp < STACK_BASE:
+                        raise _StackUnderflow
+                    if op == POP_LOCAL:
+                        ram[lcl + x] = ram[sp]
+                    elif op == POP_ARGUMENT:
+                        ram[arg + x] = ram[sp]
+                    elif op == POP_THIS:
+                        ram[this + x] = ram[sp]
+                    elif op == POP_THAT:
+                        ram[that + x] = ram[sp]
+                    elif op == POP_ADDRESS:
+                        ram[x] = ram[sp]
+                    elif x == 0:
+                        this = ram[sp]
+                    else:
+                        that = ram[sp]
+                elif op <= NOT:
+                    if sp <= STACK_BASE:
+                        raise _StackUnderflow
+                    if op == NOT:
+                        ram[sp - 1] ^= WORD_MASK
+                        continue
+                    elif op == NEG:
+                        ram[sp - 1] = -ram[sp - 1] & WORD_MASK
+                        continue
+                    sp -= 1
+                    if sp <= STACK_BASE:
+                        raise _StackUnderflow
+                    if op == ADD:
+                        ram[sp - 1] = (ram[sp - 1] + ram[sp]) & WORD_MASK
+                    elif op == SUB:
+                        ram[sp - 1] = (ram[sp - 1] - ram[sp]) & WORD_MASK
+                    elif op == EQ:
+                        ram[sp - 1] = WORD_MASK if ram[sp - 1] == ram[sp] else 0
+                    elif op == GT:
+                        ram[sp - 1] = WORD_MASK if ram[sp - 1] ^ SIGN_BIT > ram[sp] ^ SIGN_BIT else 0
+                    elif op == LT:
+                        ram[sp - 1] = WORD_MASK if ram[sp - 1] ^ SIGN_BIT < ram[sp] ^ SIGN_BIT else 0
+                    elif op == AND:
+                        ram[sp - 1] &= ram[sp]
+                    else:
+                        ram[sp - 1] |= ram[sp]
+                elif op == IF_GOTO:
+                    sp -= 1
+                    if sp < STACK_BASE:
+                        raise _StackUnderflow
+                    if ram[sp]:
+                        pc = x
+                elif op == GOTO:
+                    pc = x
+                elif op == CALL:
+                    frames.append((pc, lcl, arg, this, that))
+                    arg = sp - args2[pc - 1]
+                    lcl = sp
+                    pc = x
+                elif op == NATIVE:
+                    nargs = args2[pc - 1]
+                    sp -= nargs
+                    if sp < STACK_BASE:
+                        raise _StackUnderflow
+                    ram[sp] = native_functions[x](self, ram[sp:sp + nargs])
+                    sp += 1
+                elif op == FUNCTION:
+                    for _ in range(x):
+                        ram[sp] = 0
+                        sp += 1
+                elif op == RETURN:
+                    ram[arg] = ram[sp - 1]
+                    sp = arg + 1
+                    if not frames:
+                        # returned from the entry function
+                        self.halted = True
+                        break
+                    pc, lcl, arg, this, that = frames.pop()
+                elif op == HALT:
+                    self.halted = True
+                    break
+                elif op == UNDEFINED:
+                    pc -= 1
+                    raise RuntimeError(f"undefined function {self.linked[pc].arg1} "
+                                       f"called at {self.describe(pc)}")
+                else:
+                    pc -= 1
+                    raise RuntimeError("the program ran past its last command")
+
+        except (IndexError, _StackUnderflow) as e:
+            pc -= 1
+            error = "stack underflow" if isinstance(e, _StackUnderflow) else "RAM address out of range"
+            raise RuntimeError(f"{error} at {self.describe(pc)} "
+                               f"(SP={sp}, LCL={lcl}, ARG={arg}, THIS={this}, THAT={that})") from None
+        finally:
+            self.pc = pc
+            ram[0], ram[1], ram[2], ram[3], ram[4] = sp, lcl, arg, this, that
+            self.steps += n
+        return n
+
+    def describe(self, pc: int) -> str:
+        """the command at pc and the function containing it
+        """
+        cmd = self.linked[pc]
+        text = " ".join(str(arg) for arg in (cmd.op, cmd.arg1, cmd.arg2) if arg is not None)
+        function = max(((start, name) for name, start in self.functions.items() if start <= pc),
+                       default=(0, "no function"))[1]
+        return f"'{text}' in {function} (pc {pc})"
+
+    def return_value(self) -> int:
+        """the value on top of the stack, e.g. after returning from the entry function
+        """
+        return self.ram[self.ram[0] - 1]
+
+    def call(self, function: str, args: List[int] = (), max_steps: int = 1 << 62) -> int:
+        """call a function and returns its return value
+        """
+        self.start(function, args)
+        self.run(max_steps)
+        if not self.halted:
+            raise RuntimeError(f"{function} did not return in {max_steps} steps")
+        return self.return_value()
+
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help=".vm file or directory")
+    parser.add_argument("--function", default="Sys.init", help="entry function")
+    parser.add_argument("--steps", type=int, default=10000000,
+                        help="maximum number of commands to execute")
+    parser.add_argument("--dump", type=int, nargs=2, metavar=("START", "END"),
+                        help="print RAM[START:END] after the execution")
+    parser.add_argument("--native", action="append", default=[], choices=NATIVES.keys(),
+                        help="use the native implementation of the function")
+    parser.add_argument("--natives", action="store_true",
+                        help="use all the native implementations")
+    args = parser.parse_args()
+
+    natives = NATIVES.keys() if args.natives else args.native
+    vm = VMEmulator.from_path(args.path, natives)
+    vm.start(args.function)
+    start = time.perf_counter()
+    steps = vm.run(args.steps)
+    elapsed = time.perf_counter() - start
+
+    status = "halted" if vm.halted else "stopped"
+    print(f"{status} after {steps} commands")
+    print(f"{elapsed:.3f} sec ({steps / elapsed:,.0f} commands/sec)")
+    if args.dump:
+        start, end = args.dump
+        for address in range(start, end):
+            print(f"RAM[{address}] = {vm.ram[address]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import io
 import enum
 import collections
-from typing import List
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 import os.path
 
 
@@ -15,7 +15,12 @@ class CommandType(enum.Enum):
     IF = enum.auto(),
     FUNCTION = enum.auto(),
     RETURN = enum.auto(),
-    CALL = enum.auto()
+    CALL = enum.auto(),
+    # fused commands. see CommandFuser
+    COMPARE_IF = enum.auto(),
+    MOVE = enum.auto(),
+    ADD_CONSTANT = enum.auto(),
+    INCREMENT = enum.auto()
 
 
 class Command(collections.namedtuple("Command", ["command", "op", "arg1", "arg2"])):
@@ -107,12 +112,437 @@ class Parser:
 
     def get_current_command(self):
         return self.current_command
+
+    def commands(self) -> Iterator[Command]:
+        """iterate over the remaining commands
+        """
+        while True:
+            self.advance()
+            if not self.has_more_commands():
+                break
+            yield self.get_current_command()
     
     def close(self):
         self.f.close()
 
 
 
+class CommandFuser(object):
+    """Replaces short idioms of VM commands with fused commands.
+
+    PATTERNS is the table of (name, number of commands, matcher). A matcher
+    takes the commands at the current position and returns the fused command
+    or None. Patterns are tried in order, so longer ones come first.
+    The number of hits per pattern is counted in self.counts.
+
+    Fused commands:
+    COMPARE_IF ... op = lt|gt|eq, arg1 = label, arg2 = 1 if negated
+    MOVE       ... arg1 = (segment, index) to push, arg2 = (segment, index) to pop
+    ADD_CONSTANT . op = add|sub, arg2 = constant
+    INCREMENT  ... op = add|sub, arg1 = (segment, index), arg2 = constant
+    """
+
+    BRANCH_PATTERNS = ["compare-not-if", "compare-if"]
+
+    def __init__(self, patterns: Optional[List[str]] = None):
+        """patterns: names of the patterns to apply. all of them by default.
+        """
+        self.patterns = [p for p in self.PATTERNS if patterns is None or p[0] in patterns]
+        self.counts = collections.Counter()
+
+    @staticmethod
+    def _match_increment(cmds: List[Command]) -> Optional[Command]:
+        """push S i; push constant c; add|sub; pop S i
+        """
+        push, constant, op, pop = cmds
+        if (push.command == CommandType.PUSH and push.arg1 != "constant"
+                and constant.command == CommandType.PUSH and constant.arg1 == "constant"
+                and op.op in ("add", "sub")
+                and pop.command == CommandType.POP
+                and (pop.arg1, pop.arg2) == (push.arg1, push.arg2)):
+            return Command(CommandType.INCREMENT, op.op, (push.arg1, push.arg2), constant.arg2)
+        return None
+
+    @staticmethod
+    def _match_compare_not_if(cmds: List[Command]) -> Optional[Command]:
+        """lt|gt|eq; not; if-goto L
+        """
+        compare, negate, branch = cmds
+        if compare.op in ("lt", "gt", "eq") and negate.op == "not" and branch.command == CommandType.IF:
+            return Command(CommandType.COMPARE_IF, compare.op, branch.arg1, 1)
+        return None
+
+    @staticmethod
+    def _match_compare_if(cmds: List[Command]) -> Optional[Command]:
+        """lt|gt|eq; if-goto L
+        """
+        compare, branch = cmds
+        if compare.op in ("lt", "gt", "eq") and branch.command == CommandType.IF:
+            return Command(CommandType.COMPARE_IF, compare.op, branch.arg1, 0)
+        return None
+
+    @staticmethod
+    def _match_move(cmds: List[Command]) -> Optional[Command]:
+        """push S i; pop T j
+        """
+        push, pop = cmds
+        if push.command == CommandType.PUSH and pop.command == CommandType.POP:
+            return Command(CommandType.MOVE, "move", (push.arg1, push.arg2), (pop.arg1, pop.arg2))
+        return None
+
+    @staticmethod
+    def _match_add_constant(cmds: List[Command]) -> Optional[Command]:
+        """push constant c; add|sub
+        """
+        constant, op = cmds
+        if constant.command == CommandType.PUSH and constant.arg1 == "constant" and op.op in ("add", "sub"):
+            return Command(CommandType.ADD_CONSTANT, op.op, None, constant.arg2)
+        return None
+
+    PATTERNS = [
+        ("push-add-pop", 4, _match_increment.__func__),
+        ("compare-not-if", 3, _match_compare_not_if.__func__),
+        ("compare-if", 2, _match_compare_if.__func__),
+        ("push-pop", 2, _match_move.__func__),
+        ("push-constant-add", 2, _match_add_constant.__func__),
+    ]
+
+    def fuse(self, commands: List[Command]) -> List[Command]:
+        fused = []
+        i = 0
+        while i < len(commands):
+            for name, length, match in self.patterns:
+                if i + length > len(commands):
+                    continue
+                cmd = match(commands[i:i+length])
+                if cmd is not None:
+                    fused.append(cmd)
+                    self.counts[name] += 1
+                    i += length
+                    break
+            else:
+                fused.append(commands[i])
+                i += 1
+        return fused
+
+    def report(self) -> str:
+        hits = ", ".join(f"{name}={self.counts[name]}" for name, _, _ in self.patterns)
+        return f"Fused: {hits}"
+
+
+class Fragment(collections.namedtuple("Fragment", ["asm", "before", "after", "fused", "ncalls", "nreturns"])):
+    """translated assembly of a file and its statistics
+
+    before, after ... number of instructions before and after the peephole optimization
+    fused ... hits of the CommandFuser patterns
+    ncalls, nreturns ... number of call and return commands
+    """
+
+
+def translate_commands(namespace: str, commands: List[Command], optimize: bool = False,
+                       shared: bool = False, tos: bool = False) -> Fragment:
+    """translate the commands of a file independently of the other files
+    """
+    out = io.StringIO()
+    optimizer = PeepholeOptimizer(out) if optimize else None
+    writer = CodeWriter(optimizer if optimizer else out, shared=shared, tos=tos)
+    fuser = CommandFuser()
+    writer.set_namespace(namespace)
+    if optimize:
+        commands = fuser.fuse(commands)
+    for cmd in commands:
+        writer.write_command(cmd)
+    writer.flush()
+    before = after = PeepholeOptimizer.count_instructions(out.getvalue().splitlines())
+    if optimizer:
+        before, after = optimizer.flush(namespace)
+    return Fragment(out.getvalue(), before, after, dict(fuser.counts), writer.ncalls, writer.nreturns)
+
+
+def translate_file(namespace: str, source: str, commands: Optional[List[Command]],
+                   optimize: bool = False, shared: bool = False, tos: bool = False) -> Fragment:
+    """translate a file given as the source or the parsed commands.
+    runs in worker processes in the parallel mode.
+    """
+    if commands is None:
+        commands = list(Parser(io.StringIO(source)).commands())
+    return translate_commands(namespace, commands, optimize, shared, tos)
+
+
+def translated_size(namespace: str, commands: List[Command], **options) -> int:
+    """number of instructions of the commands translated by CodeWriter(**options)
+    without the peephole optimization
+    """
+    out = io.StringIO()
+    writer = CodeWriter(out, **options)
+    writer.set_namespace(namespace)
+    for cmd in commands:
+        writer.write_command(cmd)
+    writer.flush()
+    return PeepholeOptimizer.count_instructions(out.getvalue().splitlines())
+
+
+class CallGraph(object):
+    """Call graph of VM functions built from call commands.
+
+    Commands outside of any function are treated as a root, as well as the
+    root function given to reachable().
+    """
+
+    def __init__(self, files: List[Tuple[str, List[Command]]]):
+        """files: (namespace, commands) of each file
+        """
+        # function -> (namespace, commands from the function command)
+        self.functions: Dict[str, Tuple[str, List[Command]]] = {}
+        # function -> called functions. "" for commands outside of functions
+        self.calls: Dict[str, Set[str]] = {"": set()}
+        for namespace, commands in files:
+            function = ""
+            for cmd in commands:
+                if cmd.command == CommandType.FUNCTION:
+                    function = cmd.arg1
+                    self.functions[function] = (namespace, [])
+                    self.calls[function] = set()
+                if function:
+                    self.functions[function][1].append(cmd)
+                if cmd.command == CommandType.CALL:
+                    self.calls[function].add(cmd.arg1)
+
+    def reachable(self, root: str = "Sys.init") -> Set[str]:
+        visited = set()
+        stack = [root, ""]
+        while stack:
+            function = stack.pop()
+            if function in visited:
+                continue
+            visited.add(function)
+            stack.extend(self.calls.get(function, ()))
+        visited.discard("")
+        return visited
+
+    def is_recursive(self, function: str) -> bool:
+        """True if the function can call itself directly or indirectly
+        """
+        visited = set()
+        stack = list(self.calls.get(function, ()))
+        while stack:
+            callee = stack.pop()
+            if callee == function:
+                return True
+            if callee in visited:
+                continue
+            visited.add(callee)
+            stack.extend(self.calls.get(callee, ()))
+        return False
+
+    @staticmethod
+    def prune(files: List[Tuple[str, List[Command]]], functions: Set[str]) -> List[Tuple[str, List[Command]]]:
+        """remove the functions not in 'functions' from files
+        """
+        pruned = []
+        for namespace, commands in files:
+            keep = True
+            kept = []
+            for cmd in commands:
+                if cmd.command == CommandType.FUNCTION:
+                    keep = cmd.arg1 in functions
+                if keep:
+                    kept.append(cmd)
+            pruned.append((namespace, kept))
+        return pruned
+
+
+class Inliner(object):
+    """Inlines small non-recursive functions at call sites.
+
+    The arguments and the local variables of the inlined function are moved to
+    fresh local variables of the caller, which are shared by all the inlined
+    call sites of the caller. THIS and THAT are saved and restored if the
+    inlined function sets them. Labels are renamed and return jumps to the end
+    of the inlined body, leaving the return value on the stack.
+
+    Functions are inlined bottom-up until no call site is left or the growth
+    of the program in VM commands exceeds the budget.
+    """
+
+    MAX_SIZE = 40
+    BUDGET = 2000
+    # entry points known to the emulators, e.g. Sys.halt ends a program
+    NOT_INLINED = {"Sys.init", "Sys.halt"}
+
+    def __init__(self, max_size: int = MAX_SIZE, budget: int = BUDGET):
+        """max_size: maximum number of commands of an inlined function
+        budget: maximum growth of the program in VM commands
+        """
+        self.max_size = max_size
+        self.budget = budget
+        self.growth = 0
+        # number of inlined call sites, also used to rename labels
+        self.count = 0
+        # (caller, callee) -> number of inlined call sites
+        self.sites = collections.Counter()
+        # (caller, callee) -> assembly instructions of the call sequence saved per call
+        self.savings: Dict[Tuple[str, str], int] = {}
+
+    def inline(self, files: List[Tuple[str, List[Command]]]) -> List[Tuple[str, List[Command]]]:
+        while True:
+            count = self.count
+            graph = CallGraph(files)
+            candidates = {function for function in graph.functions if self._is_candidate(graph, function)}
+            files = [(namespace, self._inline_file(graph, candidates, commands))
+                     for namespace, commands in files]
+            if self.count == count:
+                return files
+
+    def _is_candidate(self, graph: CallGraph, function: str) -> bool:
+        namespace, commands = graph.functions[function]
+        return (function not in self.NOT_INLINED
+                and len(commands) - 1 <= self.max_size
+                and not graph.is_recursive(function)
+                and self._is_balanced(commands[1:]))
+
+    @staticmethod
+    def _is_balanced(body: List[Command]) -> bool:
+        """True if the stack has exactly the return value at every return
+        """
+        BINARY = CodeWriter.BINARY_OPERATORS
+        depths: Dict[str, int] = {}
+        depth: Optional[int] = 0  # None if unreachable
+
+        def branch(label: str) -> bool:
+            return depths.setdefault(label, depth) == depth
+
+        for cmd in body:
+            if cmd.command == CommandType.LABEL:
+                if depth is None:
+                    depth = depths.get(cmd.arg1, None)
+                    if depth is None:
+                        return False
+                if not branch(cmd.arg1):
+                    return False
+                continue
+            if depth is None:
+                continue
+            if cmd.command == CommandType.PUSH:
+                depth += 1
+            elif cmd.command == CommandType.POP:
+                depth -= 1
+            elif cmd.command == CommandType.ARITHMETIC:
+                depth -= cmd.op in BINARY
+            elif cmd.command == CommandType.IF:
+                depth -= 1
+                if not branch(cmd.arg1):
+                    return False
+            elif cmd.command == CommandType.GOTO:
+                if not branch(cmd.arg1):
+                    return False
+                depth = None
+            elif cmd.command == CommandType.CALL:
+                depth += 1 - cmd.arg2
+            elif cmd.command == CommandType.RETURN:
+                if depth != 1:
+                    return False
+                depth = None
+            else:
+                return False
+            if depth is not None and depth < 0:
+                return False
+        return depth is None
+
+    def _inline_file(self, graph: CallGraph, candidates: Set[str], commands: List[Command]) -> List[Command]:
+        inlined: List[Command] = []
+        caller = ""
+        caller_index = 0  # index of the function command of the caller
+        nlocals = 0
+        extra = 0         # local variables added to the caller
+        for cmd in commands:
+            if cmd.command == CommandType.FUNCTION:
+                if caller and extra:
+                    inlined[caller_index] = inlined[caller_index]._replace(arg2=nlocals + extra)
+                caller, caller_index, nlocals, extra = cmd.arg1, len(inlined), cmd.arg2, 0
+            elif (cmd.command == CommandType.CALL and caller and cmd.arg1 in candidates
+                  and cmd.arg1 != caller):
+                namespace, callee = graph.functions[cmd.arg1]
+                code, slots, saving = self._expand(callee, cmd.arg2, nlocals,
+                                                   graph.functions[caller][0] == namespace)
+                if code is not None and saving > 0 and self.growth + len(code) - 1 <= self.budget:
+                    self.growth += len(code) - 1
+                    self.count += 1
+                    inlined.extend(code)
+                    extra = max(extra, slots)
+                    self.sites[caller, cmd.arg1] += 1
+                    self.savings[caller, cmd.arg1] = saving
+                    continue
+            inlined.append(cmd)
+        if caller and extra:
+            inlined[caller_index] = inlined[caller_index]._replace(arg2=nlocals + extra)
+        return inlined
+
+    def _expand(self, callee: List[Command], nargs: int, base: int,
+                same_namespace: bool) -> Tuple[Optional[List[Command]], int, int]:
+        """returns the commands replacing 'call callee nargs', the number of
+        local variables used from 'base' and the number of assembly instructions
+        saved per call, or (None, 0, 0) if it cannot be inlined.
+        """
+        function, body = callee[0], callee[1:]
+        nvars = function.arg2
+        saved = sorted({cmd.arg2 for cmd in body if cmd.command == CommandType.POP and cmd.arg1 == "pointer"})
+        for cmd in body:
+            if cmd.command not in (CommandType.PUSH, CommandType.POP):
+                continue
+            if cmd.arg1 == "static" and not same_namespace:
+                return None, 0, 0
+            if cmd.arg1 == "argument" and cmd.arg2 >= nargs:
+                return None, 0, 0
+
+        prefix = f"INLINE{self.count}"
+        end = f"{prefix}.END"
+        # arguments and local variables
+        prologue = []
+        for i in reversed(range(nargs)):
+            prologue.append(Command(CommandType.POP, "pop", "local", base + i))
+        for i in range(nvars):
+            prologue.append(Command(CommandType.PUSH, "push", "constant", 0))
+            prologue.append(Command(CommandType.POP, "pop", "local", base + nargs + i))
+        for i, pointer in enumerate(saved):
+            prologue.append(Command(CommandType.PUSH, "push", "pointer", pointer))
+            prologue.append(Command(CommandType.POP, "pop", "local", base + nargs + nvars + i))
+        epilogue = [Command(CommandType.LABEL, "label", end, None)]
+        for i, pointer in enumerate(saved):
+            epilogue.append(Command(CommandType.PUSH, "push", "local", base + nargs + nvars + i))
+            epilogue.append(Command(CommandType.POP, "pop", "pointer", pointer))
+        # body
+        code = []
+        for cmd in body:
+            # labels may be named like segments, e.g. 'label local'
+            if cmd.command in (CommandType.LABEL, CommandType.GOTO, CommandType.IF):
+                cmd = cmd._replace(arg1=f"{prefix}.{cmd.arg1}")
+            elif cmd.command == CommandType.RETURN:
+                cmd = Command(CommandType.GOTO, "goto", end, None)
+            elif cmd.command in (CommandType.PUSH, CommandType.POP):
+                if cmd.arg1 == "argument":
+                    cmd = cmd._replace(arg1="local", arg2=base + cmd.arg2)
+                elif cmd.arg1 == "local":
+                    cmd = cmd._replace(arg2=base + nargs + cmd.arg2)
+            code.append(cmd)
+        if code[-1].command == CommandType.GOTO and code[-1].arg1 == end:
+            code.pop()
+
+        # the frame of call/return against moving the arguments and the variables
+        call = [Command(CommandType.CALL, "call", function.arg1, nargs), function,
+                Command(CommandType.RETURN, "return", None, None)]
+        saving = translated_size("", call) - translated_size("", prologue + epilogue)
+        return prologue + code + epilogue, nargs + nvars + len(saved), saving
+
+    def report(self) -> str:
+        lines = []
+        for (caller, callee), count in sorted(self.sites.items()):
+            lines.append(f"Inlined: {callee} into {caller} at {count} call sites "
+                         f"(~{self.savings[caller, callee]} assembly instructions saved per call)")
+        lines.append(f"Inlined {self.count} call sites: {self.growth} of {self.budget} VM commands of budget")
+        return "\n".join(lines)
+
+
 class CodeBuilder(object):
     """Builder class that allows to build assembly code via human-friendly interface.
     """
@@ -235,12 +665,12 @@ class CodeBuilder(object):
         self.append(f"{l}=M")
 
     def mov_mr(self, l: str, r: str):
-        """MEM[r] = register
+        """MEM[l] = register
         """
         if r not in ["D", "A"]:
             raise ValueError(f"Invalid register {r}")
-        self.append(f"@{r}")
-        self.append(f"M={l}")
+        self.append(f"@{l}")
+        self.append(f"M={r}")
     
     def mov_mm(self, l: str, r: str):
         """MEM[l] = MEM[r]
@@ -277,6 +707,153 @@ class CodeBuilder(object):
         self.append(f"{register};J{cond.upper()}")
 
 
+class PeepholeOptimizer(object):
+    """Removes redundant instructions from assembly code written by CodeWriter.
+
+    Works as a file object between CodeWriter and the output file. Written code
+    is buffered and optimized by flush(), which is meant to be called per input
+    file. Labels are barriers: no pattern spans over a label.
+
+    Patterns:
+    - "@X M=M+1 @X M=M-1" (and the opposite) cancels out
+    - "@X" when A is already X, or when the next instruction loads A again
+    - "@0 D=D+A" and "@0 D=D-A" followed by an A-instruction
+    - "D=M M=D" at the same address
+    - "D=..." whose result is overwritten before being read
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.lines: List[str] = []
+        # statistics: (name, instructions before, instructions after)
+        self.report: List[Tuple[str, int, int]] = []
+
+    def write(self, text: str):
+        self.lines.extend(text.splitlines())
+
+    def flush(self, name: str = "") -> Tuple[int, int]:
+        """optimize the buffered code and write it to the file.
+        returns the number of instructions before and after the optimization.
+        """
+        before = self.count_instructions(self.lines)
+        lines = self.optimize(self.lines)
+        after = self.count_instructions(lines)
+        if lines:
+            self.f.write("\n".join(lines) + "\n")
+        self.lines = []
+        self.report.append((name, before, after))
+        return before, after
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    @staticmethod
+    def is_code(line: str) -> bool:
+        """instruction or label, not comment nor empty line
+        """
+        return line != "" and not line.startswith("//")
+
+    @classmethod
+    def count_instructions(cls, lines: List[str]) -> int:
+        return sum(cls.is_code(line) and not line.startswith("(") for line in lines)
+
+    @staticmethod
+    def split(instruction: str) -> Tuple[str, str, str]:
+        """dest, comp and jump of a C instruction
+        """
+        dest, comp, jump = "", instruction, ""
+        if ";" in comp:
+            comp, jump = comp.split(";")
+        if "=" in comp:
+            dest, comp = comp.split("=")
+        return dest, comp, jump
+
+    @classmethod
+    def optimize(cls, lines: List[str]) -> List[str]:
+        while True:
+            lines, changed = cls._optimize_once(lines)
+            if not changed:
+                return lines
+
+    @classmethod
+    def _optimize_once(cls, lines: List[str]) -> Tuple[List[str], bool]:
+        code = [i for i, line in enumerate(lines) if cls.is_code(line)]
+        removed = set()
+
+        def peek(k: int) -> str:
+            return lines[code[k]] if k < len(code) else ""
+
+        known_a = None  # symbol or value in A register
+        last = None     # last C instruction since A was changed
+        k = 0
+        while k < len(code):
+            line = lines[code[k]]
+            # label
+            if line.startswith("("):
+                known_a, last = None, None
+                k += 1
+                continue
+
+            # A instruction
+            if line.startswith("@"):
+                symbol = line[1:]
+                if symbol == known_a or peek(k+1).startswith("@"):
+                    removed.add(code[k])
+                    k += 1
+                    continue
+                if symbol == "0" and peek(k+1) in ("D=D+A", "D=D-A") and peek(k+2).startswith("@"):
+                    removed.update((code[k], code[k+1]))
+                    k += 2
+                    continue
+                known_a, last = symbol, None
+                inverse = {"M=M+1": "M=M-1", "M=M-1": "M=M+1"}
+                if peek(k+1) in inverse and peek(k+2) == line and peek(k+3) == inverse[peek(k+1)]:
+                    removed.update((code[k+1], code[k+2], code[k+3]))
+                    k += 4
+                    continue
+                k += 1
+                continue
+
+            # C instruction
+            dest, comp, jump = cls.split(line)
+            if line == "M=D" and last == "D=M":
+                removed.add(code[k])
+                k += 1
+                continue
+            if dest == "D" and not jump and cls._is_dead_d(lines, code, k+1):
+                removed.add(code[k])
+                k += 1
+                continue
+            last = line
+            if "A" in dest:
+                known_a, last = None, None
+            if jump == "JMP":
+                known_a, last = None, None
+            k += 1
+
+        if not removed:
+            return lines, False
+        return [line for i, line in enumerate(lines) if i not in removed], True
+
+    @classmethod
+    def _is_dead_d(cls, lines: List[str], code: List[int], k: int) -> bool:
+        """True if D is overwritten before being read, from code[k]
+        """
+        for j in range(k, len(code)):
+            line = lines[code[j]]
+            if line.startswith("("):
+                return False
+            if line.startswith("@"):
+                continue
+            dest, comp, jump = cls.split(line)
+            if "D" in comp or jump:
+                return False
+            if "D" in dest:
+                return True
+        return False
+
+
 class CodeWriter(object):
 
     # predefined registers
@@ -299,13 +876,63 @@ class CodeWriter(object):
 
     TEMP_OFFSET = 5
 
-    def __init__(self, f):
+    # entry points of the shared call/return routines
+    CALL_ROUTINE = "VM$CALL"
+    RETURN_ROUTINE = "VM$RETURN"
+
+    def __init__(self, f, shared: bool = False, tos: bool = False):
+        """shared: call and return jump to single global routines instead of
+        inlining the whole sequence. see _call_routine()
+        tos: cache the top of the stack in D between commands. see _spill()
+        """
         self.f = f
         self.count = 0
         self.namespace: str = ""
+        self.function: str = ""
+        self.shared = shared
+        self.tos = tos
+        # True if the top of the stack is in D and not pushed yet
+        self.cached = False
+        # number of call sites and returns written
+        self.ncalls = 0
+        self.nreturns = 0
     
     def set_namespace(self, namespace: str):
+        """start a file. labels are numbered per file so that the code of a
+        file does not depend on the other files.
+        """
+        self.flush()
         self.namespace = namespace
+        self.function = ""
+        self.count = 0
+
+    def flush(self):
+        """write the top of the stack if it is cached in D. called at the end
+        of a file so that its code leaves the stack in memory.
+        """
+        self.f.write(self._spill())
+
+    def _spill(self) -> str:
+        """push the top of the stack cached in D, if any.
+        the stack is spilled at labels, jumps, calls and function boundaries
+        so that the stack is always in memory there.
+        """
+        if not self.cached:
+            return ""
+        self.cached = False
+        builder = CodeBuilder()
+        builder.comment("spill")
+        builder.mov_pr("SP", "D")
+        builder.inc("SP")
+        return builder.build()
+
+    def _fill(self, builder: CodeBuilder):
+        """D = the top of the stack, popping it unless cached
+        """
+        if not self.cached:
+            builder.dec("SP")
+            builder.mov_rp("D", "SP")
+        self.cached = True
     
     @classmethod
     def _push(cls, segment: str, index: int) -> str:
@@ -436,9 +1063,89 @@ class CodeWriter(object):
 
         return "// %s %s %d NOT IMPLEMENTED \n" % (command, segment, index)
 
+    def _fixed_address(self, builder: CodeBuilder, segment: str, index: int) -> bool:
+        """A = the address of segment[index] for temp, static and pointer.
+        returns False for the other segments.
+        """
+        if segment == "temp":
+            builder.append(f"@{self.TEMP_OFFSET + index}")
+        elif segment == "static":
+            builder.append(f"@{self.namespace}.{index}")
+        elif segment == "pointer":
+            builder.append(f"@{self._this_or_that(index)}")
+        else:
+            return False
+        return True
+
+    def _load_d(self, builder: CodeBuilder, segment: str, index: int) -> bool:
+        """D = segment[index]. returns False for an unknown segment.
+        """
+        register = self.SEGMENT_POINTERS.get(segment, None)
+        if segment == "constant":
+            builder.append(f"@{index}")
+            builder.append("D=A")
+        elif register:
+            # D = *(MEM[register] + index)
+            builder.append(f"@{register}")
+            if index == 0:
+                builder.append("A=M")
+            else:
+                builder.append("D=M")
+                builder.append(f"@{index}")
+                builder.append("A=D+A")
+            builder.append("D=M")
+        elif self._fixed_address(builder, segment, index):
+            builder.append("D=M")
+        else:
+            return False
+        return True
+
+    def _store_d(self, builder: CodeBuilder, segment: str, index: int, expr: str = "M=D"):
+        """segment[index] = D, or any expr of M and D such as M=M+D
+        """
+        register = self.SEGMENT_POINTERS.get(segment, None)
+        if register and index <= 7:
+            # A = MEM[register] + index
+            builder.append(f"@{register}")
+            builder.append("A=M")
+            for _ in range(index):
+                builder.append("A=A+1")
+        elif register:
+            builder.mov_mr("R13", "D")
+            builder.append(f"@{register}")
+            builder.append("D=M")
+            builder.append(f"@{index}")
+            builder.append("D=D+A")
+            builder.mov_mr("R14", "D")
+            builder.mov_rm("D", "R13")
+            builder.append("@R14")
+            builder.append("A=M")
+        elif not self._fixed_address(builder, segment, index):
+            raise RuntimeError(f"invalid segment for pop: {segment}")
+        builder.append(expr)
+
+    def _tos_pushpop(self, command: CommandType, segment: str, index: int) -> str:
+        """push/pop with the top of the stack in D
+        """
+        builder = CodeBuilder()
+        if command == CommandType.PUSH:
+            spill = self._spill()
+            if not self._load_d(builder, segment, index):
+                return spill + self._pushpop(command, segment, index)
+            self.cached = True
+            return spill + builder.build()
+
+        self._fill(builder)
+        self._store_d(builder, segment, index)
+        self.cached = False
+        return builder.build()
+
     def write_pushpop(self, command: CommandType, segment: str, index: int):
         comment = f"// {command.name} {segment} {index}\n"
-        code = self._pushpop(command, segment, index)
+        if self.tos:
+            code = self._tos_pushpop(command, segment, index)
+        else:
+            code = self._pushpop(command, segment, index)
         self.f.write(comment + code + "\n")
 
     @classmethod
@@ -540,17 +1247,50 @@ class CodeWriter(object):
 
         return "// %s NOT IMPLEMENTED\n" % (op)
 
+    def _tos_arithmetic(self, op: str, prefix: str) -> str:
+        """arithmetic with the top of the stack in D. the result is left in D.
+        """
+        UNARY = {"neg": "D=-D", "not": "D=!D"}
+        BINARY = {"add": "D=M+D", "sub": "D=M-D", "and": "D=M&D", "or": "D=M|D"}
+        builder = CodeBuilder()
+        # D = arg2 (or arg1 for unary operations)
+        self._fill(builder)
+        if op in UNARY:
+            builder.append(UNARY[op])
+            return builder.build()
+        # A = SP-1; M = arg1
+        builder.append("@SP")
+        builder.append("AM=M-1")
+        if op in BINARY:
+            builder.append(BINARY[op])
+            return builder.build()
+        cond = op.upper()
+        true_label = f"{prefix}.{cond}.TRUE"
+        end_label = f"{prefix}.{cond}.END"
+        builder.append("D=M-D")
+        builder.goto_if("D", cond, true_label)
+        builder.append("D=0")   # false
+        builder.goto(end_label)
+        builder.label(true_label)
+        builder.append("D=-1")  # true
+        builder.label(end_label)
+        return builder.build()
+
     def write_arithmetic(self, op: str):
         comment = f"// {op}\n"
         prefix = f"{self.namespace}.{self.count}"
-        code = self._arithmetic(op, prefix)
+        if self.tos:
+            code = self._tos_arithmetic(op, prefix)
+        else:
+            code = self._arithmetic(op, prefix)
         self.f.write(comment + code)
         self.count += 1
     
     def _get_prefixed_label(self, label: str) -> str:
-        """returns prefixed label to make it unique
+        """returns prefixed label to make it unique: functionName$label
         """
-        return f"{self.namespace}.{label}"
+        scope = self.function if self.function else self.namespace
+        return f"{scope}${label}"
     
     def write_label(self, label: str):
         """label
@@ -560,7 +1300,7 @@ class CodeWriter(object):
         builder = CodeBuilder()
         builder.label(label)
         code = builder.build()
-        self.f.write(comment + code)
+        self.f.write(self._spill() + comment + code)
         self.count += 1
     
     def write_if(self, label: str):
@@ -570,13 +1310,103 @@ class CodeWriter(object):
         label = self._get_prefixed_label(label)
         builder = CodeBuilder()
         # pop
-        builder.dec("SP")
-        builder.mov_rp("D", "SP")
+        if self.tos:
+            self._fill(builder)
+            self.cached = False
+        else:
+            builder.dec("SP")
+            builder.mov_rp("D", "SP")
         builder.goto_if("D", "NE", label)
         code = builder.build()
         self.f.write(comment + code)
         self.count += 1
     
+    def write_compare_if(self, op: str, label: str, negate: bool = False):
+        """'lt|gt|eq [not] if-goto label' without pushing the boolean
+        """
+        comment = f"// {op}{' not' if negate else ''} goto-if {label}\n"
+        NOT_COND = {
+            "GT": "LE",
+            "EQ": "NE",
+            "LT": "GE",
+        }
+        cond = op.upper()
+        if negate:
+            cond = NOT_COND[cond]
+        label = self._get_prefixed_label(label)
+        builder = CodeBuilder()
+        if self.tos:
+            self._fill(builder)
+            builder.append("@SP")
+            builder.append("AM=M-1")
+            builder.append("D=M-D")
+            self.cached = False
+        else:
+            # pop twice
+            builder.dec("SP")
+            builder.mov_rp("D", "SP")
+            builder.dec("SP")
+            builder.mov_rp("A", "SP")
+            builder.append("D=A-D")
+        # jump if arg1-arg2 satisfies the condition
+        builder.goto_if("D", cond, label)
+        code = builder.build()
+        self.f.write(comment + code)
+        self.count += 1
+
+    def write_move(self, source: Tuple[str, int], destination: Tuple[str, int]):
+        """'push source; pop destination' without touching the stack
+        """
+        comment = f"// move {source[0]} {source[1]} to {destination[0]} {destination[1]}\n"
+        if self.tos:
+            code = (self._tos_pushpop(CommandType.PUSH, *source)
+                    + self._tos_pushpop(CommandType.POP, *destination))
+        else:
+            builder = CodeBuilder()
+            if not self._load_d(builder, *source):
+                raise RuntimeError(f"invalid segment for push: {source[0]}")
+            self._store_d(builder, *destination)
+            code = builder.build()
+        self.f.write(comment + code)
+        self.count += 1
+
+    def write_add_constant(self, op: str, value: int):
+        """'push constant value; add|sub' on the top of the stack in place
+        """
+        comment = f"// {op} constant {value}\n"
+        sign = "+" if op == "add" else "-"
+        builder = CodeBuilder()
+        if self.tos:
+            self._fill(builder)
+            builder.append(f"@{value}")
+            builder.append(f"D=D{sign}A")
+        else:
+            if value != 1:
+                builder.append(f"@{value}")
+                builder.append("D=A")
+            builder.append("@SP")
+            builder.append("A=M-1")
+            builder.append(f"M=M{sign}1" if value == 1 else f"M=M{sign}D")
+        self.f.write(comment + builder.build())
+        self.count += 1
+
+    def write_increment(self, op: str, variable: Tuple[str, int], value: int):
+        """'push S i; push constant value; add|sub; pop S i' in place
+        """
+        segment, index = variable
+        comment = f"// {op} {segment} {index} constant {value}\n"
+        sign = "+" if op == "add" else "-"
+        builder = CodeBuilder()
+        if value == 1:
+            self._store_d(builder, segment, index, f"M=M{sign}1")
+        else:
+            builder.append(f"@{value}")
+            builder.append("D=A")
+            self._store_d(builder, segment, index, f"M=M{sign}D")
+        # D is used as a temporary
+        self.f.write(self._spill() + comment + builder.build())
+        self.count += 1
+
     def write_goto(self, label: str):
         """unconditional jump
         """
@@ -585,10 +1415,11 @@ class CodeWriter(object):
         builder.comment(f"goto {label}")
         builder.goto(label)
         code = builder.build()
-        self.f.write(code)
+        self.f.write(self._spill() + code)
         self.count += 1
     
     def write_functions(self, function: str, nvars: int):
+        self.function = function
         builder = CodeBuilder()
         builder.comment(f"function {function} {nvars}")
         # declare label
@@ -598,12 +1429,14 @@ class CodeWriter(object):
             builder.mov_pi("SP", 0)
             builder.inc("SP")
         code = builder.build()
-        self.f.write(code)
+        self.f.write(self._spill() + code)
         self.count += 1
     
-    def write_return(self):
+    @classmethod
+    def _return(cls) -> str:
+        """restore the caller's frame and jump to the return address
+        """
         builder = CodeBuilder()
-        builder.comment("return")
 
         # TODO use R13-R15 for temporal values
         FRAME = "13"
@@ -627,16 +1460,25 @@ class CodeWriter(object):
             builder.mov_mp(segment, FRAME)
         # goto retAddr = *(LCL-5)
         builder.goto_m(RETADDR)
+        return builder.build()
 
-        code = builder.build()
-        self.f.write(code)
+    def write_return(self):
+        builder = CodeBuilder()
+        builder.comment("return")
+        if self.shared:
+            builder.goto(self.RETURN_ROUTINE)
+            code = builder.build()
+        else:
+            code = builder.build() + self._return()
+        self.f.write(self._spill() + code)
         self.count += 1
-    
-    def write_call(self, function: str, nargs: int):
-        return_address = f"{self.namespace}.{function}.{self.count}"
+        self.nreturns += 1
 
+    @classmethod
+    def _call(cls, function: str, nargs: int, return_address: str) -> str:
+        """push the frame, jump to the function and declare the return address
+        """
         builder = CodeBuilder()
-        builder.comment(f"call {function} {nargs}")
         # push returnAddress
         builder.mov_pi("SP", return_address)
         builder.inc("SP")
@@ -653,11 +1495,87 @@ class CodeWriter(object):
         builder.goto(function)
         # declare return address
         builder.label(return_address)
+        return builder.build()
 
-        code = builder.build()
-        self.f.write(code)
+    @classmethod
+    def _shared_call(cls, function: str, nargs: int, return_address: str) -> str:
+        """R13 = function, R14 = nargs, R15 = return address; goto the call routine
+        """
+        builder = CodeBuilder()
+        builder.mov_mi("R13", function)
+        builder.mov_mi("R14", nargs)
+        builder.mov_mi("R15", return_address)
+        builder.goto(cls.CALL_ROUTINE)
+        builder.label(return_address)
+        return builder.build()
+
+    @classmethod
+    def _call_routine(cls) -> str:
+        """the global call routine taking the function, nargs and the return
+        address from R13, R14 and R15 respectively
+        """
+        builder = CodeBuilder()
+        builder.comment("shared call routine")
+        builder.label(cls.CALL_ROUTINE)
+        # push returnAddress
+        builder.mov_pm("SP", "R15")
+        builder.inc("SP")
+        # save current stack frame
+        for segment in ["LCL", "ARG", "THIS", "THAT"]:
+            builder.mov_pm("SP", segment)
+            builder.inc("SP")
+        # ARG = SP-5-nargs
+        builder.mov_rm("D", "SP")
+        builder.append("@R14")
+        builder.append("D=D-M")
+        builder.append("@5")
+        builder.append("D=D-A")
+        builder.append("@ARG")
+        builder.append("M=D")
+        # LCL = SP
+        builder.mov_mm("LCL", "SP")
+        # goto function
+        builder.goto_m("R13")
+        return builder.build()
+
+    @classmethod
+    def _return_routine(cls) -> str:
+        builder = CodeBuilder()
+        builder.comment("shared return routine")
+        builder.label(cls.RETURN_ROUTINE)
+        return builder.build() + cls._return()
+
+    def write_call(self, function: str, nargs: int):
+        return_address = f"{self.namespace}.{function}.{self.count}"
+
+        builder = CodeBuilder()
+        builder.comment(f"call {function} {nargs}")
+        if self.shared:
+            code = builder.build() + self._shared_call(function, nargs, return_address)
+        else:
+            code = builder.build() + self._call(function, nargs, return_address)
+        self.f.write(self._spill() + code)
         self.count += 1
-    
+        self.ncalls += 1
+
+    def shared_report(self) -> str:
+        """ROM size saved by the shared routines against the extra cycles per call
+        (without the peephole optimization)
+        """
+        def count(code: str) -> int:
+            return PeepholeOptimizer.count_instructions(code.splitlines())
+        # all the sequences are straight-line code
+        call = count(self._call("f", 0, "r"))
+        shared_call = count(self._shared_call("f", 0, "r"))
+        call_routine = count(self._call_routine())
+        ret = count(self._return())
+        shared_ret = count(self._return_routine())
+        saved = (self.ncalls * (call - shared_call) + self.nreturns * (ret - 2)
+                 - call_routine - shared_ret)
+        return (f"Shared call/return: {self.ncalls} calls, {self.nreturns} returns, "
+                f"saved {saved} words of ROM, "
+                f"+{shared_call + call_routine - call} cycles per call, +2 cycles per return")
+
     def write_init(self):
         builder = CodeBuilder()
         builder.mov_mi("SP", 256)
@@ -665,13 +1583,52 @@ class CodeWriter(object):
         self.f.write(code)
         self.write_call("Sys.init", 0)
 
+    def write_command(self, cmd: Command):
+        if cmd.command == CommandType.PUSH or cmd.command == CommandType.POP:
+            self.write_pushpop(cmd.command, cmd.arg1, cmd.arg2)
+        elif cmd.command == CommandType.ARITHMETIC:
+            self.write_arithmetic(cmd.op)
+        elif cmd.command == CommandType.LABEL:
+            self.write_label(cmd.arg1)
+        elif cmd.command == CommandType.IF:
+            self.write_if(cmd.arg1)
+        elif cmd.command == CommandType.GOTO:
+            self.write_goto(cmd.arg1)
+        elif cmd.command == CommandType.FUNCTION:
+            self.write_functions(cmd.arg1, cmd.arg2)
+        elif cmd.command == CommandType.RETURN:
+            self.write_return()
+        elif cmd.command == CommandType.CALL:
+            self.write_call(cmd.arg1, cmd.arg2)
+        elif cmd.command == CommandType.COMPARE_IF:
+            self.write_compare_if(cmd.op, cmd.arg1, bool(cmd.arg2))
+        elif cmd.command == CommandType.MOVE:
+            self.write_move(cmd.arg1, cmd.arg2)
+        elif cmd.command == CommandType.ADD_CONSTANT:
+            self.write_add_constant(cmd.op, cmd.arg2)
+        elif cmd.command == CommandType.INCREMENT:
+            self.write_increment(cmd.op, cmd.arg1, cmd.arg2)
+        else:
+            raise NotImplementedError(cmd)
+
+    def write_routines(self):
+        """write the shared routines if enabled. called by close()
+        """
+        self.flush()
+        if self.shared:
+            self.f.write(self._call_routine() + self._return_routine())
+
     def close(self):
+        self.write_routines()
         self.f.close()
 
 
 class Main:
 
-    def __init__(self, input_path: str):
+    def __init__(self, input_path: str, assemble: bool = False, optimize: bool = False,
+                 shared: bool = False, tos: bool = False, prune: bool = False,
+                 inline: bool = False, inline_budget: int = Inliner.BUDGET,
+                 cache: bool = False, jobs: int = 1):
         import glob
 
         # input
@@ -682,8 +1639,31 @@ class Main:
             self.input_files = [input_path]
             self.is_directory = False
         else:
-            self.input_files = list(glob.glob(os.path.join(input_path, "*.vm")))
+            # sorted to make the output independent of the file system
+            self.input_files = sorted(glob.glob(os.path.join(input_path, "*.vm")))
             self.is_directory = True
+        # assemble the output in the same process
+        self.assemble = assemble
+        # fusion of VM commands and peephole optimization
+        self.optimize = optimize
+        # shared call/return routines
+        self.shared = shared
+        # top of the stack cached in D
+        self.tos = tos
+        # remove functions unreachable from Sys.init
+        self.prune = prune
+        # inline small functions
+        self.inline = inline
+        self.inline_budget = inline_budget
+        # cache the translation of each file
+        self.cache = cache
+        directory = input_path if self.is_directory else os.path.dirname(input_path)
+        self.cache_directory = os.path.join(directory, "__vmcache__")
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.translator_digest: Optional[bytes] = None
+        # number of worker processes to translate files
+        self.jobs = jobs
 
     @classmethod
     def get_namespace(cls, input_filename: str) -> str:
@@ -697,51 +1677,191 @@ class Main:
             output_filename = os.path.join(self.input_path, basename + ".asm")
         else:
             output_filename = self.input_path.replace(".vm", ".asm")
-        output_file = open(output_filename, "w")
-        writer = CodeWriter(output_file)
-
-        if self.is_directory:
-            writer.write_init()
 
+        # (namespace, source, commands). commands are None until parsed, so
+        # that a cached file is not parsed at all.
+        files = []
         for input_filename in self.input_files:
-            input_file = open(input_filename, "r")
-            parser = Parser(input_file)
-            namespace = self.get_namespace(input_filename)
-            writer.set_namespace(namespace)
-
             print("Input: " + input_filename)
-            
-            # main loop
-            while True:
-                parser.advance()
-                if not parser.has_more_commands():
-                    break
-                cmd = parser.get_current_command()
-                if cmd.command == CommandType.PUSH or cmd.command == CommandType.POP:
-                    writer.write_pushpop(cmd.command, cmd.arg1, cmd.arg2)
-                elif cmd.command == CommandType.ARITHMETIC:
-                    writer.write_arithmetic(cmd.op)
-                elif cmd.command == CommandType.LABEL:
-                    writer.write_label(cmd.arg1)
-                elif cmd.command == CommandType.IF:
-                    writer.write_if(cmd.arg1)
-                elif cmd.command == CommandType.GOTO:
-                    writer.write_goto(cmd.arg1)
-                elif cmd.command == CommandType.FUNCTION:
-                    writer.write_functions(cmd.arg1, cmd.arg2)
-                elif cmd.command == CommandType.RETURN:
-                    writer.write_return()
-                elif cmd.command == CommandType.CALL:
-                    writer.write_call(cmd.arg1, cmd.arg2)
-                else:
-                    raise NotImplementedError
+            with open(input_filename, "r") as input_file:
+                files.append((self.get_namespace(input_filename), input_file.read(), None))
+        whole_program = self.inline or (self.prune and self.is_directory)
+        if whole_program or not self.cache:
+            files = [(namespace, source, list(Parser(io.StringIO(source)).commands()))
+                     for namespace, source, _ in files]
+        if whole_program:
+            commands = [(namespace, commands) for namespace, _, commands in files]
+            if self.inline:
+                inliner = Inliner(budget=self.inline_budget)
+                commands = inliner.inline(commands)
+                print(inliner.report())
+            if self.prune and self.is_directory:
+                commands = self.prune_functions(commands)
+            files = [(namespace, source, cmds) for (namespace, source, _), (_, cmds) in zip(files, commands)]
+
+        output_file = open(output_filename, "w")
+        optimizer = None
+        if self.optimize:
+            optimizer = PeepholeOptimizer(output_file)
+        writer = CodeWriter(optimizer if optimizer else output_file, shared=self.shared, tos=self.tos)
+        if self.is_directory:
+            writer.write_init()
+            if optimizer:
+                optimizer.flush("bootstrap")
+
+        fuser = CommandFuser()
+        for fragment in self.translate_files(files):
+            output_file.write(fragment.asm)
+            if self.optimize:
+                print(f"Optimized: removed {fragment.before - fragment.after} of {fragment.before} instructions")
+            fuser.counts.update(fragment.fused)
+            writer.ncalls += fragment.ncalls
+            writer.nreturns += fragment.nreturns
         writer.close()
         print("Output: " + output_filename)
+        if self.optimize:
+            print(fuser.report())
+        if self.shared:
+            print(writer.shared_report())
+        if self.cache:
+            print(f"Cache: {self.cache_hits} hits, {self.cache_misses} misses")
+
+        if self.assemble:
+            self.write_hack(output_filename)
+
+    def translate_files(self, files: List[Tuple[str, str, Optional[List[Command]]]]) -> List[Fragment]:
+        """translate (namespace, source, commands) of files, or load the
+        translations from the cache. the cache key is the source, or the commands
+        after whole-program passes. with jobs > 1, the files are translated in
+        worker processes and the fragments are returned in the order of files.
+        """
+        fragments: List[Optional[Fragment]] = [None] * len(files)
+        keys: List[Optional[str]] = [None] * len(files)
+        pending = []
+        for i, (namespace, source, commands) in enumerate(files):
+            if self.cache:
+                content = source if commands is None else repr(commands)
+                keys[i] = self.cache_key(namespace, content)
+                fragments[i] = self.load_fragment(namespace, keys[i])
+                if fragments[i] is not None:
+                    self.cache_hits += 1
+                    continue
+                self.cache_misses += 1
+            pending.append(i)
+
+        args = [[files[i][k] for i in pending] for k in range(3)]
+        options = [[option] * len(pending) for option in (self.optimize, self.shared, self.tos)]
+        if self.jobs > 1 and len(pending) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                # map() returns the results in the order of files
+                translated = list(executor.map(translate_file, *args, *options))
+        else:
+            translated = list(map(translate_file, *args, *options))
+
+        for i, fragment in zip(pending, translated):
+            fragments[i] = fragment
+            if self.cache:
+                self.save_fragment(files[i][0], keys[i], fragment)
+        return fragments
+
+    def cache_key(self, namespace: str, content: str) -> str:
+        import hashlib
+        if self.translator_digest is None:
+            # a change of the translator invalidates the cache
+            with open(__file__, "rb") as f:
+                self.translator_digest = hashlib.sha256(f.read()).digest()
+        h = hashlib.sha256(self.translator_digest)
+        h.update(repr((namespace, self.optimize, self.shared, self.tos)).encode())
+        h.update(content.encode())
+        return h.hexdigest()
+
+    def get_cache_filename(self, namespace: str, key: str) -> str:
+        """__vmcache__/<namespace>/<options>-<key>.json. each file has its own
+        directory, and one entry is kept per set of options.
+        """
+        return os.path.join(self.cache_directory, namespace, f"{self.cache_options()}-{key}.json")
+
+    def cache_options(self) -> str:
+        import hashlib
+        return hashlib.sha256(repr((self.optimize, self.shared, self.tos)).encode()).hexdigest()[:16]
+
+    def load_fragment(self, namespace: str, key: str) -> Optional[Fragment]:
+        import json
+        try:
+            with open(self.get_cache_filename(namespace, key)) as f:
+                return Fragment(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save_fragment(self, namespace: str, key: str, fragment: Fragment):
+        import glob
+        import json
+        directory = os.path.join(self.cache_directory, namespace)
+        os.makedirs(directory, exist_ok=True)
+        # remove the outdated translation of the file with the same options
+        for filename in glob.glob(os.path.join(directory, f"{self.cache_options()}-*.json")):
+            os.remove(filename)
+        with open(self.get_cache_filename(namespace, key), "w") as f:
+            json.dump(fragment._asdict(), f)
+
+    def prune_functions(self, files: List[Tuple[str, List[Command]]]) -> List[Tuple[str, List[Command]]]:
+        """remove functions unreachable from Sys.init and report them
+        """
+        graph = CallGraph(files)
+        if "Sys.init" not in graph.functions:
+            print("Sys.init not found: no function is removed")
+            return files
+        reachable = graph.reachable("Sys.init")
+        dropped = sorted(set(graph.functions) - reachable)
+        total = 0
+        for function in dropped:
+            namespace, commands = graph.functions[function]
+            size = translated_size(namespace, commands, shared=self.shared, tos=self.tos)
+            total += size
+            print(f"Unreachable: {function} ({size} words)")
+        print(f"Removed {len(dropped)} of {len(graph.functions)} functions: "
+              f"{total} words ({total * 2} bytes) of ROM")
+        return graph.prune(files, reachable)
+
+    @classmethod
+    def write_hack(cls, asm_filename: str):
+        import assembler
+        with open(asm_filename) as f:
+            program = assembler.assemble(f)
+        hack_filename = os.path.splitext(asm_filename)[0] + ".hack"
+        with open(hack_filename, "w") as f:
+            program.write_text(f)
+        print("Output: " + hack_filename)
     
     @staticmethod
     def main():
-        import sys
-        this = Main(sys.argv[1])
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument("input_path", help=".vm file or directory")
+        parser.add_argument("--assemble", action="store_true",
+                            help="also assemble the output into .hack")
+        parser.add_argument("--optimize", action="store_true",
+                            help="fuse VM commands and apply peephole optimization")
+        parser.add_argument("--shared", action="store_true",
+                            help="use shared call/return routines to reduce ROM size")
+        parser.add_argument("--tos", action="store_true",
+                            help="cache the top of the stack in D between commands")
+        parser.add_argument("--prune", action="store_true",
+                            help="remove functions unreachable from Sys.init")
+        parser.add_argument("--inline", action="store_true",
+                            help="inline small non-recursive functions")
+        parser.add_argument("--inline-budget", type=int, default=Inliner.BUDGET,
+                            help="maximum growth of the program by inlining in VM commands")
+        parser.add_argument("--cache", action="store_true",
+                            help="reuse the translation of unchanged files from __vmcache__")
+        parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="number of worker processes to translate files")
+        args = parser.parse_args()
+        this = Main(args.input_path, assemble=args.assemble, optimize=args.optimize,
+                    shared=args.shared, tos=args.tos, prune=args.prune,
+                    inline=args.inline, inline_budget=args.inline_budget,
+                    cache=args.cache, jobs=args.jobs)
         this.translate()
 
 
@@ -11,13 +11,13 @@ class VMWriter:
         self.f.write("\n")
     
     def write_push(self, segment: Segment, index: int):
-        self.writeln(f"push {segment.value} {index}")
+        self.writeln(f"push {segment.text} {index}")
     
     def write_pop(self, segment: Segment, index: int):
-        self.writeln(f"pop {segment.value} {index}")
+        self.writeln(f"pop {segment.text} {index}")
     
     def write_arithmetic(self, arithmetic: ArithmeticCommand):
-        self.writeln(f"{arithmetic.value}")
+        self.writeln(f"{arithmetic.text}")
     
     def write_label(self, label: str):
         self.writeln(f"label {label}")
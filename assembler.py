@@ -1,5 +1,6 @@
-from typing import List, Tuple
-from enum import Enum
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional, TextIO, BinaryIO, Union
+from array import array
+import sys
 
 
 class SymbolTable(object):
@@ -137,6 +138,13 @@ class Code(object):
         "D&M":  "000000",
         "D|A":  "010101",
         "D|M":  "010101",
+        # commutative forms (VMTranslator emits e.g. D=A+D)
+        "A+D":  "000010",
+        "M+D":  "000010",
+        "A&D":  "000000",
+        "M&D":  "000000",
+        "A|D":  "010101",
+        "M|D":  "010101",
     }
 
     JUMP_CODE = {
@@ -174,47 +182,403 @@ class Code(object):
         jj = cls.jump(jump)
         return "111" + cc + dd + jj
 
+    # raw C instruction (e.g. "AM=M+1", "D;JGT") -> machine word
+    _TABLE: Dict[str, int] = {}
+
+    @classmethod
+    def table(cls) -> Dict[str, int]:
+        """all combinations of dest, comp and jump, built once.
+        dest accepts any order of the registers e.g. MD and DM.
+        """
+        if cls._TABLE:
+            return cls._TABLE
+        import itertools
+        dests = [""]
+        for n in range(1, 4):
+            dests += ["".join(p) for p in itertools.permutations("ADM", n)]
+        for dest in dests:
+            for comp in cls.COMP_C_CODE:
+                for jump in cls.JUMP_CODE:
+                    expr = comp
+                    if dest:
+                        expr = dest + "=" + expr
+                    if jump:
+                        expr = expr + ";" + jump
+                    cls._TABLE[expr] = int(cls.compile(comp, dest, jump), 2)
+        return cls._TABLE
+
+    @classmethod
+    def encode(cls, expr: str) -> int:
+        """encode a raw C instruction into a machine word with a single look up
+        """
+        try:
+            return cls.table()[expr]
+        except KeyError:
+            # not in canonical form e.g. "D = A" or "0;"
+            cinst = CInstruction.parse("".join(expr.split()))
+            return int(cls.compile(cinst.comp, cinst.dest, cinst.jump), 2)
+
+
+MAX_ADDRESS = (1 << 15) - 1
+
+
+def a_instruction(address: int) -> int:
+    """machine word of an A-instruction, which is the address itself
+    """
+    if not 0 <= address <= MAX_ADDRESS:
+        raise ValueError(f"{address} does not fit in an A-instruction")
+    return address
+
+
+def compile_a_instruction(address: int) -> str:
+    return "0{:0>15b}".format(address)
+
+
+def compile_c_instruction(line: str) -> str:
+    return "{:016b}".format(Code.encode(line))
+
+
+def encode(lines: List[str]) -> List[int]:
+    """Precondition: lines are preprocessed (no empty line, no symbols, not comments)
+    """
+    words = []
+    for line in lines:
+        if line.startswith("@"):
+            words.append(a_instruction(int(line[1:])))
+        else:
+            words.append(Code.encode(line))
+    return words
+
 
 def compile(lines: List[str]) -> List[str]:
     """Precondition: lines are preprocessed (no empty line, no symbols, not comments)
     """
-    compiled = []
+    return ["{:016b}".format(word) for word in encode(lines)]
+
+
+class StreamingAssembler(object):
+    """Single-pass assembler.
+
+    Lines are fed one by one and machine words (ints) are emitted immediately.
+    A-instructions referring to a symbol that is not known yet (a label declared
+    later, or a variable) are emitted as placeholders and their addresses are
+    recorded, so that they can be backpatched once the whole source is read.
+    Memory usage depends on the symbols, not on the length of the program.
+
+    Example:
+    asm = StreamingAssembler()
+    for line in f:
+        word = asm.feed(line)       # None for labels, comments and empty lines
+        ...
+    for address, word in asm.backpatch():
+        ...                         # overwrite the placeholder at address
+    """
+
+    PLACEHOLDER = 0
+    MAX_ADDRESS = MAX_ADDRESS
+
+    def __init__(self):
+        self.table = SymbolTable()
+        self.line_count = 0
+        # symbol -> addresses of instructions referring to the symbol.
+        # dict keeps the first-seen order which decides variable addresses.
+        self.unresolved: Dict[str, List[int]] = {}
+
+    def feed(self, line: str) -> Optional[int]:
+        """assemble a line and returns the machine word, or None if the line
+        does not produce any instruction.
+        """
+        line = sanitize_line(line)
+        if line == "":
+            return None
+
+        # is loop declaration?
+        if line.startswith("(") and line.endswith(")"):
+            self.table.add_symbol(line[1:-1], self.line_count)
+            return None
+
+        address = self.line_count
+        self.line_count += 1
+        if not line.startswith("@"):
+            return Code.encode(line)
+
+        symbol = line[1:]
+        if symbol.isdigit():
+            return a_instruction(int(symbol))
+        if symbol in self.table.symbols:
+            return a_instruction(self.table.symbols[symbol])
+        # forward reference - resolve it later
+        self.unresolved.setdefault(symbol, []).append(address)
+        return self.PLACEHOLDER
+
+    def backpatch(self) -> Iterator[Tuple[int, int]]:
+        """resolve the remaining symbols and yields (address, word) to overwrite
+        the placeholders. Call this after all the lines are fed.
+        """
+        for symbol, addresses in self.unresolved.items():
+            word = a_instruction(self.table.resolve(symbol))
+            for address in addresses:
+                yield address, word
+        self.unresolved.clear()
+
+
+def assemble_stream(fin: TextIO, fout: BinaryIO) -> int:
+    """assemble lines of fin and write the machine code to fout on the fly.
+    fout must be seekable as forward references are backpatched at the end.
+    returns the number of instructions.
+    """
+    # every word takes 17 bytes: a newline (except the first one) and 16 digits
+    width = 17
+    word_format = HackProgram.WORD_FORMAT
+    asm = StreamingAssembler()
+    for line in fin:
+        word = asm.feed(line)
+        if word is None:
+            continue
+        if asm.line_count > 1:
+            fout.write(b"\n")
+        fout.write(word_format.format(word).encode("ascii"))
+
+    end = fout.tell()
+    for address, word in asm.backpatch():
+        fout.seek(address * width)
+        fout.write(word_format.format(word).encode("ascii"))
+    fout.seek(end)
+    return asm.line_count
+
+
+class HackProgram(object):
+    """machine code packed into an array of unsigned 16-bit words.
+
+    The binary format is the raw words in big-endian, so that a ROM image can be
+    loaded with a single read and no parsing. The text format of .hack files is
+    available as a view over the same buffer.
+    """
+
+    WORD_FORMAT = "{:016b}"
+
+    def __init__(self, words: Iterable[int] = ()):
+        self.words = array("H", words)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, address: int) -> int:
+        return self.words[address]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, HackProgram) and self.words == other.words
+
+    def append(self, word: int):
+        self.words.append(word)
+
+    @classmethod
+    def from_codes(cls, codes: Iterable[str]) -> "HackProgram":
+        """from strings of '0' and '1' returned by compile()
+        """
+        return HackProgram(int(code, 2) for code in codes)
+
+    # ----------------------------------------------------------------
+    # binary format
+    # ----------------------------------------------------------------
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HackProgram":
+        program = HackProgram()
+        program.words.frombytes(data)
+        if sys.byteorder == "little":
+            program.words.byteswap()
+        return program
+
+    def to_bytes(self) -> bytes:
+        if sys.byteorder == "little":
+            words = array("H", self.words)
+            words.byteswap()
+            return words.tobytes()
+        return self.words.tobytes()
+
+    @classmethod
+    def read_binary(cls, f: BinaryIO) -> "HackProgram":
+        return cls.from_bytes(f.read())
+
+    def write_binary(self, f: BinaryIO):
+        f.write(self.to_bytes())
+
+    # ----------------------------------------------------------------
+    # text format (.hack)
+    # ----------------------------------------------------------------
+    def codes(self) -> Iterator[str]:
+        return map(self.WORD_FORMAT.format, self.words)
+
+    def to_text(self) -> str:
+        return "\n".join(self.codes())
+
+    @classmethod
+    def read_text(cls, f: TextIO) -> "HackProgram":
+        return cls.from_codes(line for line in map(str.strip, f) if line != "")
+
+    def write_text(self, f: TextIO):
+        f.write(self.to_text())
+
+    @classmethod
+    def load(cls, filename: str) -> "HackProgram":
+        """load .hack (text) or any other file as binary
+        """
+        if filename.endswith(".hack"):
+            with open(filename) as f:
+                return cls.read_text(f)
+        with open(filename, "rb") as f:
+            return cls.read_binary(f)
+
+
+def assemble_program(lines: Iterable[str]) -> HackProgram:
+    """single-pass assembly into a packed program
+    """
+    asm = StreamingAssembler()
+    program = HackProgram()
+    for line in lines:
+        word = asm.feed(line)
+        if word is not None:
+            program.append(word)
+    for address, word in asm.backpatch():
+        program.words[address] = word
+    return program
+
+
+# symbols shared with the worker processes of assemble_parallel()
+_worker_symbols: Dict[str, int] = {}
+
+
+def _init_worker(symbols: Dict[str, int]):
+    global _worker_symbols
+    _worker_symbols = symbols
+
+
+def _encode_chunk(lines: List[str]) -> bytes:
+    """encode preprocessed lines with the resolved symbols. returns packed words.
+    """
+    words = array("H")
     for line in lines:
         if line.startswith("@"):
-            val = int(line[1:])
-            code = "0{:0>15b}".format(val)
-            compiled.append(code)
+            symbol = line[1:]
+            address = int(symbol) if symbol.isdigit() else _worker_symbols[symbol]
+            words.append(a_instruction(address))
         else:
-            cinst = CInstruction.parse(line)
-            code = Code.compile(cinst.comp, cinst.dest, cinst.jump)
-            compiled.append(code)
-    return compiled
+            words.append(Code.encode(line))
+    return words.tobytes()
 
 
-def main():
-    # test preprocess
-    import sys
-    filename = sys.argv[1]
-    with open(filename) as f:
-        lines = f.readlines()
-    preprocessed = preprocess(lines)
+def assemble_parallel(lines: Iterable[str], jobs: Optional[int] = None,
+                      chunk_size: int = 4096) -> HackProgram:
+    """resolve all the symbols in a fast scan, then encode chunks of the program
+    in worker processes and join them in order.
+
+    Variables are allocated in the scan in first-seen order, so the output is
+    identical to the serial assembler.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    table = SymbolTable()
+    instructions = []
+    # find loop declarations
+    for line in lines:
+        line = sanitize_line(line)
+        if line == "":
+            continue
+        if line.startswith("(") and line.endswith(")"):
+            table.add_symbol(line[1:-1], len(instructions))
+        else:
+            instructions.append(line)
+    # allocate variables
+    for line in instructions:
+        if line.startswith("@"):
+            table.resolve(line[1:])
+
+    chunks = [instructions[i:i+chunk_size] for i in range(0, len(instructions), chunk_size)]
+    program = HackProgram()
+    if len(chunks) <= 1 or jobs == 1:
+        _init_worker(table.symbols)
+        for chunk in chunks:
+            program.words.frombytes(_encode_chunk(chunk))
+        return program
 
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(table.symbols,)) as executor:
+        # map() returns the results in the order of chunks
+        for data in executor.map(_encode_chunk, chunks):
+            program.words.frombytes(data)
+    return program
+
+
+def assemble(source: Union[str, TextIO], verbose: bool = False) -> HackProgram:
+    """assemble source code (a string or a file object) and returns the program.
+
+    Nothing is printed unless verbose is set, in which case the preprocessed
+    and compiled listings are printed to stdout.
+    """
+    lines = source.splitlines() if isinstance(source, str) else source
+    if not verbose:
+        return assemble_program(lines)
+
+    preprocessed = preprocess(list(lines))
     print("----- PREPROCESSED -----")
     print("\n".join(preprocessed))
     print()
 
-    compiled = compile(preprocessed)
-
+    program = HackProgram(encode(preprocessed))
     print("----- COMPILED -----")
-    print("\n".join(compiled))
+    print(program.to_text())
+    return program
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print the preprocessed and compiled programs")
+    # --stream writes the text format only
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--stream", action="store_true",
+                        help="single-pass assembly writing the output on the fly")
+    output.add_argument("--binary", action="store_true",
+                        help="write packed 16-bit words (big-endian) to .bin")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="encode chunks of the program in parallel processes")
+    args = parser.parse_args()
+    # the listing is printed by the serial assembler only
+    if args.verbose and (args.jobs > 0 or args.stream):
+        parser.error("--verbose cannot be used with --jobs or --stream")
+    if args.jobs > 0 and args.stream:
+        parser.error("--jobs cannot be used with --stream")
+    filename = args.filename
 
     import os.path
     basename = os.path.basename(filename)
     basename_wo_ext = os.path.splitext(basename)[0]
     compined_filename = basename_wo_ext + ".hack"
-    with open(compined_filename, "w") as f:
-        f.write("\n".join(compiled))
+
+    if args.stream:
+        with open(filename) as fin, open(compined_filename, "wb") as fout:
+            n = assemble_stream(fin, fout)
+        print(f"Assembled {n} instructions to {compined_filename}")
+        return
+
+    with open(filename) as f:
+        if args.jobs > 0:
+            program = assemble_parallel(f, jobs=args.jobs)
+        else:
+            program = assemble(f, verbose=args.verbose)
+
+    if args.binary:
+        binary_filename = basename_wo_ext + ".bin"
+        with open(binary_filename, "wb") as f:
+            program.write_binary(f)
+        print(f"Assembled {len(program)} instructions to {binary_filename}")
+    else:
+        with open(compined_filename, "w") as f:
+            program.write_text(f)
+        print(f"Assembled {len(program)} instructions to {compined_filename}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,772 @@
+"""micro benchmarks of the toolchain
+
+usage:
+    python benchmark.py <name> [args...]
+"""
+import io
+import random
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+
+def measure(func: Callable[[], None], repeat: int = 5) -> float:
+    """returns the best time of 'repeat' runs in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def generate_vm(ncommands: int, seed: int = 0) -> str:
+    """generate random but valid-looking VM commands
+    """
+    rng = random.Random(seed)
+    segments = ["local", "argument", "this", "that", "temp", "static", "constant", "pointer"]
+    arithmetics = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
+    lines = ["function Bench.main 4"]
+    for i in range(ncommands):
+        r = rng.random()
+        if r < 0.4:
+            segment = rng.choice(segments)
+            index = rng.randrange(2) if segment == "pointer" else rng.randrange(8)
+            lines.append(f"push {segment} {index}")
+        elif r < 0.6:
+            segment = rng.choice([s for s in segments if s != "constant"])
+            index = rng.randrange(2) if segment == "pointer" else rng.randrange(8)
+            lines.append(f"pop {segment} {index}")
+        elif r < 0.85:
+            lines.append(rng.choice(arithmetics))
+        elif r < 0.9:
+            lines.append(f"label L{i}")
+        elif r < 0.95:
+            lines.append(f"if-goto L{rng.randrange(ncommands)}")
+        else:
+            lines.append(f"call Bench.f{rng.randrange(16)} {rng.randrange(4)}")
+    lines.append("return")
+    return "\n".join(lines) + "\n"
+
+
+def translate_vm(sources: List[Tuple[str, str]], bootstrap: bool = False,
+                 optimize: bool = False, fuse: Optional[List[str]] = None,
+                 inline_budget: int = 0, prune: bool = False, **options) -> str:
+    """translate (namespace, VM code) pairs into assembly.
+    fuse is the list of the names of CommandFuser patterns to apply.
+    prune removes functions unreachable from Sys.init.
+    options are passed to CodeWriter.
+    """
+    from VMTranslator import Parser, CodeWriter, PeepholeOptimizer, CommandFuser, Inliner, CallGraph
+    out = io.StringIO()
+    fuser = CommandFuser(fuse) if fuse else None
+    optimizer = PeepholeOptimizer(out) if optimize else None
+    writer = CodeWriter(optimizer if optimize else out, **options)
+    if bootstrap:
+        writer.write_init()
+    files = [(namespace, list(Parser(io.StringIO(source)).commands())) for namespace, source in sources]
+    if inline_budget:
+        files = Inliner(budget=inline_budget).inline(files)
+    if prune:
+        files = CallGraph.prune(files, CallGraph(files).reachable("Sys.init"))
+    for namespace, commands in files:
+        if fuser:
+            commands = fuser.fuse(commands)
+        writer.set_namespace(namespace)
+        for cmd in commands:
+            writer.write_command(cmd)
+        writer.flush()
+        if optimizer:
+            optimizer.flush(namespace)
+    writer.write_routines()
+    if optimizer:
+        optimizer.flush()
+    return out.getvalue()
+
+
+def compile_jack(paths: List[str], **options) -> List[Tuple[str, str]]:
+    """compile .jack files in the directories into (namespace, VM code) pairs.
+    a class in a later directory replaces the one of the same name e.g. in os.
+    options are passed to CompilationEngine.
+    """
+    import glob
+    import os.path
+    from JackTokenizer import RegexJackTokenizer
+    from ParseTree import ParseTreeBuilder
+    from CompilationEngine import CompilationEngine
+    from VMWriter import VMWriter
+
+    filenames = {}
+    for path in paths:
+        for filename in glob.glob(os.path.join(path, "*.jack")):
+            filenames[os.path.splitext(os.path.basename(filename))[0]] = filename
+    sources = []
+    for namespace, filename in sorted(filenames.items()):
+        with open(filename) as f:
+            tree = ParseTreeBuilder(RegexJackTokenizer(f)).build()
+        out = io.StringIO()
+        CompilationEngine(VMWriter(out), **options).compile_class(tree)
+        sources.append((namespace, out.getvalue()))
+    return sources
+
+
+def generate_asm(ncommands: int, seed: int = 0) -> str:
+    """translate generated VM commands into assembly
+    """
+    return translate_vm([("Bench", generate_vm(ncommands, seed))])
+
+
+def read_vm(path: str) -> List[Tuple[str, str]]:
+    """read a .vm file or .vm files in a directory as (namespace, VM code) pairs
+    """
+    import glob
+    import os.path
+    filenames = [path] if path.endswith(".vm") else sorted(glob.glob(os.path.join(path, "*.vm")))
+    sources = []
+    for filename in filenames:
+        with open(filename) as f:
+            sources.append((os.path.splitext(os.path.basename(filename))[0], f.read()))
+    return sources
+
+
+def run_to_halt(asm: str, max_cycles: int = 100000000) -> Tuple[int, int]:
+    """run translated assembly until it reaches Sys.halt.
+    returns the ROM size and the number of cycles.
+    """
+    from assembler import StreamingAssembler, assemble_program
+    from CPUEmulator import BlockCPUEmulator
+
+    program = assemble_program(asm.splitlines())
+    labels = StreamingAssembler()
+    for line in asm.splitlines():
+        labels.feed(line)
+    halt = labels.table.symbols["Sys.halt"]
+    cpu = BlockCPUEmulator(program)
+    # Sys.halt is the start of a block: run a block at a time not to miss it
+    while not cpu.halted and cpu.pc != halt and cpu.cycles < max_cycles:
+        cpu.run(1)
+    return len(program), cpu.cycles
+
+
+def read_or_generate_asm(args: List[str]) -> str:
+    if args:
+        with open(args[0]) as f:
+            return f.read()
+    return generate_asm(20000)
+
+
+# ----------------------------------------------------------------
+# benchmarks
+# ----------------------------------------------------------------
+def bench_c_instruction(args: List[str]):
+    """per-instruction cost of encoding C-instructions
+    usage: c-instruction [file.asm]
+    """
+    from assembler import sanitize_line, CInstruction, Code
+
+    source = read_or_generate_asm(args)
+    lines = [sanitize_line(l) for l in source.splitlines()]
+    cinsts = [l for l in lines if l and not l.startswith("@") and not l.startswith("(")]
+
+    def parse_and_compile():
+        for line in cinsts:
+            cinst = CInstruction.parse(line)
+            Code.compile(cinst.comp, cinst.dest, cinst.jump)
+
+    def lookup():
+        for line in cinsts:
+            Code.encode(line)
+
+    Code.table()    # exclude the construction of the table
+    n = len(cinsts)
+    before = measure(parse_and_compile)
+    after = measure(lookup)
+    print(f"{n} C-instructions")
+    print(f"parse + compile: {before / n * 1e9:8.1f} ns/instruction")
+    print(f"table lookup:    {after / n * 1e9:8.1f} ns/instruction ({before / after:.1f}x)")
+
+
+# R2 = R0 * R1 by repeated addition
+MULT_ASM = """
+    @R2
+    M=0
+(LOOP)
+    @R1
+    D=M
+    @END
+    D;JLE
+    @R0
+    D=M
+    @R2
+    M=D+M
+    @R1
+    M=M-1
+    @LOOP
+    0;JMP
+(END)
+    @END
+    0;JMP
+"""
+
+
+def bench_emulator(args: List[str]):
+    """instructions per second of the CPU emulator engines
+    usage: emulator [file.hack] [cycles]
+    """
+    from assembler import assemble, HackProgram
+    from CPUEmulator import ENGINES
+
+    cycles = int(args[1]) if len(args) > 1 else 2000000
+    if args:
+        program = HackProgram.load(args[0])
+    else:
+        program = assemble(MULT_ASM)
+
+    for name, engine in ENGINES.items():
+        start = time.perf_counter()
+        cpu = engine(program)
+        decode = time.perf_counter() - start
+        if not args:
+            cpu.ram[0], cpu.ram[1] = 3, 30000
+        start = time.perf_counter()
+        n = cpu.run(cycles)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: prepared {len(program)} instructions in {decode * 1e3:.1f} ms, "
+              f"executed {n} instructions in {elapsed:.3f} sec: {n / elapsed:,.0f} instructions/sec")
+
+
+# fib(18) with recursive calls
+FIB_VM = [("Sys", """
+function Sys.init 0
+push constant 18
+call Main.fib 1
+pop static 0
+call Sys.halt 0
+function Sys.halt 0
+label LOOP
+goto LOOP
+"""), ("Main", """
+function Main.fib 0
+push argument 0
+push constant 2
+lt
+if-goto BASE
+push argument 0
+push constant 1
+sub
+call Main.fib 1
+push argument 0
+push constant 2
+sub
+call Main.fib 1
+add
+return
+label BASE
+push argument 0
+return
+""")]
+
+
+def bench_vm(args: List[str]):
+    """VM interpreter against emulating the translated assembly
+    usage: vm [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    from assembler import StreamingAssembler, assemble_program
+    from CPUEmulator import ENGINES
+    from VMEmulator import VMEmulator
+
+    sources = read_vm(args[0]) if args else FIB_VM
+
+    vm = VMEmulator()
+    for namespace, source in sources:
+        vm.load(io.StringIO(source), namespace)
+    vm.link()
+    vm.start()
+    start = time.perf_counter()
+    steps = vm.run()
+    elapsed = time.perf_counter() - start
+    print(f"vm: {steps} commands in {elapsed:.3f} sec")
+
+    asm = translate_vm(sources, bootstrap=True)
+    program = assemble_program(asm.splitlines())
+    # find the address of Sys.halt
+    labels = StreamingAssembler()
+    for line in asm.splitlines():
+        labels.feed(line)
+    halt = labels.table.symbols["Sys.halt"]
+    for name, engine in ENGINES.items():
+        cpu = engine(program)
+        start = time.perf_counter()
+        while not cpu.halted and cpu.pc != halt:
+            cpu.run(1000)
+        elapsed_cpu = time.perf_counter() - start
+        print(f"{name}: {cpu.cycles} instructions in {elapsed_cpu:.3f} sec "
+              f"({elapsed_cpu / elapsed:.1f}x slower than vm)")
+
+
+def bench_peephole(args: List[str]):
+    """ROM size and cycles with and without the peephole optimizer
+    usage: peephole [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    sources = read_vm(args[0]) if args else FIB_VM
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"plain:     {rom:6d} words, {cycles:10d} cycles")
+    rom_opt, cycles_opt = run_to_halt(translate_vm(sources, bootstrap=True, optimize=True))
+    print(f"optimized: {rom_opt:6d} words, {cycles_opt:10d} cycles "
+          f"({1 - rom_opt / rom:.1%} smaller, {1 - cycles_opt / cycles:.1%} fewer cycles)")
+
+
+def bench_branches(args: List[str]):
+    """ROM size and cycles with and without fused compare-and-branch
+    usage: branches [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    from VMTranslator import CommandFuser
+    sources = read_vm(args[0]) if args else FIB_VM
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"plain: {rom:6d} words, {cycles:10d} cycles")
+    rom_fused, cycles_fused = run_to_halt(translate_vm(sources, bootstrap=True,
+                                                       fuse=CommandFuser.BRANCH_PATTERNS))
+    print(f"fused: {rom_fused:6d} words, {cycles_fused:10d} cycles "
+          f"({1 - rom_fused / rom:.1%} smaller, {1 - cycles_fused / cycles:.1%} fewer cycles)")
+
+
+def bench_fusion(args: List[str]):
+    """hits, ROM size and cycles of each CommandFuser pattern
+    usage: fusion [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    from VMTranslator import Parser, CommandFuser
+
+    sources = read_vm(args[0]) if args else FIB_VM
+    fuser = CommandFuser()
+    for _, source in sources:
+        fuser.fuse(list(Parser(io.StringIO(source)).commands()))
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"{'none':18s} {'':>6s} {rom:6d} words, {cycles:10d} cycles")
+    for name, _, _ in CommandFuser.PATTERNS:
+        rom_fused, cycles_fused = run_to_halt(translate_vm(sources, bootstrap=True, fuse=[name]))
+        print(f"{name:18s} {fuser.counts[name]:6d} {rom_fused:6d} words, {cycles_fused:10d} cycles "
+              f"({1 - rom_fused / rom:.1%} smaller, {1 - cycles_fused / cycles:.1%} fewer cycles)")
+    names = [name for name, _, _ in CommandFuser.PATTERNS]
+    rom_fused, cycles_fused = run_to_halt(translate_vm(sources, bootstrap=True, fuse=names))
+    print(f"{'all':18s} {sum(fuser.counts.values()):6d} {rom_fused:6d} words, {cycles_fused:10d} cycles "
+          f"({1 - rom_fused / rom:.1%} smaller, {1 - cycles_fused / cycles:.1%} fewer cycles)")
+
+
+def bench_inline(args: List[str]):
+    """ROM size and cycles with and without inlining small functions
+    usage: inline [dir or file.vm] [budget]   (the program must reach Sys.halt)
+    """
+    from VMTranslator import Inliner
+
+    sources = read_vm(args[0]) if args else FIB_VM
+    budget = int(args[1]) if len(args) > 1 else Inliner.BUDGET
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"plain:   {rom:6d} words, {cycles:10d} cycles")
+    rom_inline, cycles_inline = run_to_halt(translate_vm(sources, bootstrap=True, inline_budget=budget))
+    print(f"inlined: {rom_inline:6d} words, {cycles_inline:10d} cycles "
+          f"({rom_inline / rom - 1:.1%} larger, {1 - cycles_inline / cycles:.1%} fewer cycles)")
+
+
+def bench_tos(args: List[str]):
+    """ROM size and cycles with and without caching the top of the stack in D
+    usage: tos [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    sources = read_vm(args[0]) if args else FIB_VM
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"plain:  {rom:6d} words, {cycles:10d} cycles")
+    rom_tos, cycles_tos = run_to_halt(translate_vm(sources, bootstrap=True, tos=True))
+    print(f"cached: {rom_tos:6d} words, {cycles_tos:10d} cycles "
+          f"({1 - rom_tos / rom:.1%} smaller, {1 - cycles_tos / cycles:.1%} fewer cycles)")
+
+
+def bench_shared(args: List[str]):
+    """ROM size and cycles with the inlined and the shared call/return sequences
+    usage: shared [dir or file.vm]   (the program must reach Sys.halt)
+    """
+    sources = read_vm(args[0]) if args else FIB_VM
+    rom, cycles = run_to_halt(translate_vm(sources, bootstrap=True))
+    print(f"inlined: {rom:6d} words, {cycles:10d} cycles")
+    rom_shared, cycles_shared = run_to_halt(translate_vm(sources, bootstrap=True, shared=True))
+    print(f"shared:  {rom_shared:6d} words, {cycles_shared:10d} cycles "
+          f"({1 - rom_shared / rom:.1%} smaller, {cycles_shared / cycles - 1:.1%} more cycles)")
+
+
+def bench_translate(args: List[str]):
+    """translation time of a generated multi-file project per number of jobs
+    usage: translate [nfiles] [ncommands per file]
+    """
+    import contextlib
+    import hashlib
+    import os
+    import tempfile
+    from VMTranslator import Main
+
+    nfiles = int(args[0]) if args else 32
+    ncommands = int(args[1]) if len(args) > 1 else 5000
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(nfiles):
+            with open(os.path.join(directory, f"Class{i}.vm"), "w") as f:
+                f.write(generate_vm(ncommands, seed=i).replace("Bench.", f"Class{i}."))
+        output = os.path.join(directory, os.path.basename(directory) + ".asm")
+        jobs = 1
+        while jobs <= max(os.cpu_count() or 1, 4):
+            main = Main(directory, optimize=True, jobs=jobs)
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = measure(main.translate, repeat=1)
+            with open(output, "rb") as f:
+                digest = hashlib.md5(f.read()).hexdigest()
+            print(f"jobs={jobs}: {elapsed:.3f} sec, output {digest}")
+            jobs *= 2
+    print(f"{nfiles} files x {ncommands} commands, {os.cpu_count()} CPUs")
+
+
+# runs a few generations of project9/Lifegame from a glider without the
+# keyboard and Random, then draws shapes with Screen
+LIFEGAME_MAIN = """
+class Main {
+    function void main() {
+        var Lifegame lifegame;
+        var Array fields;
+        var Matrix mtx;
+        var int i;
+        let lifegame = Lifegame.new(16, 32);
+        let fields = lifegame;
+        let mtx = fields[0];
+        do mtx.set(0, 1, 1);
+        do mtx.set(1, 2, 1);
+        do mtx.set(2, 0, 1);
+        do mtx.set(2, 1, 1);
+        do mtx.set(2, 2, 1);
+        do Screen.clearScreen();
+        let i = 0;
+        while (i < 2) {
+            do lifegame.nextGeneration();
+            do lifegame.draw();
+            let i = i + 1;
+        }
+        do lifegame.dispose();
+        do Screen.setColor(true);
+        do Screen.drawRectangle(0, 240, 15, 255);
+        return;
+    }
+}
+"""
+
+
+def jack_paths(args: List[str], directory: str) -> List[str]:
+    """directories to compile: os and the given one, or Lifegame with
+    LIFEGAME_MAIN written to 'directory'
+    """
+    import os
+    if args:
+        return ["os", args[0]]
+    with open(os.path.join(directory, "Main.jack"), "w") as f:
+        f.write(LIFEGAME_MAIN)
+    return ["os", "project9/Lifegame", directory]
+
+
+def run_jack(sources: List[Tuple[str, str]], fuse: Optional[List[str]] = None) -> Tuple[int, int]:
+    """translate compiled Jack programs as small as they fit in ROM and run them
+    """
+    return run_to_halt(translate_vm(sources, bootstrap=True, optimize=True, fuse=fuse,
+                                    shared=True, prune=True),
+                       max_cycles=1000000000)
+
+
+def bench_loops(args: List[str]):
+    """ROM size and cycles of Jack programs with and without rotated while loops
+    usage: loops [dir]   (compiled with os; the program must reach Sys.halt)
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = jack_paths(args, directory)
+        plain = compile_jack(paths, rotate_loops=False)
+        rotated = compile_jack(paths)
+    rom, cycles = run_jack(plain)
+    print(f"plain:   {rom:6d} words, {cycles:10d} cycles")
+    rom_rotated, cycles_rotated = run_jack(rotated)
+    print(f"rotated: {rom_rotated:6d} words, {cycles_rotated:10d} cycles "
+          f"({1 - rom_rotated / rom:.1%} smaller, {1 - cycles_rotated / cycles:.1%} fewer cycles)")
+
+
+def bench_ifs(args: List[str]):
+    """ROM size and cycles of Jack programs with the plain and the compact if statements
+    usage: ifs [dir]   (compiled with os; the program must reach Sys.halt)
+    """
+    import tempfile
+    from VMTranslator import CommandFuser
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = jack_paths(args, directory)
+        plain = compile_jack(paths, compact_ifs=False)
+        compact = compile_jack(paths)
+    # without fusion and with CommandFuser as VMTranslator --optimize does
+    for fuse in [None, [name for name, _, _ in CommandFuser.PATTERNS]]:
+        print("fused:" if fuse else "not fused:")
+        rom, cycles = run_jack(plain, fuse)
+        print(f"  plain:   {rom:6d} words, {cycles:10d} cycles")
+        rom_compact, cycles_compact = run_jack(compact, fuse)
+        print(f"  compact: {rom_compact:6d} words, {cycles_compact:10d} cycles "
+              f"({1 - rom_compact / rom:.1%} smaller, {1 - cycles_compact / cycles:.1%} fewer cycles)")
+
+
+def read_tokens(tokenizer) -> List[Tuple[str, str]]:
+    """all the (token type, token) of a JackTokenizer
+    """
+    tokens = []
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+        tokens.append((tokenizer.token_type(), tokenizer.token()))
+    return tokens
+
+
+def bench_tokenizer(args: List[str]):
+    """tokens per second of JackTokenizer and RegexJackTokenizer
+    usage: tokenizer [dir] [copies]   (copies of the sources in the large input)
+    """
+    import glob
+    import os.path
+    from JackTokenizer import JackTokenizer, RegexJackTokenizer
+
+    path = args[0] if args else "os"
+    copies = int(args[1]) if len(args) > 1 else 50
+    sources = []
+    for filename in sorted(glob.glob(os.path.join(path, "*.jack"))):
+        with open(filename) as f:
+            sources.append(f.read())
+    inputs = [(f"{path}/*.jack", sources), (f"{copies} copies", ["\n".join(sources * copies)])]
+    for name, texts in inputs:
+        ntokens = sum(len(read_tokens(RegexJackTokenizer(io.StringIO(text)))) for text in texts)
+        print(f"{name}: {ntokens} tokens, {sum(map(len, texts))} bytes")
+        for cls in [JackTokenizer, RegexJackTokenizer]:
+            elapsed = measure(lambda: [read_tokens(cls(io.StringIO(text))) for text in texts],
+                              repeat=3)
+            print(f"  {cls.__name__:18s} {ntokens / elapsed:12.0f} tokens/sec")
+        same = all(read_tokens(JackTokenizer(io.StringIO(text))) ==
+                   read_tokens(RegexJackTokenizer(io.StringIO(text))) for text in texts)
+        print(f"  identical tokens: {same}")
+
+
+def read_jack_sources(args: List[str]) -> Tuple[List[str], int]:
+    """read the .jack files in args[0] (os by default) args[1] times (10 by
+    default). returns the sources and the number of tokens in them
+    """
+    import glob
+    import os.path
+    from JackTokenizer import RegexJackTokenizer
+
+    path = args[0] if args else "os"
+    copies = int(args[1]) if len(args) > 1 else 10
+    sources = []
+    for filename in sorted(glob.glob(os.path.join(path, "*.jack"))):
+        with open(filename) as f:
+            sources.append(f.read())
+    sources *= copies
+    ntokens = sum(len(read_tokens(RegexJackTokenizer(io.StringIO(source)))) for source in sources)
+    return sources, ntokens
+
+
+def measure_memory(func: Callable[[], Any]) -> Tuple[Any, int]:
+    """returns the result of func and the bytes allocated and still held by it
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_parse(args: List[str]):
+    """time to tokenize, parse and compile Jack sources
+    usage: parse [dir] [copies]   (copies of the sources compiled per run)
+    """
+    from JackTokenizer import RegexJackTokenizer
+    from ParseTree import ParseTreeBuilder
+    from CompilationEngine import CompilationEngine
+    from VMWriter import VMWriter
+
+    sources, ntokens = read_jack_sources(args)
+
+    def parse():
+        return [ParseTreeBuilder(RegexJackTokenizer(io.StringIO(source))).build() for source in sources]
+
+    def compile_trees():
+        for tree in trees:
+            CompilationEngine(VMWriter(io.StringIO())).compile_class(tree)
+
+    trees = parse()
+    print(f"{len(sources)} files, {ntokens} tokens")
+    for name, func in [("parse", parse), ("compile", compile_trees)]:
+        elapsed = measure(func)
+        print(f"{name:8s} {elapsed:.3f} sec, {ntokens / elapsed:10.0f} tokens/sec")
+
+
+def bench_tree_memory(args: List[str]):
+    """memory held by the parse trees of Jack sources with the node layout
+    before __slots__ and with TreeNode
+    usage: tree-memory [dir] [copies]
+    """
+    from JackTokenizer import RegexJackTokenizer
+    from ParseTree import ParseTreeBuilder
+    from constants import TokenType
+
+    class DictNode:
+        """the former layout: a __dict__, a child list and an addenda dict
+        in every node including the leaves
+        """
+        def __init__(self, token_type, token=""):
+            self.children = []
+            self.token_type = token_type
+            self.token = token
+            self.addenda = {}
+
+    class DictNonTerminalNode(DictNode):
+        def __init__(self, nodetype):
+            super().__init__(TokenType.NONTERMINAL, nodetype.text)
+            self._nodetype = nodetype
+
+    class DictTreeBuilder(ParseTreeBuilder):
+        new_node = DictNonTerminalNode
+
+        def new_leaf(self, token):
+            return DictNode(token.token_type, token.token)
+
+    sources, ntokens = read_jack_sources(args)
+    print(f"{len(sources)} files, {ntokens} tokens")
+    for name, builder in [("dict nodes", DictTreeBuilder), ("slots nodes", ParseTreeBuilder)]:
+        _, size = measure_memory(lambda: [builder(RegexJackTokenizer(io.StringIO(source))).build()
+                                          for source in sources])
+        print(f"{name:12s} {size:10d} bytes, {size / ntokens:6.1f} bytes/token")
+
+
+def bench_flat_tree(args: List[str]):
+    """parse, pickle and compile with the object tree and the flat tree
+    usage: flat-tree [dir] [copies]
+    """
+    import pickle
+    from JackTokenizer import RegexJackTokenizer
+    from ParseTree import ParseTreeBuilder, FlatTreeBuilder
+    from CompilationEngine import CompilationEngine
+    from VMWriter import VMWriter
+
+    sources, ntokens = read_jack_sources(args)
+    print(f"{len(sources)} files, {ntokens} tokens")
+    outputs = []
+    for name, builder, root in [("object", ParseTreeBuilder, lambda tree: tree),
+                                ("flat", FlatTreeBuilder, lambda tree: tree.root())]:
+        def parse():
+            return [builder(RegexJackTokenizer(io.StringIO(source))).build() for source in sources]
+
+        def compile_trees():
+            for tree in trees:
+                CompilationEngine(VMWriter(io.StringIO())).compile_class(root(tree))
+
+        trees, size = measure_memory(parse)
+        data = pickle.dumps(trees, protocol=pickle.HIGHEST_PROTOCOL)
+        out = io.StringIO()
+        for tree in trees:
+            CompilationEngine(VMWriter(out)).compile_class(root(tree))
+        outputs.append(out.getvalue())
+        print(f"{name}:")
+        print(f"  memory   {size / ntokens:10.1f} bytes/token")
+        print(f"  pickle   {len(data) / ntokens:10.1f} bytes/token")
+        print(f"  parse    {measure(parse):10.3f} sec")
+        print(f"  dumps    {measure(lambda: pickle.dumps(trees, protocol=pickle.HIGHEST_PROTOCOL)):10.3f} sec")
+        print(f"  loads    {measure(lambda: pickle.loads(data)):10.3f} sec")
+        print(f"  compile  {measure(compile_trees):10.3f} sec")
+    print(f"identical VM code: {outputs[0] == outputs[1]}")
+
+
+def bench_natives(args: List[str]):
+    """VM interpreter with and without native OS functions
+    usage: natives <dir>   (with os .vm files; the program must reach Sys.halt)
+    """
+    from VMEmulator import VMEmulator, NATIVES
+
+    if not args:
+        print(bench_natives.__doc__)
+        return
+    path = args[0]
+    heaps = []
+    for natives in [(), NATIVES.keys()]:
+        vm = VMEmulator.from_path(path, natives)
+        vm.start()
+        start = time.perf_counter()
+        steps = vm.run()
+        elapsed = time.perf_counter() - start
+        heaps.append(vm.ram[2048:16384])
+        print(f"natives={sorted(natives)}: {steps} commands in {elapsed:.3f} sec")
+    print(f"identical heap: {heaps[0] == heaps[1]}")
+
+    # compare the results against the Jack implementations
+    def init_os() -> VMEmulator:
+        vm = VMEmulator.from_path(path)
+        vm.call("Memory.init")
+        vm.call("Math.init")
+        return vm
+
+    rng = random.Random(0)
+    vm = init_os()
+    for name, nargs in [("Math.multiply", 2), ("Math.divide", 2), ("Math.sqrt", 1)]:
+        ncases = mismatch = endless = 0
+        for _ in range(300):
+            inputs = [rng.randrange(1 << 16) for _ in range(nargs)]
+            ncases += 1
+            try:
+                expected = vm.call(name, inputs, max_steps=100000)
+            except RuntimeError:
+                # the Jack implementation does not terminate e.g. division by 0,
+                # and the native one must raise. the stack may have overflowed
+                # into the heap.
+                vm = init_os()
+                endless += 1
+                try:
+                    NATIVES[name](vm, inputs)
+                    mismatch += 1
+                except RuntimeError:
+                    pass
+                continue
+            mismatch += NATIVES[name](vm, inputs) != expected
+        print(f"{name}: {mismatch} mismatches in {ncases} cases ({endless} not terminating)")
+
+
+BENCHMARKS = {
+    "c-instruction": bench_c_instruction,
+    "emulator": bench_emulator,
+    "vm": bench_vm,
+    "natives": bench_natives,
+    "translate": bench_translate,
+    "peephole": bench_peephole,
+    "shared": bench_shared,
+    "branches": bench_branches,
+    "tos": bench_tos,
+    "fusion": bench_fusion,
+    "inline": bench_inline,
+    "loops": bench_loops,
+    "ifs": bench_ifs,
+    "tokenizer": bench_tokenizer,
+    "parse": bench_parse,
+    "tree-memory": bench_tree_memory,
+    "flat-tree": bench_flat_tree,
+}
+
+
+def main():
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(__doc__)
+        for name, func in BENCHMARKS.items():
+            print(f"{name}: {func.__doc__.strip()}")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
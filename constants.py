@@ -7,26 +7,32 @@ CATEGORY = "category"
 
 
 class StringEnum(enum.Enum):
+    """enum of strings. 'text' is the value as a plain attribute, which is
+    faster to read than Enum.value on hot paths.
+    """
+
+    def __init__(self, value: str):
+        self.text = value
 
     @classmethod
     def from_str(cls, s: str) -> "StringEnum":
-        for e in cls:
-            if e.value == s:
-                return e
-        raise ValueError(f"{s} is not defined in {cls.__name__}")
+        member = cls._value2member_map_.get(s)
+        if member is None:
+            raise ValueError(f"{s} is not defined in {cls.__name__}")
+        return member
 
     @classmethod
     def has_value(cls, value: str) -> bool:
-        return any(value == e.value for e in cls)
+        return value in cls._value2member_map_
 
     def to_str(self):
-        return self.value
+        return self.text
 
     def is_same(self, other):
         if isinstance(other, str):
-            return self.value == other
+            return self.text == other
         else:
-            return self == other
+            return self is other
 
 
 # ----------------------------------------------------------------
@@ -60,17 +66,37 @@ class ArithmeticCommand(StringEnum):
 
     @classmethod
     def from_symbol(cls, symbol: str) -> "ArithmeticCommand":
-        return {
-            "+": ArithmeticCommand.ADD,
-            "-": ArithmeticCommand.SUB,
-            "-": ArithmeticCommand.NEG,
-            "=": ArithmeticCommand.EQ,
-            ">": ArithmeticCommand.GT,
-            "<": ArithmeticCommand.LT,
-            "&": ArithmeticCommand.AND,
-            "|": ArithmeticCommand.OR,
-            "~": ArithmeticCommand.NOT,
-        }[symbol]
+        """unary operator for '-'. see BINARY_OPERATORS for binary ones.
+        """
+        return _ARITHMETIC_SYMBOLS[symbol]
+
+
+_ARITHMETIC_SYMBOLS = {
+    "+": ArithmeticCommand.ADD,
+    "-": ArithmeticCommand.NEG,
+    "=": ArithmeticCommand.EQ,
+    ">": ArithmeticCommand.GT,
+    "<": ArithmeticCommand.LT,
+    "&": ArithmeticCommand.AND,
+    "|": ArithmeticCommand.OR,
+    "~": ArithmeticCommand.NOT,
+}
+
+# Jack binary operator -> VM command
+BINARY_OPERATORS = {
+    "+": ArithmeticCommand.ADD,
+    "-": ArithmeticCommand.SUB,
+    "=": ArithmeticCommand.EQ,
+    ">": ArithmeticCommand.GT,
+    "<": ArithmeticCommand.LT,
+    "&": ArithmeticCommand.AND,
+    "|": ArithmeticCommand.OR,
+}
+# Jack binary operator -> OS function
+BINARY_OPERATOR_CALLS = {
+    "*": "Math.multiply",
+    "/": "Math.divide",
+}
 
 
 # ----------------------------------------------------------------
@@ -134,6 +160,10 @@ class NonTerminalType(StringEnum):
     EXPRESSION_LIST = "expressionList"
 
 
+# keyword -> member
+KEYWORDS = {k.text: k for k in Keyword}
+
+
 class SymbolKind(StringEnum):
 
     UNKNOWN = "unknown"
@@ -0,0 +1,184 @@
+"""a fixed VM program and helpers to run it on the emulators.
+
+Sys.init points THAT to RESULTS and stores the results of the other functions
+there, so the translations can be compared regardless of where the assembler
+allocates static variables.
+"""
+import io
+from typing import List, Tuple
+
+from assembler import StreamingAssembler, assemble_program
+from CPUEmulator import BlockCPUEmulator
+from VMEmulator import VMEmulator
+
+RESULTS = 3000
+NRESULTS = 8
+
+SYS = """
+function Sys.init 0
+push constant 3000
+pop pointer 1
+push constant 4000
+pop pointer 0
+push constant 12
+call Main.fib 1
+pop that 0
+push constant 50
+call Main.loop 1
+pop that 1
+push constant 9
+push constant 4
+call Main.compare 2
+pop that 2
+push constant 3
+push constant 4
+call Main.compare 2
+pop that 3
+call Counter.next 0
+pop temp 0
+call Counter.next 0
+push temp 0
+sub
+pop that 4
+push constant 7
+neg
+pop this 2
+push this 2
+push constant 5
+call Counter.max 2
+pop that 5
+push constant 5
+push constant 7
+neg
+call Counter.max 2
+pop that 6
+push this 2
+pop that 7
+call Sys.halt 0
+pop temp 0
+return
+
+function Sys.halt 0
+label WAIT
+goto WAIT
+"""
+
+MAIN = """
+function Main.fib 0
+push argument 0
+push constant 2
+lt
+not
+if-goto RECURSE
+push argument 0
+return
+label RECURSE
+push argument 0
+push constant 1
+sub
+call Main.fib 1
+push argument 0
+push constant 2
+sub
+call Main.fib 1
+add
+return
+
+function Main.loop 2
+push constant 0
+pop local 0
+push constant 0
+pop local 1
+label LOOP
+push local 0
+push argument 0
+lt
+not
+if-goto END
+push local 1
+push local 0
+add
+pop local 1
+push local 0
+push constant 1
+add
+pop local 0
+goto LOOP
+label END
+push local 1
+return
+
+function Main.compare 0
+push argument 0
+pop static 0
+push argument 1
+pop static 1
+push static 0
+push static 1
+gt
+push static 0
+push static 1
+eq
+or
+return
+
+function Main.unused 0
+push constant 1
+return
+"""
+
+# small functions to inline
+COUNTER = """
+function Counter.next 0
+push static 0
+push constant 1
+add
+pop static 0
+push static 0
+return
+
+function Counter.max 1
+push argument 0
+pop local 0
+push argument 0
+push argument 1
+gt
+if-goto DONE
+push argument 1
+pop local 0
+label DONE
+push local 0
+return
+"""
+
+SOURCES: List[Tuple[str, str]] = [("Counter", COUNTER), ("Main", MAIN), ("Sys", SYS)]
+
+EXPECTED = [144, 1225, 0xFFFF, 0, 1, 5, 5, 0xFFFF & -7]
+
+
+def run_asm(asm: str, engine=BlockCPUEmulator, max_cycles: int = 1000000) -> List[int]:
+    """assemble and run until Sys.halt. returns the RAM.
+    """
+    program = assemble_program(asm.splitlines())
+    labels = StreamingAssembler()
+    for line in asm.splitlines():
+        labels.feed(line)
+    halt = labels.table.symbols["Sys.halt"]
+    cpu = engine(program)
+    while cpu.pc != halt and cpu.cycles < max_cycles:
+        cpu.run(1)
+    assert cpu.pc == halt
+    return cpu.ram
+
+
+def run_vm(sources: List[Tuple[str, str]], max_steps: int = 1000000) -> VMEmulator:
+    """run VM code from Sys.init until Sys.halt
+    """
+    vm = VMEmulator()
+    for namespace, source in sources:
+        vm.load(io.StringIO(source), namespace)
+    vm.link()
+    vm.start()
+    vm.run(max_steps)
+    assert vm.halted
+    return vm
@@ -0,0 +1,146 @@
+import io
+import sys
+
+import pytest
+
+import assembler
+from assembler import (Code, HackProgram, StreamingAssembler, a_instruction, assemble, assemble_parallel,
+                       assemble_program, assemble_stream, compile, preprocess)
+
+# sum of 1..100 into RAM[sum], with forward references to labels and variables
+SUM = """
+// comment
+@i
+M=1
+@sum
+M=0
+(LOOP)
+@i
+D=M
+@100
+D=D-A
+@END
+D;JGT    // forward reference
+@i
+D=M
+@sum
+M=D+M
+@i
+M=M+1
+@LOOP
+0;JMP
+(END)
+@END
+0;JMP
+@SCREEN
+D=A
+@R15
+M=D
+"""
+
+
+def test_stream():
+    lines = SUM.splitlines()
+    fout = io.BytesIO()
+    assert assemble_stream(io.StringIO(SUM), fout) == 24
+    assert fout.getvalue().decode("ascii") == "\n".join(compile(preprocess(lines)))
+
+
+def test_backpatch():
+    asm = StreamingAssembler()
+    codes = [code for code in map(asm.feed, SUM.splitlines()) if code is not None]
+    patches = dict(asm.backpatch())
+    # the variables i and sum are allocated at the end, and @END is before (END)
+    assert sorted(patches) == [0, 2, 4, 8, 10, 12, 14]
+    for address, code in patches.items():
+        codes[address] = code
+    assert codes == [int(code, 2) for code in compile(preprocess(SUM.splitlines()))]
+
+
+def test_program():
+    program = assemble_program(SUM.splitlines())
+    assert list(program.codes()) == compile(preprocess(SUM.splitlines()))
+    assert program == HackProgram.from_codes(program.codes())
+    # big-endian words
+    assert program.to_bytes()[:4] == bytes([0, 16, 0xEF, 0xC8])
+    assert HackProgram.from_bytes(program.to_bytes()) == program
+    assert HackProgram.read_text(io.StringIO(program.to_text() + "\n")) == program
+
+
+def test_load(tmp_path):
+    program = assemble_program(SUM.splitlines())
+    with open(tmp_path / "Sum.bin", "wb") as f:
+        program.write_binary(f)
+    with open(tmp_path / "Sum.hack", "w") as f:
+        program.write_text(f)
+    assert HackProgram.load(str(tmp_path / "Sum.bin")) == program
+    assert HackProgram.load(str(tmp_path / "Sum.hack")) == program
+
+
+@pytest.mark.parametrize("line, code", [
+    ("@21", "0000000000010101"),
+    ("D=A", "1110110000010000"),
+    ("D=D+A", "1110000010010000"),
+    ("D=A+D", "1110000010010000"),
+    ("M=M+1", "1111110111001000"),
+    ("AM=M-1", "1111110010101000"),
+    ("MD=D|M", "1111010101011000"),
+    ("DM=D|M", "1111010101011000"),
+    ("D;JGT", "1110001100000001"),
+    ("0;JMP", "1110101010000111"),
+    # not in canonical form
+    ("D = A", "1110110000010000"),
+    ("AM = M - 1", "1111110010101000"),
+    ("0 ; JMP", "1110101010000111"),
+])
+def test_encoding(line, code):
+    assert compile([line]) == [code]
+
+
+def test_table():
+    # every entry of the table is the word compiled from its parts
+    for expr, word in Code.table().items():
+        dest, _, rest = expr.rpartition("=")
+        comp, _, jump = rest.partition(";")
+        assert word == int(Code.compile(comp, dest, jump), 2), expr
+
+
+def test_a_instruction_range():
+    assert a_instruction(32767) == 32767
+    with pytest.raises(ValueError):
+        a_instruction(32768)
+
+
+def test_assemble(capsys):
+    program = assemble_program(SUM.splitlines())
+    assert assemble(SUM) == program
+    assert assemble(io.StringIO(SUM)) == program
+    assert capsys.readouterr().out == ""
+    assert assemble(SUM, verbose=True) == program
+    assert program.to_text() in capsys.readouterr().out
+
+
+def test_translate_and_assemble(tmp_path):
+    from VMTranslator import Main
+    vm = tmp_path / "Add.vm"
+    vm.write_text("push constant 7\npush constant 8\nadd\n")
+    Main(str(vm), assemble=True).translate()
+    with open(tmp_path / "Add.asm") as f:
+        program = assemble(f)
+    assert HackProgram.load(str(tmp_path / "Add.hack")) == program
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_parallel(jobs):
+    lines = SUM.splitlines()
+    assert assemble_parallel(lines, jobs=jobs, chunk_size=5) == assemble_program(lines)
+
+
+@pytest.mark.parametrize("args", [["-v", "-j", "2"], ["-v", "--stream"], ["-j", "2", "--stream"]])
+def test_rejected_options(tmp_path, monkeypatch, args):
+    source = tmp_path / "Sum.asm"
+    source.write_text(SUM)
+    monkeypatch.setattr(sys, "argv", ["assembler.py", str(source)] + args)
+    with pytest.raises(SystemExit):
+        assembler.main()
+    assert not (tmp_path / "Sum.hack").exists()
@@ -0,0 +1,222 @@
+import glob
+import io
+
+import pytest
+
+from CompilationEngine import CompilationEngine
+from JackTokenizer import JackTokenizer, RegexJackTokenizer
+from constants import BINARY_OPERATORS, ArithmeticCommand, Keyword, TokenType
+from ParseTree import ParseTreeBuilder, FlatTreeBuilder
+from VMEmulator import VMEmulator
+from VMTranslator import CommandFuser, Parser
+from VMWriter import VMWriter
+
+JACK_FILES = sorted(glob.glob("os/*.jack") + glob.glob("project9/*/*.jack"))
+
+
+def read(filename: str) -> str:
+    with open(filename) as f:
+        return f.read()
+
+
+def compile_class(source: str, builder=ParseTreeBuilder, **options) -> str:
+    tree = builder(JackTokenizer(io.StringIO(source))).build()
+    if builder is FlatTreeBuilder:
+        tree = tree.root()
+    out = io.StringIO()
+    CompilationEngine(VMWriter(out), **options).compile_class(tree)
+    return out.getvalue()
+
+
+def read_tokens(tokenizer):
+    tokens = []
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+        if tokenizer.token_type() != TokenType.UNKNOWN:
+            tokens.append((tokenizer.token_type(), tokenizer.token()))
+    return tokens
+
+
+@pytest.mark.parametrize("filename", JACK_FILES)
+def test_tokenizers(filename):
+    source = read(filename)
+    old = [(t.token_type, t.token) for t in JackTokenizer(io.StringIO(source)).tokens()]
+    new = [(t.token_type, t.token) for t in RegexJackTokenizer(io.StringIO(source)).tokens()]
+    assert old == new
+    assert read_tokens(RegexJackTokenizer(io.StringIO(source))) == new
+
+
+def to_xml(tree) -> str:
+    out = io.StringIO()
+    tree.to_xml(out, show_addenda=True)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("filename", JACK_FILES)
+def test_parse_trees(filename):
+    source = read(filename)
+    old = ParseTreeBuilder(JackTokenizer(io.StringIO(source))).build()
+    new = ParseTreeBuilder(RegexJackTokenizer(io.StringIO(source))).build()
+    assert to_xml(new) == to_xml(old)
+    assert not hasattr(new, "__dict__")
+    assert not hasattr(new.children[0], "__dict__")
+    flat = FlatTreeBuilder(RegexJackTokenizer(io.StringIO(source))).build()
+    assert to_xml(flat.root()) == to_xml(old)
+    assert compile_class(source, FlatTreeBuilder) == compile_class(source)
+
+
+def test_token_positions():
+    tokens = RegexJackTokenizer(io.StringIO("class Main {\n  field int x;\n}")).tokens()
+    assert [(t.token, t.line, t.column) for t in tokens] == [
+        ("class", 1, 1), ("Main", 1, 7), ("{", 1, 12), ("field", 2, 3), ("int", 2, 9),
+        ("x", 2, 13), (";", 2, 14), ("}", 3, 1),
+    ]
+
+
+def test_current_line():
+    source = "class Main {\r\n  field int x;\n\n  field int y; }"
+    tokenizer = RegexJackTokenizer(io.StringIO(source))
+    lines = []
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+        lines.append(tokenizer.current_line())
+    assert lines == ["class Main {"] * 3 + ["  field int x;"] * 4 + ["  field int y; }"] * 5
+
+
+def test_parse_error_position():
+    source = "class Main {\n  function void f() { let x 1; }\n}"
+    with pytest.raises(SyntaxError, match="line 2, column 29"):
+        ParseTreeBuilder(RegexJackTokenizer(io.StringIO(source))).build()
+
+
+def test_regex_tokenizer_error():
+    with pytest.raises(SyntaxError, match="line 2"):
+        read_tokens(RegexJackTokenizer(io.StringIO("class Main {\n  # }")))
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("1 + 2 3", "expected an operator"),
+    ("1 ~ 2", "expected an operator"),
+    ("1 +", "unexpected end of input"),
+])
+def test_expression_errors(expression, message):
+    source = f"class Main {{ function int f() {{ return {expression}"
+    with pytest.raises(SyntaxError, match=message):
+        ParseTreeBuilder(RegexJackTokenizer(io.StringIO(source))).build()
+
+
+def test_enum_lookups():
+    for keyword in Keyword:
+        assert Keyword.from_str(keyword.text) is keyword
+        assert Keyword.has_value(keyword.text)
+    assert not Keyword.has_value("goto")
+    with pytest.raises(ValueError):
+        Keyword.from_str("goto")
+    assert ArithmeticCommand.from_symbol("-") is ArithmeticCommand.NEG
+    assert ArithmeticCommand.from_symbol("~") is ArithmeticCommand.NOT
+    assert BINARY_OPERATORS["-"] is ArithmeticCommand.SUB
+    assert "~" not in BINARY_OPERATORS
+    assert "~" not in ParseTreeBuilder.BINARY_OPERATORS
+
+
+def call(source: str, function: str, args=(), **options) -> int:
+    vm = VMEmulator()
+    vm.load(io.StringIO(compile_class(source, **options)), function.split(".")[0])
+    vm.link()
+    return vm.call(function, list(args))
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("1 + 2", 3),
+    ("10 - 3 - 2", 5),
+    ("1 + 2 + 3 + 4", 10),
+    ("(1 + 2) - (3 - 4) & 7", 4),
+    ("x - 1 = 4", 0xFFFF),
+])
+def test_binary_operators(expression, expected):
+    source = f"class Main {{ function int f(int x) {{ return {expression}; }} }}"
+    assert call(source, "Main.f", [5]) == expected
+
+
+def test_identifiers_with_digits():
+    tokens = read_tokens(JackTokenizer(io.StringIO("let x1 = y_2+x1;")))
+    assert tokens == [
+        (TokenType.KEYWORD, "let"), (TokenType.IDENTIFIER, "x1"), (TokenType.SYMBOL, "="),
+        (TokenType.IDENTIFIER, "y_2"), (TokenType.SYMBOL, "+"), (TokenType.IDENTIFIER, "x1"),
+        (TokenType.SYMBOL, ";"),
+    ]
+
+
+LOOP = """
+class Main {
+    function int sum(int n) {
+        var int i, s;
+        let i = 0;
+        let s = 0;
+        while (i < n) {
+            let s = s + i;
+            let i = i + 1;
+        }
+        return s;
+    }
+}
+"""
+
+
+@pytest.mark.parametrize("n, expected", [(0, 0), (1, 0), (10, 45)])
+def test_rotate_loops(n, expected):
+    rotated = compile_class(LOOP)
+    plain = compile_class(LOOP, rotate_loops=False)
+    assert rotated != plain
+    assert "not" not in rotated.split()
+    for rotate_loops in [True, False]:
+        assert call(LOOP, "Main.sum", [n], rotate_loops=rotate_loops) == expected
+
+
+BIT_LOOP = """
+class Main {
+    function int f(int x) {
+        var int n;
+        while (x & 4) {
+            let x = x + 1;
+            let n = n + 1;
+        }
+        return n;
+    }
+}
+"""
+
+
+def test_rotate_loops_non_boolean():
+    # only -1 is true for 'not', so the loop exits on x & 4 = 4
+    assert compile_class(BIT_LOOP) == compile_class(BIT_LOOP, rotate_loops=False)
+    assert call(BIT_LOOP, "Main.f", [4]) == 0
+    assert call(BIT_LOOP, "Main.f", [0]) == 0
+
+
+IFS = """
+class Main {
+    function int f(int x, int y) {
+        var int r;
+        if (x < y) { let r = 1; }
+        if (~(x = y)) { let r = r + 2; } else { let r = r + 4; }
+        if (x & 4) { let r = r + 8; }
+        if (x > y) { return r + 16; }
+        return r;
+    }
+}
+"""
+
+
+@pytest.mark.parametrize("x, y, expected", [(1, 2, 3), (2, 2, 4), (4, 2, 26), (5, 5, 12)])
+def test_compact_ifs(x, y, expected):
+    assert len(compile_class(IFS)) < len(compile_class(IFS, compact_ifs=False))
+    for compact_ifs in [True, False]:
+        assert call(IFS, "Main.f", [x, y], compact_ifs=compact_ifs) == expected
+
+
+def test_compact_ifs_fused():
+    # the comparisons without else are negated, and CommandFuser makes each one branch
+    fuser = CommandFuser(CommandFuser.BRANCH_PATTERNS)
+    fuser.fuse(list(Parser(io.StringIO(compile_class(IFS))).commands()))
+    assert fuser.counts["compare-not-if"] == 2
@@ -0,0 +1,331 @@
+import io
+import itertools
+import math
+
+import pytest
+
+from assembler import assemble
+from benchmark import compile_jack, translate_vm
+from CPUEmulator import ALU, ENGINES, CPUEmulator, _alu
+from VMEmulator import VMEmulator, NATIVES
+from programs import SOURCES, EXPECTED, RESULTS, NRESULTS, run_asm, run_vm
+
+# R2 = R0 * R1 by repeated addition, then halts
+MULT = """
+@R2
+M=0
+(LOOP)
+@R1
+D=M
+@END
+D;JLE
+@R0
+D=M
+@R2
+M=D+M
+@R1
+M=M-1
+@LOOP
+0;JMP
+(END)
+@END
+0;JMP
+"""
+
+# calls a subroutine twice through a return address in R13, which jumps
+# back into the middle of a block
+CALLS = """
+@5
+D=A
+@R0
+M=D
+@RET1
+D=A
+@R13
+M=D
+@DOUBLE
+0;JMP
+(RET1)
+@R0
+M=M+1
+@RET2
+D=A
+@R13
+M=D
+@DOUBLE
+0;JMP
+(RET2)
+@END
+0;JMP
+(DOUBLE)
+@R0
+D=M
+M=D+M
+@R13
+A=M
+0;JMP
+(END)
+@END
+0;JMP
+"""
+
+VALUES = [0, 1, 2, 0x7FFF, 0x8000, 0xFFFF, 1234]
+
+
+@pytest.mark.parametrize("cbits", sorted(ALU.STANDARD))
+def test_alu(cbits):
+    general = _alu(*[(cbits >> i) & 1 for i in range(5, -1, -1)])
+    for x, y in itertools.product(VALUES, VALUES):
+        assert ALU.STANDARD[cbits](x, y) == general(x, y)
+
+
+@pytest.mark.parametrize("x, y", [(0, 5), (6, 7), (0xFFFF, 3), (100, 0)])
+def test_cpu(x, y):
+    cpu = CPUEmulator(assemble(MULT))
+    cpu.ram[0], cpu.ram[1] = x, y
+    cycles = cpu.run(max_cycles=100000)
+    assert cpu.halted
+    assert cpu.ram[2] == (x * y) & 0xFFFF
+    # 12 per iteration, the exit test and the halt loop
+    assert cycles == cpu.cycles == 2 + 12 * y + 4 + 2
+
+
+@pytest.mark.parametrize("source", [MULT, CALLS])
+def test_engines(source):
+    program = assemble(source)
+    cpus = []
+    for engine in ENGINES.values():
+        cpu = engine(program)
+        cpu.ram[0], cpu.ram[1] = 6, 7
+        cpu.run(max_cycles=100000)
+        assert cpu.halted
+        cpus.append(cpu)
+    for cpu in cpus[1:]:
+        assert (cpu.ram, cpu.pc, cpu.a, cpu.d) == (cpus[0].ram, cpus[0].pc, cpus[0].a, cpus[0].d)
+        assert cpu.cycles == cpus[0].cycles
+    assert cpus[0].ram[0] == (6 if source is MULT else 22)
+
+
+@pytest.mark.parametrize("engine", ENGINES.values())
+def test_vm_against_translation(engine):
+    vm = run_vm(SOURCES)
+    ram = run_asm(translate_vm(SOURCES, bootstrap=True), engine)
+    assert vm.ram[RESULTS:RESULTS + NRESULTS] == ram[RESULTS:RESULTS + NRESULTS] == EXPECTED
+
+
+def test_vm_ram_out_of_range():
+    source = """
+function Sys.init 0
+push constant 32767
+pop pointer 1
+push that 5
+return
+"""
+    with pytest.raises(RuntimeError, match=r"push that 5' in Sys.init \(pc 3\)"):
+        run_vm([("Sys", source)])
+
+
+@pytest.mark.parametrize("pushes, command", [
+    (0, "pop temp 0"), (0, "not"), (1, "add"), (0, "if-goto END"),
+])
+def test_vm_stack_underflow(pushes, command):
+    source = "function Sys.init 0\n" + "push constant 1\n" * pushes + f"{command}\nlabel END\ncall Sys.halt 0\n"
+    with pytest.raises(RuntimeError, match=f"stack underflow at '{command}' in Sys.init"):
+        run_vm([("Sys", source)])
+
+
+def test_vm_undefined_function():
+    source = """
+function Sys.init 0
+push constant 1
+call Sys.halt 0
+function Sys.unused 0
+call Missing.f 0
+return
+function Sys.broken 0
+call Missing.g 0
+return
+"""
+    # only reported when called
+    run_vm([("Sys", source)])
+    vm = VMEmulator()
+    vm.load(io.StringIO(source), "Sys")
+    vm.link()
+    with pytest.raises(RuntimeError, match=r"undefined function Missing.g called at 'call Missing.g 0' in Sys.broken"):
+        vm.call("Sys.broken")
+
+
+def test_vm_run_past_end():
+    with pytest.raises(RuntimeError, match="ran past its last command"):
+        run_vm([("Sys", "function Sys.init 0\npush constant 1\npop temp 0\n")])
+
+
+# the Jack compiler numbers the labels per function, so they repeat in a file
+SAME_LABELS = """
+function Sys.init 0
+push constant 3000
+pop pointer 1
+push constant 4
+call Sys.sum 1
+push constant 5
+call Sys.twice 1
+pop that 1
+pop that 0
+call Sys.halt 0
+function Sys.sum 1
+label WHILE_EXP0
+push argument 0
+push constant 0
+eq
+if-goto WHILE_END0
+push local 0
+push argument 0
+add
+pop local 0
+push argument 0
+push constant 1
+sub
+pop argument 0
+goto WHILE_EXP0
+label WHILE_END0
+push local 0
+return
+function Sys.twice 1
+label WHILE_EXP0
+push argument 0
+push constant 0
+eq
+if-goto WHILE_END0
+push local 0
+push constant 2
+add
+pop local 0
+push argument 0
+push constant 1
+sub
+pop argument 0
+goto WHILE_EXP0
+label WHILE_END0
+push local 0
+return
+function Sys.halt 0
+label WHILE_EXP0
+goto WHILE_EXP0
+"""
+
+
+def test_labels_scoped_by_function():
+    sources = [("Sys", SAME_LABELS)]
+    ram = run_asm(translate_vm(sources, bootstrap=True))
+    assert run_vm(sources).ram[3000:3002] == ram[3000:3002] == [10, 10]
+
+
+@pytest.mark.parametrize("x, y", [(0, 5), (123, 45), (-7, 9), (-300, -300), (32767, 2)])
+def test_native_multiply(x, y):
+    assert NATIVES["Math.multiply"](VMEmulator(), [x & 0xFFFF, y & 0xFFFF]) == (x * y) & 0xFFFF
+
+
+@pytest.mark.parametrize("x, y, expected", [
+    (100, 7, 14), (-100, 7, -14), (100, -7, -14), (-100, -7, 14), (6, 7, 0), (10000, 3, 3333),
+    (-32768, -32768, 1),
+    # Math.abs(-32768) is negative
+    (-32768, 1, 0),
+])
+def test_native_divide(x, y, expected):
+    assert NATIVES["Math.divide"](VMEmulator(), [x & 0xFFFF, y & 0xFFFF]) == expected & 0xFFFF
+
+
+@pytest.mark.parametrize("x, y", [(5, 0), (32767, 16384), (100, -32768)])
+def test_native_divide_does_not_terminate(x, y):
+    # os/Math.jack recurses forever on these
+    with pytest.raises(RuntimeError, match="does not terminate"):
+        NATIVES["Math.divide"](VMEmulator(), [x & 0xFFFF, y & 0xFFFF])
+
+
+def test_native_memory():
+    memory = dict(compile_jack(["os"]))["Memory"]
+    vms = []
+    for _ in range(2):
+        vm = VMEmulator()
+        vm.load(io.StringIO(memory), "Memory")
+        vm.link()
+        vm.call("Memory.init")
+        vms.append(vm)
+    jack, native = vms
+
+    def alloc(size):
+        a = jack.call("Memory.alloc", [size])
+        assert NATIVES["Memory.alloc"](native, [size]) == a
+        return a
+
+    def dealloc(a):
+        jack.call("Memory.deAlloc", [a])
+        NATIVES["Memory.deAlloc"](native, [a])
+
+    blocks = [alloc(size) for size in (10, 5, 1, 30)]
+    dealloc(blocks[1])
+    dealloc(blocks[3])
+    alloc(3)
+    alloc(10)
+    assert native.ram[2048:16384] == jack.ram[2048:16384]
+
+    with pytest.raises(RuntimeError, match="corrupted heap"):
+        NATIVES["Memory.deAlloc"](native, [1])
+    # a free list pointing to itself
+    free_list = native.ram[native.static_address("Memory", 1)]
+    native.ram[free_list] = free_list
+    native.ram[free_list + 1] = 0
+    with pytest.raises(RuntimeError, match="cycle"):
+        NATIVES["Memory.alloc"](native, [4])
+
+
+def test_native_sqrt():
+    for x in range(0, 32768, 7):
+        assert NATIVES["Math.sqrt"](VMEmulator(), [x]) == math.isqrt(x)
+
+
+# Math.multiply in VM code for non-negative arguments
+MULTIPLY = """
+function Sys.init 0
+push constant 3000
+pop pointer 1
+push constant 123
+push constant 45
+call Math.multiply 2
+pop that 0
+call Sys.halt 0
+function Sys.halt 0
+label WAIT
+goto WAIT
+function Math.multiply 1
+label LOOP
+push argument 1
+push constant 0
+eq
+if-goto END
+push local 0
+push argument 0
+add
+pop local 0
+push argument 1
+push constant 1
+sub
+pop argument 1
+goto LOOP
+label END
+push local 0
+return
+"""
+
+
+def test_natives():
+    steps = []
+    for natives in [(), ["Math.multiply"]]:
+        vm = VMEmulator(natives)
+        vm.load(io.StringIO(MULTIPLY), "Sys")
+        vm.link()
+        vm.start()
+        steps.append(vm.run())
+        assert vm.halted
+        assert vm.ram[3000] == 123 * 45
+    assert steps[1] < steps[0]
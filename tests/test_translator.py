@@ -0,0 +1,143 @@
+import io
+import os
+
+import pytest
+
+from benchmark import translate_vm
+from VMTranslator import CallGraph, CodeWriter, CommandFuser, Main, Parser
+from programs import SOURCES, EXPECTED, RESULTS, NRESULTS, run_asm
+
+ALL_PATTERNS = [name for name, _, _ in CommandFuser.PATTERNS]
+
+
+def results(asm: str):
+    return run_asm(asm)[RESULTS:RESULTS + NRESULTS]
+
+
+def test_plain():
+    assert results(translate_vm(SOURCES, bootstrap=True)) == EXPECTED
+
+
+@pytest.mark.parametrize("options", [
+    {"optimize": True},
+    {"shared": True},
+    {"optimize": True, "shared": True},
+    {"fuse": CommandFuser.BRANCH_PATTERNS},
+    {"tos": True},
+    {"inline_budget": 40},
+] + [{"fuse": [name]} for name in ALL_PATTERNS] + [
+    {"fuse": ALL_PATTERNS},
+    {"tos": True, "optimize": True, "shared": True, "fuse": ALL_PATTERNS, "inline_budget": 40},
+])
+def test_pass(options):
+    plain = translate_vm(SOURCES, bootstrap=True)
+    asm = translate_vm(SOURCES, bootstrap=True, **options)
+    assert asm != plain
+    assert results(asm) == EXPECTED
+
+
+def test_flush():
+    out = io.StringIO()
+    writer = CodeWriter(out, tos=True)
+    writer.set_namespace("Main")
+    for cmd in Parser(io.StringIO("push constant 7\npush constant 8\nadd\n")).commands():
+        writer.write_command(cmd)
+    assert writer.cached
+    writer.flush()
+    spilled = out.getvalue()
+    assert not writer.cached
+    writer.flush()
+    assert out.getvalue() == spilled
+    ram = run_asm("@256\nD=A\n@SP\nM=D\n" + spilled + "(Sys.halt)\n@Sys.halt\n0;JMP\n")
+    assert (ram[0], ram[256]) == (257, 15)
+
+
+def write_sources(path):
+    for namespace, source in SOURCES:
+        (path / f"{namespace}.vm").write_text(source)
+    return path / f"{path.name}.asm"
+
+
+def test_call_graph():
+    files = [(namespace, list(Parser(io.StringIO(source)).commands())) for namespace, source in SOURCES]
+    assert CallGraph(files).reachable("Sys.init") == {
+        "Sys.init", "Sys.halt", "Main.fib", "Main.loop", "Main.compare", "Counter.next", "Counter.max"}
+
+
+def test_prune(tmp_path):
+    output = write_sources(tmp_path)
+    Main(str(tmp_path)).translate()
+    plain = output.read_text()
+    Main(str(tmp_path), prune=True).translate()
+    pruned = output.read_text()
+    assert "(Main.unused)" in plain
+    assert "(Main.unused)" not in pruned
+    assert results(pruned) == EXPECTED
+
+
+def test_inline_segment_labels():
+    # labels may be named like segments
+    sources = [(namespace, source.replace("DONE", "local")) for namespace, source in SOURCES]
+    plain = translate_vm(sources, bootstrap=True)
+    asm = translate_vm(sources, bootstrap=True, inline_budget=40)
+    assert asm != plain
+    assert results(asm) == EXPECTED
+
+
+def test_inline(tmp_path):
+    output = write_sources(tmp_path)
+    Main(str(tmp_path), inline=True, prune=True).translate()
+    asm = output.read_text()
+    # inlined into Sys.init, and then unreachable
+    assert "(Counter.max)" not in asm
+    assert results(asm) == EXPECTED
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"optimize": True, "tos": True},
+    {"inline": True, "prune": True},
+])
+def test_cache(tmp_path, options):
+    output = write_sources(tmp_path)
+    outputs = []
+    for _ in range(2):
+        translator = Main(str(tmp_path), cache=True, **options)
+        translator.translate()
+        outputs.append(output.read_text())
+    assert translator.cache_hits == len(SOURCES)
+    assert os.listdir(translator.cache_directory)
+    assert outputs[0] == outputs[1]
+    assert results(outputs[1]) == EXPECTED
+
+    # only the edited file is translated again. with inlining the key is the
+    # commands, which a comment does not change
+    (tmp_path / "Main.vm").write_text(dict(SOURCES)["Main"] + "\n// edited\n")
+    translator = Main(str(tmp_path), cache=True, **options)
+    translator.translate()
+    misses = 0 if options.get("inline") else 1
+    assert (translator.cache_hits, translator.cache_misses) == (len(SOURCES) - misses, misses)
+    assert output.read_text() == outputs[0]
+
+
+def test_cache_options(tmp_path):
+    write_sources(tmp_path)
+    option_sets = [{}, {"optimize": True}, {"tos": True}]
+    for options in option_sets:
+        Main(str(tmp_path), cache=True, **options).translate()
+    # each set of options keeps its own entries
+    for options in option_sets:
+        translator = Main(str(tmp_path), cache=True, **options)
+        translator.translate()
+        assert (translator.cache_hits, translator.cache_misses) == (len(SOURCES), 0)
+    for namespace, _ in SOURCES:
+        assert len(os.listdir(os.path.join(translator.cache_directory, namespace))) == len(option_sets)
+
+
+@pytest.mark.parametrize("options", [{}, {"optimize": True, "tos": True, "shared": True}])
+def test_jobs(tmp_path, options):
+    output = write_sources(tmp_path)
+    Main(str(tmp_path), **options).translate()
+    serial = output.read_text()
+    Main(str(tmp_path), jobs=2, **options).translate()
+    assert output.read_text() == serial